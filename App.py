@@ -1,146 +1,559 @@
-from flask import Flask, request, jsonify, current_app, render_template
+from flask import Flask, Blueprint, request, jsonify, current_app, render_template, Response, stream_with_context, make_response
 from datetime import datetime, timedelta
 import os
-from pymongo import MongoClient
+import logging
+import sqlite3
+from werkzeug.local import LocalProxy
 from pymongo.errors import ConnectionFailure, OperationFailure
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
 from functools import wraps
+import click
 from flask_cors import CORS
+from json_provider import MongoJSONProvider
+from indexes import index_drift, find_collection_scans
+from timers import serialize_timer, UNLOGGED_TIMER_GRACE_SECONDS
+from time_entries import ROLLUP_GROUPS, DAY_FORMAT
+from revisions import TASKS_SCOPE, folder_scope, listing_etag
+from database import Database, CircuitBreaker
+from events import EventBroker
+from jobs import JobRunner, STALE_JOB_SECONDS
+from search import TaskPrefixIndex, tokenize
+from scheduler import NextUpIndex, parse_schedule, describe, next_up_from_store
+from quadrants import get_eisenhower_quadrant
+from metrics import configure_metrics, register_cache_metrics
+from cache import ReadThroughCache
+from storage.base import project
+from logs import configure_logging, annotate, annotate_detail, parse_sample_rates, log_event, DEFAULT_DEBUG_SAMPLE_RATE
 
-app = Flask(__name__)
-
-# Enable CORS
-cors = CORS(app)    
-
-# MongoDB Atlas connection string
-mongo_uri = os.environ.get('MONGO_URI')
-
-# Flag to indicate if the database is available
-db_available = False
-try:
-    # Connect to MongoDB Atlas
-    client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
-    # Ping the server to check the connection
-    client.admin.command('ping')
-    print("Connected successfully to MongoDB!")
-    db_available = True
-except ConnectionFailure as e:
-    print(f"Failed to connect to MongoDB. Error: {e}")
-    print("Please check your connection string, network, and MongoDB Atlas settings.")
-except Exception as e:
-    print(f"An unexpected error occurred while connecting to MongoDB: {e}")
-
-# Only set up database and collections if connection was successful
-if db_available:
-    db = client['Time2Learn']
-    tasks_collection = db['tasks']
-    folders_collection = db['folders']
-    timers_collection = db['timers']
+# Folder names for the four Eisenhower quadrants, see get_eisenhower_quadrant
+QUADRANTS = (
+    "urgent_important",
+    "not_urgent_important",
+    "urgent_not_important",
+    "not_urgent_not_important",
+)
+
+# Tasks deleted per batch by the delete-folder job; each batch is a few
+# short writes, so requests keep interleaving with a large cascade
+FOLDER_DELETE_BATCH_SIZE = 500
+
+# Unrecorded time entries of stopped timers recorded per health check
+UNLOGGED_TIMERS_PER_CHECK = 100
+
+# Seconds of silence after which an /events stream sends a keep-alive comment
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# PyMongo client settings that can be tuned per deployment, by config key;
+# each is read from the environment variable of the same name when set
+MONGO_CLIENT_SETTINGS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+}
+
+# Every route and CLI command lives on this blueprint; create_app() registers it
+api = Blueprint('api', __name__, cli_group=None)
+
+def create_app(config=None):
+    """Build the app without touching the database.
+
+    The storage backend is connected by a background health monitor,
+    started by the first request, so the app serves (with 503s from
+    handle_db_error) while it is down and recovers on its own once it
+    comes back.
+    """
+    app = Flask(__name__)
+    # Serializes ObjectId and datetime natively, see json_provider.py
+    app.json = MongoJSONProvider(app)
+
+    # Storage backend: mongo (default), sqlite or memory, see storage/__init__.py
+    app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'mongo')
+    # MongoDB Atlas connection string
+    app.config['MONGO_URI'] = os.environ.get('MONGO_URI')
+    # Database file used by the sqlite backend
+    app.config['SQLITE_PATH'] = os.environ.get('SQLITE_PATH', 'time2learn.db')
+    # Seconds between background pings of the database
+    app.config['DB_CHECK_INTERVAL'] = float(os.environ.get('DB_CHECK_INTERVAL', 10))
+    # Consecutive connection failures that open the circuit breaker, and
+    # seconds it stays open before letting a trial request through
+    app.config['DB_BREAKER_THRESHOLD'] = int(os.environ.get('DB_BREAKER_THRESHOLD', 5))
+    app.config['DB_BREAKER_RESET_SECONDS'] = float(os.environ.get('DB_BREAKER_RESET_SECONDS', 30))
+    for key in MONGO_CLIENT_SETTINGS:
+        if os.environ.get(key):
+            app.config[key] = int(os.environ[key])
+    # Read preference for the GET routes' queries, e.g. secondaryPreferred
+    # to spread reads over replicas; writes always go to the primary
+    app.config['MONGO_GET_READ_PREFERENCE'] = os.environ.get('MONGO_GET_READ_PREFERENCE', 'primary')
+    # Level of the app's structured logs, see logs.py
+    app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    # Fraction of requests whose debug detail is logged, overall and per
+    # route rule, e.g. LOG_DEBUG_SAMPLE_RATES="/task/<task_id>/move=0.5"
+    app.config['LOG_DEBUG_SAMPLE_RATE'] = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', DEFAULT_DEBUG_SAMPLE_RATE))
+    app.config['LOG_DEBUG_SAMPLE_RATES'] = parse_sample_rates(os.environ.get('LOG_DEBUG_SAMPLE_RATES'))
+    # Send a Server-Timing header splitting each response's time into
+    # database and app time, for debugging from the browser
+    app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+    # Threads per process running background jobs, see jobs.py, and seconds
+    # without progress after which an unfinished job is run again
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+    app.config['JOB_STALE_SECONDS'] = float(os.environ.get('JOB_STALE_SECONDS', STALE_JOB_SECONDS))
+    # Tasks and folders cached per process for lookups by ID, and how long
+    # an entry is trusted; writes in other workers show up after at most
+    # CACHE_TTL_SECONDS, see cache.py
+    app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+    app.config['CACHE_TTL_SECONDS'] = float(os.environ.get('CACHE_TTL_SECONDS', 5))
+    # Serve GET /next from an in-process heap of every task; with 0 it is
+    # always answered by indexed database queries, see scheduler.py
+    app.config['NEXT_UP_INDEX'] = os.environ.get('NEXT_UP_INDEX', '1') == '1'
+    if config:
+        app.config.update(config)
+
+    configure_logging(app)
+    # After logging, so its per-request database totals reach the log event
+    command_listener = configure_metrics(app)
+
+    # Enable CORS
+    CORS(app)
+
+    storage_options = {}
+    if app.config['STORAGE_BACKEND'] == 'mongo':
+        storage_options = {
+            option: app.config[key]
+            for key, option in MONGO_CLIENT_SETTINGS.items()
+            if app.config.get(key) is not None
+        }
+        storage_options['get_read_preference'] = app.config['MONGO_GET_READ_PREFERENCE']
+        storage_options['event_listeners'] = [command_listener]
+
+    database = Database(
+        app.config['STORAGE_BACKEND'],
+        mongo_uri=app.config['MONGO_URI'],
+        sqlite_path=app.config['SQLITE_PATH'],
+        quadrants=QUADRANTS,
+        check_interval=app.config['DB_CHECK_INTERVAL'],
+        breaker=CircuitBreaker(app.config['DB_BREAKER_THRESHOLD'], app.config['DB_BREAKER_RESET_SECONDS']),
+        storage_options=storage_options,
+        logger=app.logger,
+    )
+    app.extensions['database'] = database
+    # Fans task and timer changes out to every /events stream in this process
+    app.extensions['event_broker'] = EventBroker(app.json.dumps)
+    job_runner = JobRunner(
+        app,
+        {'delete-folder': delete_folder_tasks},
+        max_workers=app.config['JOB_WORKERS'],
+        stale_after=app.config['JOB_STALE_SECONDS'],
+    )
+    app.extensions['jobs'] = job_runner
+    # Autocomplete for GET /task/search, loaded on first use
+    app.extensions['task_prefix_index'] = TaskPrefixIndex()
+    # Ranking for GET /next, loaded in the background on first use
+    app.extensions['next_up_index'] = NextUpIndex()
+    caches = [
+        ReadThroughCache(name, app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_TTL_SECONDS'])
+        for name in ('tasks', 'folders')
+    ]
+    app.extensions['task_cache'], app.extensions['folder_cache'] = caches
+    register_cache_metrics(app.extensions['metrics'], caches)
+    # Picks up jobs whose process died, including after an outage
+    database.on_healthy.append(job_runner.resume_stale)
+    # Records time entries that failed stop requests left behind
+    database.on_healthy.append(lambda: record_unlogged_timers(app.logger, database.storage))
+
+    app.register_blueprint(api)
+    # Not started here: a server that builds the app before forking its
+    # workers (Gunicorn's preload_app) must not connect or run jobs in the
+    # parent, so the monitor starts with the first request, or earlier
+    # from the server's worker hooks, see gunicorn.conf.py
+    app.before_request(database.ensure_monitor)
+    return app
+
+def get_database():
+    return current_app.extensions['database']
+
+# The current app's stores and helpers; only usable once handle_db_error
+# has let the request through, since they are None until the first connect
+storage = LocalProxy(lambda: get_database().storage)
+# Same stores for GET routes, honouring MONGO_GET_READ_PREFERENCE
+read_storage = LocalProxy(lambda: get_database().read_storage)
+change_log = LocalProxy(lambda: get_database().change_log)
+quadrant_folders = LocalProxy(lambda: get_database().quadrant_folders)
+event_broker = LocalProxy(lambda: current_app.extensions['event_broker'])
+job_runner = LocalProxy(lambda: current_app.extensions['jobs'])
+task_prefix_index = LocalProxy(lambda: current_app.extensions['task_prefix_index'])
+next_up_index = LocalProxy(lambda: current_app.extensions['next_up_index'])
+# Read-through caches by ObjectId; every route that writes a cached
+# document invalidates it after the write
+task_cache = LocalProxy(lambda: current_app.extensions['task_cache'])
+folder_cache = LocalProxy(lambda: current_app.extensions['folder_cache'])
 
 #  Decorator that's designed to handle database-related errors in application
 def handle_db_error(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        if not db_available:
+        database = get_database()
+        # Fails fast while the database is down or the circuit is open
+        if not database.allow_request():
             return jsonify({'error': 'Database is currently unavailable'}), 503
         try:
-            return func(*args, **kwargs)
-        except ConnectionFailure:
+            response = func(*args, **kwargs)
+        except ConnectionFailure as e:
+            database.record_failure()
+            annotate(error=str(e))
             return jsonify({'error': 'Database connection error'}), 500
-        except OperationFailure as e:
+        except (OperationFailure, sqlite3.Error) as e:
+            annotate(error=str(e))
             return jsonify({'error': f'Database operation failed: {str(e)}'}), 500
         except InvalidId:
             return jsonify({'error': 'Invalid ID format'}), 400
         except Exception as e:
+            annotate(error=str(e))
             return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
+        database.record_success()
+        return response
     return wrapper
 
-def get_eisenhower_quadrant(priority):
-    if priority['urgent'] and priority['important']:
-        return "urgent_important"
-    elif not priority['urgent'] and priority['important']:
-        return "not_urgent_important"
-    elif priority['urgent'] and not priority['important']:
-        return "urgent_not_important"
+# Page size used when a client asks for a page without giving a limit,
+# and the hard upper bound on any single page
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Task fields a client may ask for with ?fields=; _id is always returned
+TASK_FIELDS = ('name', 'folder_id', 'priority', 'created_at', 'due_at', 'estimate', 'rev')
+
+def parse_fields(value):
+    """Turn a comma separated ``fields`` parameter into a list of fields.
+
+    The stores push it down as a projection. Returns None, meaning every
+    field, when the parameter is absent.
+    """
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in TASK_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(TASK_FIELDS)}")
+    return fields
+
+def parse_page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, MAX_PAGE_SIZE)
+
+def list_tasks_response(task_store, folder_id=None):
+    """Build the response for a task listing route from ``task_store``.
+
+    Supports three modes, selected by query parameters:
+    - ``?stream=ndjson`` / ``?stream=array`` streams every matching task
+      straight off the database cursor, one batch at a time
+    - ``?limit=N&after=<cursor>`` returns one keyset page ordered by ``_id``
+      together with the ``next_cursor`` to pass as ``after`` for the next page
+    - no parameters returns the plain JSON array for existing clients
+    """
+    stream = request.args.get('stream')
+    limit_arg = request.args.get('limit')
+    after = request.args.get('after')
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    after = ObjectId(after) if after else None
+
+    if stream:
+        if stream not in ('ndjson', 'array'):
+            return jsonify({'error': "stream must be 'ndjson' or 'array'"}), 400
+        return stream_tasks(task_store.find(folder_id, after=after, fields=fields), stream)
+
+    if limit_arg is None and after is None:
+        return jsonify(list(task_store.find(folder_id, fields=fields)))
+
+    try:
+        limit = parse_page_size(limit_arg)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Fetch one extra document to know whether another page exists
+    tasks = list(task_store.find(folder_id, after=after, limit=limit + 1, fields=fields))
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = tasks[-1]['_id']
+    return jsonify({'tasks': tasks, 'next_cursor': next_cursor})
+
+def conditional_listing(scope, build_response):
+    """Answer a listing with 304 when the client's ETag is still current.
+
+    Only the revision counter is read for a 304; the tasks collection is
+    queried through ``build_response`` only when the listing has changed.
+    ``build_response`` must read from the primary, like the counter: a
+    body from a lagging secondary under the primary's newer counter would
+    be served as current, with 304s, until the next write.
+    """
+    # Read the counter before the listing: writes bump it after changing
+    # the tasks, so a write in between errs towards refetching
+    etag = listing_etag(scope, storage.revisions.current(scope), request.query_string)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
     else:
-        return "not_urgent_not_important"
+        response = make_response(build_response())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    # Let browsers keep the listing but revalidate it on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def stream_tasks(tasks, fmt):
+    dumps = current_app.json.dumps
+
+    # Errors raised once streaming has started can't be turned into a
+    # status code by handle_db_error, so they end the stream early instead
+    def generate():
+        try:
+            if fmt == 'ndjson':
+                for task in tasks:
+                    yield dumps(task) + '\n'
+            else:
+                yield '['
+                first = True
+                for task in tasks:
+                    yield ('' if first else ',') + dumps(task)
+                    first = False
+                yield ']'
+        except Exception as e:
+            # The request's summary event has already been logged by now
+            log_event(current_app.logger, 'stream_failed', logging.ERROR, error=str(e))
+        finally:
+            tasks.close()
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
 
+# Tasks per quadrant in GET /matrix and in the page's first paint when
+# the client doesn't ask for a different number
+MATRIX_DEFAULT_LIMIT = 100
 
-@app.route('/')
+def build_matrix(limit):
+    """The tasks of the four quadrant folders, ``limit`` per quadrant, with
+    each quadrant's total and the sync token to poll changes from."""
+    # Taken before the tasks are read, so nothing written in between is
+    # missed; changes seen twice are simply applied again. The tasks come
+    # from the primary like the token: a secondary's older copy would skip
+    # the changes it lacks for good once the client polls from the token.
+    token = change_log.current_token()
+    folder_ids = {name: quadrant_folders.folder_id(name) for name in QUADRANTS}
+    groups = storage.tasks.group_by_folder(list(folder_ids.values()), limit)
+    quadrants = {}
+    for name, folder_id in folder_ids.items():
+        group = groups.get(folder_id, {'count': 0, 'tasks': []})
+        quadrants[name] = {'folder_id': folder_id, 'count': group['count'], 'tasks': group['tasks']}
+    return {'quadrants': quadrants, 'limit': limit, 'next': token}
+
+@api.route('/')
 def index():
-    return render_template('index.html')
+    # The page carries the matrix so its first paint needs no request; if
+    # the database can't provide it the client fetches GET /matrix itself
+    matrix = None
+    database = get_database()
+    if database.allow_request():
+        try:
+            matrix = build_matrix(MATRIX_DEFAULT_LIMIT)
+        except ConnectionFailure as e:
+            database.record_failure()
+            annotate(error=str(e))
+        except Exception as e:
+            annotate(error=str(e))
+        else:
+            database.record_success()
+    return render_template('index.html', matrix=matrix)
 
+@api.route('/matrix', methods=['GET'])
+@handle_db_error
+def get_matrix():
+    """Tasks grouped by Eisenhower quadrant, at most ``limit`` per quadrant."""
+    try:
+        limit = parse_page_size(request.args.get('limit', str(MATRIX_DEFAULT_LIMIT)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return conditional_listing(TASKS_SCOPE, lambda: jsonify(build_matrix(limit)))
 
-@app.route('/task', methods=['POST'])
+
+@api.route('/task', methods=['POST'])
 @handle_db_error
 def create_task():
     data = request.json
+    if not isinstance(data.get('name'), str):
+        return jsonify({'error': "'name' must be a string"}), 400
     priority = data['priority']
+    try:
+        schedule = parse_schedule(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     quadrant = get_eisenhower_quadrant(priority)
-    
-    # Check if the quadrant folder exists, if not create it
-    folder = folders_collection.find_one({'name': quadrant})
-    if not folder:
-        folder_result = folders_collection.insert_one({'name': quadrant, 'created_at': datetime.now()})
-        folder_id = str(folder_result.inserted_id)
-    else:
-        folder_id = str(folder['_id'])
-    
+    folder_id = quadrant_folders.folder_id(quadrant)
+
     task = {
         'name': data['name'],
         'folder_id': folder_id,
         'priority': priority,
-        'created_at': datetime.now()
+        'created_at': datetime.now(),
+        **schedule,
+        'rev': change_log.next_revisions()
     }
-    result = tasks_collection.insert_one(task)
-    task['_id'] = str(result.inserted_id)
-    task['created_at'] = task['created_at'].isoformat()
+    storage.tasks.insert(task)
+    storage.revisions.bump(TASKS_SCOPE, folder_scope(folder_id))
+    task_prefix_index.add(task)
+    next_up_index.add(task)
+    event_broker.publish('task-created', task)
     return jsonify(task), 201
 
 
-@app.route('/task/<task_id>', methods=['GET'])
+@api.route('/task/<task_id>', methods=['GET'])
 @handle_db_error
 def get_task(task_id):
-    task = tasks_collection.find_one({'_id': ObjectId(task_id)})
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    task = project(task_cache.get(ObjectId(task_id), read_storage.tasks.get), fields)
     if task:
-        task['_id'] = str(task['_id'])
-        task['created_at'] = task['created_at'].isoformat()
         return jsonify(task)
     return jsonify({'error': 'Task not found'}), 404
 
-@app.route('/task', methods=['GET'])
+@api.route('/task', methods=['GET'])
 @handle_db_error
 def get_all_tasks():
-    tasks = list(tasks_collection.find())
-    for task in tasks:
-        task['_id'] = str(task['_id'])
-        task['created_at'] = task['created_at'].isoformat()
-    return jsonify(tasks)
+    return conditional_listing(TASKS_SCOPE, lambda: list_tasks_response(storage.tasks))
+
+
+
+@api.route('/task/changes', methods=['GET'])
+@handle_db_error
+def get_task_changes():
+    """Tasks created, moved or deleted since the client's sync token.
+
+    Without ``since`` the response only carries the current token: the
+    client loads the full list from GET /task and syncs from there.
+    """
+    since = request.args.get('since')
+    if not since:
+        return jsonify({'reset': True, 'next': change_log.current_token()})
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        changes = change_log.changes(since, limit)
+    except ValueError:
+        return jsonify({'error': "'since' must be a token from a previous sync and 'limit' a positive integer"}), 400
+    return jsonify(changes)
+
+# Results per search when the client gives no limit, and the most it may ask for
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
 
+@api.route('/task/search', methods=['GET'])
+@handle_db_error
+def search_tasks():
+    """Tasks whose name matches ``q``, best matches first.
+
+    ``mode=words`` (the default) matches whole words through the text
+    index. ``mode=prefix`` is for autocomplete: the last word is a prefix,
+    matched in this process's TaskPrefixIndex, and each result carries
+    only ``_id``, ``name`` and ``folder_id``. ``quadrant`` or ``folder_id``
+    limits the search to one folder.
+    """
+    query = request.args.get('q', '').strip()
+    mode = request.args.get('mode', 'words')
+    quadrant = request.args.get('quadrant')
+    if not query:
+        return jsonify({'error': "'q' is required"}), 400
+    if mode not in ('words', 'prefix'):
+        return jsonify({'error': "mode must be 'words' or 'prefix'"}), 400
+    if quadrant is not None and quadrant not in QUADRANTS:
+        return jsonify({'error': f"quadrant must be one of: {', '.join(QUADRANTS)}"}), 400
+    limit_arg = request.args.get('limit')
+    try:
+        limit = SEARCH_DEFAULT_LIMIT if limit_arg is None else min(parse_page_size(limit_arg), SEARCH_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    folder_id = quadrant_folders.folder_id(quadrant) if quadrant else request.args.get('folder_id')
+
+    if mode == 'prefix':
+        task_prefix_index.sync(change_log, storage.tasks)
+        tasks = task_prefix_index.search(query, folder_id, limit)
+    else:
+        tasks = read_storage.tasks.search(tokenize(query), folder_id, limit)
+    annotate(search_mode=mode, results=len(tasks))
+    return jsonify({'tasks': tasks})
+
+# Tasks returned by GET /next unless the client asks for a different
+# number, and the most it may ask for
+NEXT_DEFAULT_COUNT = 10
+NEXT_MAX_COUNT = 100
 
+@api.route('/next', methods=['GET'])
+@handle_db_error
+def next_tasks():
+    """The ``n`` tasks to work on next, most pressing first.
+
+    Ranked by ``start_by`` (see scheduler.py) from this process's
+    NextUpIndex; until that has loaded, or with NEXT_UP_INDEX off, from
+    indexed queries on the database.
+    """
+    try:
+        n = int(request.args.get('n', NEXT_DEFAULT_COUNT))
+    except ValueError:
+        return jsonify({'error': 'n must be an integer'}), 400
+    if n < 1:
+        return jsonify({'error': 'n must be a positive integer'}), 400
+    n = min(n, NEXT_MAX_COUNT)
+
+    # The index may load on a thread of its own, which can't resolve the
+    # request-bound proxies
+    database = get_database()
+    if current_app.config['NEXT_UP_INDEX'] and next_up_index.sync(database.change_log, database.storage.tasks, block=False):
+        source = 'index'
+        ranked = next_up_index.top(n)
+    else:
+        source = 'database'
+        ranked = next_up_from_store(read_storage.tasks, n)
+    now = datetime.now()
+    annotate(next_source=source, results=len(ranked))
+    return jsonify({'tasks': [describe(task, key, now) for task, key in ranked]})
 
-@app.route('/task/<task_id>', methods=['DELETE'])
+@api.route('/task/<task_id>', methods=['DELETE'])
 @handle_db_error
 def delete_task(task_id):
-    current_app.logger.info(f"delete_task function called for task_id: {task_id}")
+    annotate(task_id=task_id)
     try:
-        result = tasks_collection.delete_one({'_id': ObjectId(task_id)})
-        if result.deleted_count == 0:
-            current_app.logger.warning(f"Task not found: {task_id}")
+        task = storage.tasks.delete(ObjectId(task_id))
+        if not task:
             return jsonify({'error': 'Task not found'}), 404
-        
+        change_log.record_task_deletes([task])
+        storage.revisions.bump(TASKS_SCOPE, folder_scope(task.get('folder_id')))
+        task_cache.invalidate(task['_id'])
+        task_prefix_index.remove(task['_id'])
+        next_up_index.remove(task['_id'])
+        event_broker.publish('task-deleted', task)
+
         # Also delete any associated timers
-        timers_collection.delete_many({'task_id': task_id})
-        
-        current_app.logger.info(f"Task {task_id} deleted successfully")
+        storage.timers.delete_for_tasks([task_id])
         return jsonify({'message': 'Task deleted successfully'}), 200
     except Exception as e:
-        current_app.logger.error(f"Error in delete_task: {str(e)}")
+        annotate(error=str(e))
+        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
   
 
 
-@app.route('/folder', methods=['POST'])
+@api.route('/folder', methods=['POST'])
 @handle_db_error
 def create_folder():
     data = request.json
@@ -148,272 +561,546 @@ def create_folder():
         'name': data['name'],
         'created_at': datetime.now()
     }
-    result = folders_collection.insert_one(folder)
-    folder['_id'] = str(result.inserted_id)
-    folder['created_at'] = folder['created_at'].isoformat()
+    storage.folders.insert(folder)
     return jsonify(folder), 201
 
-@app.route('/folder/<folder_id>', methods=['DELETE'])
+@api.route('/folder/<folder_id>', methods=['DELETE'])
 @handle_db_error
 def delete_folder(folder_id):
-    current_app.logger.info(f"delete_folder function called for folder_id: {folder_id}")
+    """Delete a folder now and its tasks in a background job.
+
+    Answers 202 with the job's ID; GET /jobs/<job_id> reports how many
+    tasks are gone so far.
+    """
+    annotate(folder_id=folder_id)
     try:
-        # First, delete all tasks in the folder
-        current_app.logger.info(f"Deleted {tasks_collection.deleted_count} tasks from folder {folder_id}")
-        
-        # Then delete the folder
-        folder_result = folders_collection.delete_one({'_id': ObjectId(folder_id)})
-        if folder_result.deleted_count == 0:
-            current_app.logger.warning(f"Folder not found: {folder_id}")
+        if not storage.folders.get(ObjectId(folder_id)):
             return jsonify({'error': 'Folder not found'}), 404
-        
-        current_app.logger.info(f"Folder {folder_id} deleted successfully")
-        return jsonify({'message': 'Folder and all its tasks deleted successfully'}), 200
+        # Recorded before the folder goes, so its tasks are deleted in the
+        # end even if this process dies before starting the job
+        job = job_runner.create('delete-folder', folder_id=folder_id)
+        annotate(job_id=str(job['_id']))
+        if not remove_folder(folder_id):
+            # Deleted meanwhile by another request, whose job takes the tasks
+            job_runner.cancel(job, 'Folder was already deleted')
+            return jsonify({'error': 'Folder not found'}), 404
+        job_runner.start(job)
+        response = jsonify({'message': 'Folder deleted; its tasks are being deleted', 'job_id': job['_id']})
+        response.headers['Location'] = f"/jobs/{job['_id']}"
+        return response, 202
     except Exception as e:
-        current_app.logger.error(f"Error in delete_folder: {str(e)}")
+        annotate(error=str(e))
         return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
-@app.route('/folder/<folder_id>/tasks', methods=['GET'])
+def remove_folder(folder_id):
+    """Delete a folder, leaving its tasks; returns False if it was gone."""
+    if not storage.folders.delete(ObjectId(folder_id)):
+        return False
+    folder_cache.invalidate(ObjectId(folder_id))
+    change_log.record_folder_delete(folder_id)
+    # GET /matrix is tagged with the tasks scope, and a deleted quadrant
+    # folder changes its folder_id even with no tasks in it
+    storage.revisions.bump(TASKS_SCOPE, folder_scope(folder_id))
+    if quadrant_folders.invalidate(folder_id):
+        # Recreated on next use
+        annotate(quadrant_folder=True)
+    return True
+
+def delete_folder_tasks(job, progress):
+    """Job behind DELETE /folder: delete the folder's tasks and their
+    timers, FOLDER_DELETE_BATCH_SIZE tasks at a time.
+
+    Each batch is taken from whatever tasks are left, so a resumed job
+    carries on where the last run stopped.
+    """
+    folder_id = job['params']['folder_id']
+    # A job resumed after its request died may find the folder still there
+    remove_folder(folder_id)
+    deleted = job['progress'].get('tasks_deleted', 0)
+    progress(tasks_deleted=deleted)
+    while True:
+        batch = [task['_id'] for task in storage.tasks.find(folder_id, limit=FOLDER_DELETE_BATCH_SIZE, fields=['_id'])]
+        if not batch:
+            break
+        existing = storage.tasks.delete_many(batch)
+        if existing:
+            task_cache.invalidate(*(task['_id'] for task in existing))
+            # Timers reference tasks by their string ID
+            storage.timers.delete_for_tasks([str(task['_id']) for task in existing])
+            change_log.record_task_deletes(existing)
+            storage.revisions.bump(TASKS_SCOPE, folder_scope(folder_id))
+            for task in existing:
+                task_prefix_index.remove(task['_id'])
+                next_up_index.remove(task['_id'])
+                event_broker.publish('task-deleted', {'_id': task['_id'], 'folder_id': folder_id})
+        deleted += len(existing)
+        progress(tasks_deleted=deleted)
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+@handle_db_error
+def get_job(job_id):
+    annotate(job_id=job_id)
+    # Read from the primary; progress on a lagging replica would go backwards
+    job = storage.jobs.get(ObjectId(job_id))
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@api.route('/folder/<folder_id>/tasks', methods=['GET'])
 @handle_db_error
 def get_folder_tasks(folder_id):
-    folder_tasks = list(tasks_collection.find({'folder_id': folder_id}))
-    for task in folder_tasks:
-        task['_id'] = str(task['_id'])
-        task['created_at'] = task['created_at'].isoformat()
-    return jsonify(folder_tasks)
+    return conditional_listing(folder_scope(folder_id), lambda: list_tasks_response(storage.tasks, folder_id))
 
-@app.route('/folder/<folder_id>/task', methods=['POST'])
+@api.route('/folder/<folder_id>/task', methods=['POST'])
 @handle_db_error
 def add_task_to_folder(folder_id):
-    current_app.logger.info(f"add_task_to_folder function called for folder_id: {folder_id}")
+    annotate(folder_id=folder_id)
     try:
         data = request.json
-        current_app.logger.info(f"Received data: {data}")
-        
+        annotate_detail(body=data)
+
         # Check if the folder exists
-        folder = folders_collection.find_one({'_id': ObjectId(folder_id)})
+        folder = folder_cache.get(ObjectId(folder_id), storage.folders.get)
         if not folder:
-            current_app.logger.warning(f"Folder not found: {folder_id}")
             return jsonify({'error': 'Folder not found'}), 404
+        if not isinstance(data.get('name'), str):
+            return jsonify({'error': "'name' must be a string"}), 400
+        try:
+            schedule = parse_schedule(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         task = {
             'name': data['name'],
             'folder_id': folder_id,
-            'created_at': datetime.now()
+            'created_at': datetime.now(),
+            **schedule,
+            'rev': change_log.next_revisions()
         }
-        result = tasks_collection.insert_one(task)
-        task['_id'] = str(result.inserted_id)
-        task['created_at'] = task['created_at'].isoformat()
-        
-        current_app.logger.info(f"Task added to folder: {task}")
+        storage.tasks.insert(task)
+        storage.revisions.bump(TASKS_SCOPE, folder_scope(folder_id))
+        task_prefix_index.add(task)
+        next_up_index.add(task)
+        event_broker.publish('task-created', task)
+        annotate(task_id=task['_id'])
         return jsonify(task), 201
     except Exception as e:
-        current_app.logger.error(f"Error in add_task_to_folder: {str(e)}")
+        annotate(error=str(e))
         return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
-@app.route('/task/<task_id>/move', methods=['PUT'])
+@api.route('/task/<task_id>/move', methods=['PUT'])
 @handle_db_error
 def move_task_to_folder(task_id):
-    current_app.logger.info(f"move_task_to_folder function called for task_id: {task_id}")
+    annotate(task_id=task_id)
     try:
         data = request.json
         new_priority = data.get('priority')
-        current_app.logger.info(f"Received data: {data}")
-
-        # Check if the task exists
-        task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        if not task:
-            current_app.logger.warning(f"Task not found: {task_id}")
-            return jsonify({'error': 'Task not found'}), 404
+        annotate_detail(body=data)
 
         # Determine new quadrant based on priority
         if new_priority:
             new_quadrant = get_eisenhower_quadrant(new_priority)
-            folder = folders_collection.find_one({'name': new_quadrant})
-            if not folder:
-                folder_result = folders_collection.insert_one({'name': new_quadrant, 'created_at': datetime.now()})
-                folder_id = str(folder_result.inserted_id)
-            else:
-                folder_id = str(folder['_id'])
+            folder_id = quadrant_folders.folder_id(new_quadrant)
         else:
             folder_id = data.get('folder_id')
 
-        # Create the update_data dictionary
-        update_data = {"$set": {"folder_id": folder_id}}
+        # Create the changes dictionary
+        changes = {"folder_id": folder_id, "rev": change_log.next_revisions()}
         if new_priority:
-            update_data["$set"]["priority"] = new_priority
+            changes["priority"] = new_priority
 
-        # Perform the update operation
-        update_result = tasks_collection.update_one({'_id': ObjectId(task_id)}, update_data)
-
-        if update_result.modified_count == 0:
-            current_app.logger.warning(f"Task not found or no changes made: {task_id}")
-            return jsonify({'message': 'Task not found or no changes made'}), 404
-
-        current_app.logger.info(f"Task {task_id} moved to folder {folder_id} successfully")
+        # Perform the update operation; the store hands back the task as it was
+        task = storage.tasks.update(ObjectId(task_id), changes)
+        if not task:
+            return jsonify({'error': 'Task not found'}), 404
+        task_cache.invalidate(task['_id'])
+        storage.revisions.bump(TASKS_SCOPE, folder_scope(task.get('folder_id')), folder_scope(folder_id))
+        task.update(changes)
+        task_prefix_index.add(task)
+        next_up_index.add(task)
+        event_broker.publish('task-moved', task)
+        annotate(folder_id=folder_id)
         return jsonify({'message': 'Task moved successfully'}), 200
     except Exception as e:
-        current_app.logger.error(f"Error in move_task_to_folder: {str(e)}")
+        annotate(error=str(e))
         return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
-@app.route('/timer/start', methods=['POST'])
+# Upper bound on the number of items accepted by one batch request
+MAX_BATCH_SIZE = 1000
+
+def batch_items(data, key):
+    """Pull the list of batch items out of a request body.
+
+    Returns ``(items, error_response)``; exactly one of them is None.
+    """
+    items = (data or {}).get(key)
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({'error': f"'{key}' must be a non-empty list"}), 400)
+    if len(items) > MAX_BATCH_SIZE:
+        return None, (jsonify({'error': f"At most {MAX_BATCH_SIZE} items per batch"}), 400)
+    return items, None
+
+def batch_response(results, success_status):
+    errors = sum(1 for result in results if 'error' in result)
+    status = success_status if errors == 0 else 207
+    return jsonify({'results': results, 'succeeded': len(results) - errors, 'failed': errors}), status
+
+def parse_batch_ids(task_ids, results):
+    """Convert task ID strings to ObjectIds, recording bad ones in results.
+
+    Returns a dict mapping each valid ObjectId to its position in the batch.
+    """
+    positions = {}
+    for index, task_id in enumerate(task_ids):
+        try:
+            # ObjectId(None) would mint a fresh ID rather than fail
+            if not isinstance(task_id, str):
+                raise InvalidId(task_id)
+            task_oid = ObjectId(task_id)
+        except InvalidId:
+            results[index] = {'index': index, 'task_id': task_id, 'error': 'Invalid ID format'}
+            continue
+        if task_oid in positions:
+            results[index] = {'index': index, 'task_id': task_id, 'error': 'Duplicate task ID in batch'}
+            continue
+        positions[task_oid] = index
+    return positions
+
+@api.route('/task/batch', methods=['POST'])
+@handle_db_error
+def create_tasks_batch():
+    items, error = batch_items(request.json, 'tasks')
+    if error:
+        return error
+
+    results = [None] * len(items)
+    tasks = []
+    positions = []
+    now = datetime.now()
+    for index, item in enumerate(items):
+        try:
+            priority = item['priority']
+            if not isinstance(item['name'], str):
+                raise TypeError(item['name'])
+            task = {
+                'name': item['name'],
+                'folder_id': quadrant_folders.folder_id(get_eisenhower_quadrant(priority)),
+                'priority': priority,
+                'created_at': now
+            }
+        except (KeyError, TypeError):
+            results[index] = {'index': index, 'error': "Each task needs a string 'name' and a 'priority' with 'urgent' and 'important'"}
+            continue
+        try:
+            task.update(parse_schedule(item))
+        except ValueError as e:
+            results[index] = {'index': index, 'error': str(e)}
+            continue
+        tasks.append(task)
+        positions.append(index)
+
+    failed_positions = set()
+    if tasks:
+        first_rev = change_log.next_revisions(len(tasks))
+        for offset, task in enumerate(tasks):
+            task['rev'] = first_rev + offset
+        for position, message in storage.tasks.insert_many(tasks).items():
+            index = positions[position]
+            failed_positions.add(index)
+            results[index] = {'index': index, 'error': message}
+
+    touched = set()
+    for task, index in zip(tasks, positions):
+        if index not in failed_positions:
+            results[index] = {'index': index, 'task': task}
+            touched.add(folder_scope(task['folder_id']))
+    if touched:
+        storage.revisions.bump(TASKS_SCOPE, *touched)
+        for task, index in zip(tasks, positions):
+            if index not in failed_positions:
+                task_prefix_index.add(task)
+                next_up_index.add(task)
+                event_broker.publish('task-created', task)
+    return batch_response(results, 201)
+
+@api.route('/task/batch/move', methods=['PUT'])
+@handle_db_error
+def move_tasks_batch():
+    items, error = batch_items(request.json, 'moves')
+    if error:
+        return error
+
+    results = [None] * len(items)
+    task_ids = [item.get('task_id') if isinstance(item, dict) else None for item in items]
+    positions = parse_batch_ids(task_ids, results)
+
+    moves = []
+    for task_oid, index in positions.items():
+        item = items[index]
+        new_priority = item.get('priority')
+        if new_priority:
+            try:
+                folder_id = quadrant_folders.folder_id(get_eisenhower_quadrant(new_priority))
+            except (KeyError, TypeError):
+                results[index] = {'index': index, 'task_id': task_ids[index], 'error': "'priority' needs 'urgent' and 'important'"}
+                continue
+        else:
+            folder_id = item.get('folder_id')
+            if not folder_id:
+                results[index] = {'index': index, 'task_id': task_ids[index], 'error': "Each move needs a 'priority' or a 'folder_id'"}
+                continue
+
+        changes = {"folder_id": folder_id}
+        if new_priority:
+            changes["priority"] = new_priority
+        moves.append((index, task_oid, folder_id, changes))
+
+    touched = set()
+    if moves:
+        first_rev = change_log.next_revisions(len(moves))
+        for offset, (_, _, _, changes) in enumerate(moves):
+            changes["rev"] = first_rev + offset
+        existing, errors = storage.tasks.update_many([(task_oid, changes) for _, task_oid, _, changes in moves])
+        task_cache.invalidate(*existing)
+        failed_positions = set()
+        for position, message in errors.items():
+            index = moves[position][0]
+            failed_positions.add(index)
+            results[index] = {'index': index, 'task_id': task_ids[index], 'error': message}
+
+        moved = []
+        for index, task_oid, folder_id, changes in moves:
+            if index in failed_positions:
+                continue
+            if task_oid in existing:
+                results[index] = {'index': index, 'task_id': task_ids[index], 'folder_id': folder_id}
+                task = existing[task_oid]
+                touched.update((folder_scope(task.get('folder_id')), folder_scope(folder_id)))
+                task.update(changes)
+                moved.append(task)
+            else:
+                results[index] = {'index': index, 'task_id': task_ids[index], 'error': 'Task not found'}
+        if touched:
+            storage.revisions.bump(TASKS_SCOPE, *touched)
+        for task in moved:
+            task_prefix_index.add(task)
+            next_up_index.add(task)
+            event_broker.publish('task-moved', task)
+    return batch_response(results, 200)
+
+@api.route('/task/batch', methods=['DELETE'])
+@handle_db_error
+def delete_tasks_batch():
+    items, error = batch_items(request.json, 'task_ids')
+    if error:
+        return error
+
+    results = [None] * len(items)
+    positions = parse_batch_ids(items, results)
+    if positions:
+        existing = {task['_id']: task.get('folder_id') for task in storage.tasks.delete_many(list(positions))}
+        if existing:
+            task_cache.invalidate(*existing)
+            # Timers reference tasks by their string ID
+            storage.timers.delete_for_tasks([str(task_oid) for task_oid in existing])
+            change_log.record_task_deletes([{'_id': task_oid, 'folder_id': folder_id} for task_oid, folder_id in existing.items()])
+            storage.revisions.bump(TASKS_SCOPE, *{folder_scope(folder_id) for folder_id in existing.values()})
+            for task_oid, folder_id in existing.items():
+                task_prefix_index.remove(task_oid)
+                next_up_index.remove(task_oid)
+                event_broker.publish('task-deleted', {'_id': task_oid, 'folder_id': folder_id})
+        for task_oid, index in positions.items():
+            if task_oid in existing:
+                results[index] = {'index': index, 'task_id': items[index]}
+            else:
+                results[index] = {'index': index, 'task_id': items[index], 'error': 'Task not found'}
+    return batch_response(results, 200)
+
+def timer_task_id():
+    """The ``task_id`` a timer route acts on; raises InvalidId (400)
+    unless it is a string."""
+    task_id = request.json['task_id']
+    annotate(task_id=task_id)
+    # ObjectId(None) would mint a fresh ID rather than fail, and a dict
+    # would reach the timer filter as query operators
+    if not isinstance(task_id, str):
+        raise InvalidId(task_id)
+    return task_id
+
+@api.route('/timer/start', methods=['POST'])
 @handle_db_error
 def start_timer():
-    current_app.logger.info("start_timer function called")
-    try:
-        data = request.json
-        current_app.logger.info(f"Received data: {data}")
-        task_id = data['task_id']
-        current_app.logger.info(f"Searching for task with id: {task_id}")
-        task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        if not task:
-            current_app.logger.warning(f"Task not found: {task_id}")
-            return jsonify({'error': 'Task not found'}), 404
-        
-        current_app.logger.info(f"Task found: {task}")
-        start_time = datetime.now()
-        timer = {
-            'task_id': task_id,
-            'start_time': start_time,
-            'paused_time': None,
-            'total_pause_time': 0
-        }
-        current_app.logger.info(f"Inserting timer: {timer}")
-        result = timers_collection.insert_one(timer)
-        timer['_id'] = str(result.inserted_id)
-        timer['start_time'] = start_time.isoformat()
-        current_app.logger.info(f"Timer inserted successfully: {timer}")
-        return jsonify(timer), 201
-    except Exception as e:
-        current_app.logger.error(f"Error in start_timer: {str(e)}")
-        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
+    task_id = timer_task_id()
+    # Timers may only run for tasks that exist; their time is reported per task
+    if not task_cache.get(ObjectId(task_id), storage.tasks.get):
+        return jsonify({'error': 'Task not found'}), 404
+    timer = storage.timers.start(task_id)
+    if not timer:
+        return jsonify({'error': 'Timer already active for this task'}), 409
+    serialize_timer(timer)
+    event_broker.publish('timer-state', timer)
+    return jsonify(timer), 201
 
-@app.route('/timer/pause', methods=['POST'])
+@api.route('/timer/pause', methods=['POST'])
 @handle_db_error
 def pause_timer():
-    current_app.logger.info("pause_timer function called")
-    try:
-        data = request.json
-        current_app.logger.info(f"Received data: {data}")
-        task_id = data['task_id']
-        current_app.logger.info(f"Searching for active timer with task_id: {task_id}")
-        timer = timers_collection.find_one({'task_id': task_id, 'paused_time': None})
-        if not timer:
-            current_app.logger.warning(f"Active timer not found for task_id: {task_id}")
-            return jsonify({'error': 'Active timer not found'}), 404
-        
-        current_app.logger.info(f"Active timer found: {timer}")
-        pause_time = datetime.now()
-        update_result = timers_collection.update_one(
-            {'_id': timer['_id']},
-            {'$set': {'paused_time': pause_time}}
-        )
-        current_app.logger.info(f"Update result: {update_result.modified_count} document(s) modified")
-        
-        timer['paused_time'] = pause_time.isoformat()
-        timer['_id'] = str(timer['_id'])
-        current_app.logger.info(f"Timer paused: {timer}")
-        return jsonify(timer)
-    except Exception as e:
-        current_app.logger.error(f"Error in pause_timer: {str(e)}")
-        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
+    task_id = timer_task_id()
+    timer = storage.timers.pause(task_id)
+    if not timer:
+        return jsonify({'error': 'Active timer not found'}), 404
+    serialize_timer(timer)
+    event_broker.publish('timer-state', timer)
+    return jsonify(timer)
 
-@app.route('/timer/resume', methods=['POST'])
+@api.route('/timer/resume', methods=['POST'])
 @handle_db_error
 def resume_timer():
-    current_app.logger.info("resume_timer function called")
-    try:
-        data = request.json
-        current_app.logger.info(f"Received data: {data}")
-        task_id = data['task_id']
-        current_app.logger.info(f"Searching for paused timer with task_id: {task_id}")
-        timer = timers_collection.find_one({'task_id': task_id, 'paused_time': {'$ne': None}})
-        if not timer:
-            current_app.logger.warning(f"Paused timer not found for task_id: {task_id}")
-            return jsonify({'error': 'Paused timer not found'}), 404
-        
-        current_app.logger.info(f"Paused timer found: {timer}")
-        current_time = datetime.now()
-        current_app.logger.info(f"Current time: {current_time}")
-        current_app.logger.info(f"Paused time from DB: {timer['paused_time']}")
-        
-        # Check if paused_time is already a datetime object
-        if isinstance(timer['paused_time'], datetime):
-            paused_time = timer['paused_time']
-        else:
-            # If it's a string, parse it
-            paused_time = datetime.fromisoformat(timer['paused_time'])
-        
-        current_app.logger.info(f"Parsed paused time: {paused_time}")
-        pause_duration = (current_time - paused_time).total_seconds()
-        
-        current_app.logger.info(f"Calculating pause duration: {pause_duration} seconds")
-        
-        update_result = timers_collection.update_one(
-            {'_id': timer['_id']},
-            {
-                '$set': {'paused_time': None},
-                '$inc': {'total_pause_time': pause_duration}
-            }
-        )
-        current_app.logger.info(f"Update result: {update_result.modified_count} document(s) modified")
-        
-        timer['paused_time'] = None
-        timer['total_pause_time'] += pause_duration
-        timer['_id'] = str(timer['_id'])
-        current_app.logger.info(f"Timer resumed: {timer}")
-        return jsonify(timer)
-    except Exception as e:
-        current_app.logger.error(f"Error in resume_timer: {str(e)}")
-        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
+    task_id = timer_task_id()
+    timer = storage.timers.resume(task_id)
+    if not timer:
+        return jsonify({'error': 'Paused timer not found'}), 404
+    serialize_timer(timer)
+    event_broker.publish('timer-state', timer)
+    return jsonify(timer)
 
-@app.route('/timer/stop', methods=['POST'])
+@api.route('/timer/stop', methods=['POST'])
 @handle_db_error
 def stop_timer():
-    current_app.logger.info("stop_timer function called")
+    task_id = timer_task_id()
+    timer = storage.timers.stop(task_id)
+    if not timer:
+        return jsonify({'error': 'Timer not found'}), 404
+    # Should this fail, the timer stays unlogged and a health check
+    # records its entry later
+    record_time_entry(get_database().storage, timer)
+    serialize_timer(timer)
+    event_broker.publish('timer-state', timer)
+    return jsonify(timer)
+
+def record_time_entry(storage, timer):
+    """Record a stopped timer's time entry, then mark the timer logged.
+
+    The time goes to wherever the task lives now, read from the primary
+    since a cached copy may predate a move.
+    """
+    folder_id = quadrant = None
     try:
-        data = request.json
-        current_app.logger.info(f"Received data: {data}")
-        task_id = data['task_id']
-        current_app.logger.info(f"Searching for timer with task_id: {task_id}")
-        timer = timers_collection.find_one({'task_id': task_id})
-        if not timer:
-            current_app.logger.warning(f"Timer not found for task_id: {task_id}")
-            return jsonify({'error': 'Timer not found'}), 404
-        
-        current_app.logger.info(f"Timer found: {timer}")
-        end_time = datetime.now()
-        current_app.logger.info(f"End time: {end_time}")
-
-        # Convert start_time to datetime if it's a string
-        start_time = timer['start_time']
-        if isinstance(start_time, str):
-            start_time = datetime.fromisoformat(start_time.rstrip('Z'))
-        
-        current_app.logger.info(f"Start time: {start_time}")
+        task = storage.tasks.get(ObjectId(timer['task_id']), ['folder_id', 'priority'])
+    except InvalidId:
+        task = None
+    if task:
+        folder_id = task.get('folder_id')
+        if task.get('priority'):
+            quadrant = get_eisenhower_quadrant(task['priority'])
+    storage.time_log.record(timer, folder_id=folder_id, quadrant=quadrant)
+    storage.timers.mark_logged(timer['_id'])
 
-        total_time = end_time - start_time - timedelta(seconds=timer['total_pause_time'])
-        current_app.logger.info(f"Calculated total time: {total_time}")
-        
-        result = {
-            'task_id': task_id,
-            'total_time': str(total_time)
-        }
-        delete_result = timers_collection.delete_one({'_id': timer['_id']})
-        current_app.logger.info(f"Delete result: {delete_result.deleted_count} document(s) deleted")
-        
-        current_app.logger.info(f"Timer stopped: {result}")
-        return jsonify(result)
+def record_unlogged_timers(logger, storage):
+    """Record the entries of timers stopped a while ago whose stop request
+    failed before recording them."""
+    stopped_before = datetime.now() - timedelta(seconds=UNLOGGED_TIMER_GRACE_SECONDS)
+    for timer in storage.timers.unlogged(stopped_before, UNLOGGED_TIMERS_PER_CHECK):
+        record_time_entry(storage, timer)
+        log_event(logger, 'time-entry-recovered', timer_id=str(timer['_id']), task_id=timer['task_id'])
+
+@api.route('/report/time', methods=['GET'])
+@handle_db_error
+def time_report():
+    group = request.args.get('group', 'quadrant')
+    if group not in ROLLUP_GROUPS:
+        return jsonify({'error': f"group must be one of: {', '.join(ROLLUP_GROUPS)}"}), 400
+
+    start_day = request.args.get('from')
+    end_day = request.args.get('to')
+    try:
+        for day in (start_day, end_day):
+            if day:
+                datetime.strptime(day, DAY_FORMAT)
+    except ValueError:
+        return jsonify({'error': "'from' and 'to' must be dates formatted as YYYY-MM-DD"}), 400
+
+    totals = read_storage.time_log.totals(group, start_day, end_day)
+    return jsonify({'group': group, 'from': start_day, 'to': end_day, 'totals': totals})
+
+def connect_or_fail():
+    try:
+        get_database().connect()
     except Exception as e:
-        current_app.logger.error(f"Error in stop_timer: {str(e)}")
-        return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
+        raise click.ClickException(f'Database is currently unavailable: {e}')
+
+@api.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Create any missing indexes declared by the storage backend, then
+    upgrade documents written by older versions."""
+    connect_or_fail()
+    failures = storage.ensure_indexes()
+    for collection_name, index_name, error in failures:
+        click.echo(f"{collection_name}.{index_name}: {error}", err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo("All required indexes are in place")
+    for collection_name, count in storage.upgrade().items():
+        if count:
+            click.echo(f"Upgraded {count} {collection_name} written by an older version")
+
+@api.cli.command('check-indexes')
+def check_indexes_command():
+    """Report index drift and fail if any route query does a COLLSCAN."""
+    connect_or_fail()
+    if storage.name != 'mongo':
+        raise click.ClickException('Index checks are only available for the mongo storage backend')
+    db = storage.db
+    failed = False
+    for collection_name, drift in index_drift(db).items():
+        for kind in ('missing', 'mismatched', 'extra'):
+            for index_name in drift[kind]:
+                click.echo(f"{collection_name}.{index_name}: {kind}")
+        # Extra indexes cost write throughput but do not break any query
+        failed = failed or bool(drift['missing'] or drift['mismatched'])
+    for route, collection_name, stages in find_collection_scans(db):
+        click.echo(f"{route}: COLLSCAN on {collection_name} ({' -> '.join(stages)})")
+        failed = True
+    if failed:
+        raise SystemExit(1)
+    click.echo("Indexes match and no route query scans a collection")
 
-@app.route('/health', methods=['GET'])
+@api.route('/events', methods=['GET'])
+def stream_events():
+    """Server-Sent Events stream of task and timer changes.
+
+    Event types: task-created, task-moved, task-deleted and timer-state,
+    each carrying the affected document as JSON.
+    """
+    # The generator outlives the request context, so hold the broker itself
+    broker = current_app.extensions['event_broker']
+    subscription = broker.subscribe()
+
+    def generate():
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield 'retry: 3000\n\n'
+            while not subscription.overflowed:
+                frame = subscription.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+                # Comments keep proxies from closing an idle connection
+                yield frame if frame is not None else ': keep-alive\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(generate(), mimetype='text/event-stream', headers=headers)
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Request and database metrics in the Prometheus text format."""
+    body = current_app.extensions['metrics'].render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@api.route('/health', methods=['GET'])
 def health_check():
-    if db_available:
-        return jsonify({'status': 'healthy', 'database': 'connected'}), 200
-    else:
-        return jsonify({'status': 'unhealthy', 'database': 'disconnected'}), 503
+    status = get_database().status()
+    return jsonify(status), 200 if status['status'] == 'healthy' else 503
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
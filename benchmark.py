@@ -0,0 +1,413 @@
+"""Concurrent load benchmark for the Time2Learn API.
+
+Starts the app against a local storage backend (or targets a running
+server), drives it with concurrent clients following a traffic mix and
+reports p50/p95/p99 latency and requests/sec per route.
+
+    python benchmark.py                                  # every mix, in-process, memory backend
+    python benchmark.py --mix read-heavy --clients 16 --duration 20
+    python benchmark.py --server subprocess --backend sqlite
+    python benchmark.py --server gunicorn --workers 4 --backend sqlite
+    python benchmark.py --url http://localhost:5000      # an already running server
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.25
+
+With --baseline the script exits with status 1 when any route's p95/p99
+latency grows, or its throughput drops, by more than the threshold.
+
+In-process mode shares the interpreter (and the GIL) with the clients;
+use --server subprocess for numbers closer to a real deployment, or
+--server gunicorn to run the production launcher (gunicorn.conf.py).
+The memory backend keeps separate data in every gunicorn worker, so use
+sqlite or mongo with more than one worker.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+MIXES = {
+    'create-heavy': [
+        (60, 'create_task'),
+        (10, 'create_batch'),
+        (20, 'list_page'),
+        (10, 'move_task'),
+    ],
+    'read-heavy': [
+        (40, 'list_page'),
+        (20, 'list_conditional'),
+        (20, 'list_folder'),
+        (15, 'get_task'),
+        (5, 'create_task'),
+    ],
+    'timer-churn': [
+        (85, 'timer_step'),
+        (10, 'time_report'),
+        (5, 'get_task'),
+    ],
+}
+
+PRIORITIES = [
+    {'urgent': urgent, 'important': important}
+    for urgent in (True, False)
+    for important in (True, False)
+]
+
+# Latency and throughput metrics compared against a baseline, and which
+# direction counts as a regression
+COMPARED_METRICS = {'p95_ms': 'higher', 'p99_ms': 'higher', 'rps': 'lower'}
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class LatencyRecorder:
+    """Collects per-route latencies from every client thread.
+
+    Requests that start before ``measure_from`` (the warm-up) are dropped.
+    """
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._errors = {}
+
+    def record(self, route, started, elapsed, ok):
+        if started < self.measure_from:
+            return
+        with self._lock:
+            self._latencies.setdefault(route, []).append(elapsed)
+            if not ok:
+                self._errors[route] = self._errors.get(route, 0) + 1
+
+    def summary(self, seconds):
+        routes = {}
+        everything = []
+        with self._lock:
+            for route, latencies in sorted(self._latencies.items()):
+                everything.extend(latencies)
+                routes[route] = summarize(latencies, self._errors.get(route, 0), seconds)
+            total = summarize(everything, sum(self._errors.values()), seconds)
+        return routes, total
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+class Client:
+    """One simulated user with its own HTTP session and task pool."""
+
+    def __init__(self, base_url, recorder, dataset, own_tasks, seed):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.dataset = dataset
+        self.own_tasks = own_tasks
+        self.session = requests.Session()
+        self.random = random.Random(seed)
+        self.cursor = None
+        self.etag = None
+        # Timer state per owned task: None, 'running' or 'paused'
+        self.timers = {}
+
+    def request(self, method, route, path, **kwargs):
+        started = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, **kwargs)
+        elapsed = time.perf_counter() - started
+        # A 304 is the expected answer to a conditional listing
+        ok = response.status_code < 400
+        self.recorder.record(route, started, elapsed, ok)
+        return response
+
+    def new_task(self):
+        return {'name': f'bench task {self.random.random():.6f}', 'priority': self.random.choice(PRIORITIES)}
+
+    def create_task(self):
+        self.request('POST', 'POST /task', '/task', json=self.new_task())
+
+    def create_batch(self):
+        tasks = [self.new_task() for _ in range(20)]
+        self.request('POST', 'POST /task/batch', '/task/batch', json={'tasks': tasks})
+
+    def list_page(self):
+        # Walk the keyset pages, starting over after the last one
+        params = {'limit': 100}
+        if self.cursor:
+            params['after'] = self.cursor
+        response = self.request('GET', 'GET /task?limit', '/task', params=params)
+        if response.ok:
+            self.cursor = response.json()['next_cursor']
+
+    def list_conditional(self):
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        response = self.request('GET', 'GET /task (etag)', '/task', params={'limit': 100}, headers=headers)
+        self.etag = response.headers.get('ETag', self.etag)
+
+    def list_folder(self):
+        folder_id = self.random.choice(self.dataset['folder_ids'])
+        self.request('GET', 'GET /folder/<id>/tasks', f'/folder/{folder_id}/tasks', params={'limit': 100})
+
+    def get_task(self):
+        task_id = self.random.choice(self.dataset['task_ids'])
+        self.request('GET', 'GET /task/<id>', f'/task/{task_id}')
+
+    def move_task(self):
+        task_id = self.random.choice(self.own_tasks)
+        self.request('PUT', 'PUT /task/<id>/move', f'/task/{task_id}/move', json={'priority': self.random.choice(PRIORITIES)})
+
+    def timer_step(self):
+        # Move one owned task's timer one step through start/pause/resume/stop
+        task_id = self.random.choice(self.own_tasks)
+        state = self.timers.get(task_id)
+        if state is None:
+            action, next_state = 'start', 'running'
+        elif state == 'running':
+            action, next_state = self.random.choice([('pause', 'paused'), ('stop', None)])
+        else:
+            action, next_state = self.random.choice([('resume', 'running'), ('stop', None)])
+        response = self.request('POST', f'POST /timer/{action}', f'/timer/{action}', json={'task_id': task_id})
+        if response.ok:
+            self.timers[task_id] = next_state
+
+    def time_report(self):
+        self.request('GET', 'GET /report/time', '/report/time', params={'group': 'quadrant'})
+
+    def run(self, mix, deadline):
+        weights = [weight for weight, _ in mix]
+        operations = [getattr(self, name) for _, name in mix]
+        while time.perf_counter() < deadline:
+            try:
+                self.random.choices(operations, weights)[0]()
+            except requests.RequestException as e:
+                print(f"Request failed: {e}", file=sys.stderr)
+        # Leave no timers running for the next mix
+        for task_id, state in self.timers.items():
+            if state:
+                self.session.post(self.base_url + '/timer/stop', json={'task_id': task_id})
+        self.session.close()
+
+def seed_tasks(base_url, count):
+    """Create ``count`` tasks through the batch endpoint and return their IDs
+    and the quadrant folders they landed in."""
+    session = requests.Session()
+    task_ids, folder_ids = [], set()
+    rng = random.Random(0)
+    for start in range(0, count, 100):
+        tasks = [
+            {'name': f'seed task {index}', 'priority': rng.choice(PRIORITIES)}
+            for index in range(start, min(start + 100, count))
+        ]
+        response = session.post(base_url + '/task/batch', json={'tasks': tasks})
+        response.raise_for_status()
+        for result in response.json()['results']:
+            if 'task' in result:
+                task_ids.append(result['task']['_id'])
+                folder_ids.add(result['task']['folder_id'])
+    session.close()
+    return {'task_ids': task_ids, 'folder_ids': sorted(folder_ids)}
+
+def run_mix(base_url, name, clients, duration, warmup, dataset):
+    mix = MIXES[name]
+    start = time.perf_counter()
+    recorder = LatencyRecorder(measure_from=start + warmup)
+    deadline = start + warmup + duration
+    # Each client works on its own slice of tasks so timer transitions don't collide
+    slice_size = max(1, len(dataset['task_ids']) // clients)
+    threads = []
+    for index in range(clients):
+        own_tasks = dataset['task_ids'][index * slice_size:(index + 1) * slice_size] or dataset['task_ids']
+        client = Client(base_url, recorder, dataset, own_tasks, seed=index)
+        threads.append(threading.Thread(target=client.run, args=(mix, deadline), daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    routes, total = recorder.summary(duration)
+    return {'clients': clients, 'duration': duration, 'routes': routes, 'total': total}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def backend_environment(backend, workdir):
+    # Like the access log, a JSON log line per request would dominate the
+    # measurements; failed requests are still logged
+    env = {'STORAGE_BACKEND': backend, 'LOG_LEVEL': 'WARNING'}
+    if backend == 'sqlite':
+        env['SQLITE_PATH'] = os.path.join(workdir, 'benchmark.db')
+    return env
+
+def wait_until_healthy(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + '/health', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become healthy within {timeout}s")
+
+def start_in_process(backend, workdir):
+    # App reads its configuration at import time
+    os.environ.update(backend_environment(backend, workdir))
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import App
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        # An access log line per request would dominate the measurements
+        def log_request(self, *args, **kwargs):
+            pass
+
+    port = free_port()
+    server = make_server('127.0.0.1', port, App.app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{port}', server.shutdown
+
+def start_subprocess(backend, workdir, workers=None):
+    port = free_port()
+    env = dict(os.environ, **backend_environment(backend, workdir))
+    if workers:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                   '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'App:app']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'App', 'run', '--port', str(port)]
+    process = subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    def stop():
+        process.terminate()
+        process.wait(timeout=10)
+
+    return f'http://127.0.0.1:{port}', stop
+
+def compare_with_baseline(results, baseline, threshold, min_delta_ms):
+    """Return a description of every route that regressed past ``threshold``."""
+    regressions = []
+    for mix, result in results.items():
+        baseline_routes = baseline.get('mixes', {}).get(mix, {}).get('routes', {})
+        for route, stats in result['routes'].items():
+            before = baseline_routes.get(route)
+            if not before:
+                continue
+            for metric, worse in COMPARED_METRICS.items():
+                old, new = before.get(metric), stats.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if worse == 'higher':
+                    # Sub-millisecond jitter is noise, not a regression
+                    regressed = change > threshold and new - old > min_delta_ms
+                else:
+                    regressed = -change > threshold
+                if regressed:
+                    regressions.append(f"{mix} {route}: {metric} {old} -> {new} ({change:+.0%})")
+            if stats['errors'] > before.get('errors', 0):
+                regressions.append(f"{mix} {route}: errors {before.get('errors', 0)} -> {stats['errors']}")
+    return regressions
+
+def print_report(name, result):
+    print(f"\n{name}: {result['clients']} clients for {result['duration']}s")
+    header = f"{'route':<28}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print('-' * len(header))
+    rows = list(result['routes'].items()) + [('total', result['total'])]
+    for route, stats in rows:
+        print(f"{route:<28}{stats['requests']:>10}{stats['errors']:>8}{stats['rps']:>10}"
+              f"{stats['p50_ms'] or '-':>10}{stats['p95_ms'] or '-':>10}{stats['p99_ms'] or '-':>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mix', choices=sorted(MIXES), action='append',
+                        help='traffic mix to run; repeat for several (default: all)')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients (default: 8)')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per mix (default: 10)')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each mix (default: 2)')
+    parser.add_argument('--seed-tasks', type=int, default=500, help='tasks created before the run (default: 500)')
+    parser.add_argument('--server', choices=('in-process', 'subprocess', 'gunicorn'), default='in-process',
+                        help='how to start the app (default: in-process)')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes (default: 1)')
+    parser.add_argument('--backend', choices=('memory', 'sqlite', 'mongo'), default='memory',
+                        help='storage backend of the started app (default: memory)')
+    parser.add_argument('--url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results as the new baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='fail if results regress against this baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative regression, e.g. 0.2 for 20%% (default: 0.2)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='ignore latency regressions smaller than this (default: 1.0)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stop = None
+        if args.url:
+            base_url = args.url.rstrip('/')
+        elif args.server == 'subprocess':
+            base_url, stop = start_subprocess(args.backend, workdir)
+        elif args.server == 'gunicorn':
+            base_url, stop = start_subprocess(args.backend, workdir, workers=args.workers)
+        else:
+            base_url, stop = start_in_process(args.backend, workdir)
+        try:
+            wait_until_healthy(base_url)
+            dataset = seed_tasks(base_url, args.seed_tasks)
+            results = {}
+            for name in args.mix or sorted(MIXES):
+                results[name] = run_mix(base_url, name, args.clients, args.duration, args.warmup, dataset)
+                print_report(name, results[name])
+        finally:
+            if stop:
+                stop()
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'target': args.url or f'{args.server}/{args.backend}' + (f'/{args.workers}w' if args.server == 'gunicorn' else ''),
+        'mixes': results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nResults written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%} against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Read-through cache for documents looked up by ``_id`` on hot paths.
+
+Entries are evicted least recently used first once the cache is full,
+and expire ``ttl`` seconds after they were loaded. Routes that write a
+document invalidate it here, but only in their own process: a write made
+by another server worker is seen once the entry expires, so ``ttl``
+bounds how stale a read can be.
+
+Concurrent misses for the same key share a single load. A load that an
+invalidation overtakes still answers the requests waiting on it, but its
+result is not cached.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+class _Load:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+class ReadThroughCache:
+    """LRU/TTL cache of documents keyed by ObjectId.
+
+    ``get`` returns a copy, so callers may modify what they get back.
+    Missing documents (a load returning None) are not cached.
+    """
+
+    def __init__(self, name, max_entries=10000, ttl=5.0):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._loads = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """Return the document for ``key``, calling ``load(key)`` on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self.expirations += 1
+            pending = self._loads.get(key)
+            if pending is None:
+                self.misses += 1
+                pending = self._loads[key] = _Load()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return copy.deepcopy(pending.value)
+
+        try:
+            pending.value = load(key)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._loads.get(key) is pending:
+                    del self._loads[key]
+                if pending.error is None and pending.value is not None and not pending.stale:
+                    self._store(key, pending.value)
+            pending.done.set()
+        return copy.deepcopy(pending.value)
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys):
+        """Forget ``keys``; call after writing the documents they name."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                pending = self._loads.pop(key, None)
+                if pending is not None:
+                    pending.stale = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,266 @@
+"""The app's connection to its storage backend.
+
+``Database`` connects lazily, so the app can start serving before the
+backend answers, and a background monitor pings the backend to flip
+availability both ways. Requests consult a ``CircuitBreaker`` first so a
+database that is down fails them fast with a 503 instead of holding a
+worker for a full server selection timeout.
+
+Database objects are fork safe: a forked child (e.g. a pre-fork server
+worker after ``preload_app``) drops the parent's client, which must not
+be shared across processes, and reconnects with its own.
+"""
+import os
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from pymongo.errors import ConnectionFailure, OperationFailure
+
+from logs import log_event
+from quadrants import QuadrantFolderRegistry
+from storage import create_storage
+from sync import TaskChangeLog
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Counts consecutive connection failures.
+
+    After ``failure_threshold`` of them the circuit opens and requests are
+    refused outright. Once ``reset_timeout`` seconds have passed a single
+    trial request is let through (half open); its outcome closes the
+    circuit or opens it for another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow_request(self):
+        if self._state == CLOSED:
+            return True
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            # In both open and half open, one trial per reset_timeout; a
+            # trial whose outcome never got recorded doesn't block forever
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        # Skip the lock on the hot path when nothing needs resetting
+        if self._state == CLOSED and self._failures == 0:
+            return
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def trip(self):
+        """Open the circuit right away, e.g. after a failed health check."""
+        with self._lock:
+            self._failures = max(self._failures, self.failure_threshold)
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+
+# Every Database in this process, reset in the child after a fork
+_databases = weakref.WeakSet()
+
+def _reset_after_fork():
+    for database in list(_databases):
+        database._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+class Database:
+    """Lazily connected storage plus the helpers built on top of it.
+
+    ``storage``, ``read_storage``, ``change_log`` and ``quadrant_folders``
+    are None until the first successful connection. ``storage_options``
+    are passed on to ``create_storage``; ``logger`` gets an event for each
+    storage upgrade. Functions in ``on_healthy`` are
+    called on the monitor thread after every successful check.
+    """
+
+    def __init__(self, backend, mongo_uri=None, sqlite_path=None, quadrants=(),
+                 check_interval=10, breaker=None, storage_options=None, logger=None):
+        self.backend = backend
+        self.mongo_uri = mongo_uri
+        self.sqlite_path = sqlite_path
+        self.quadrants = quadrants
+        self.check_interval = check_interval
+        self.breaker = breaker or CircuitBreaker()
+        self.storage_options = storage_options or {}
+        self.logger = logger
+        self.on_healthy = []
+        self._reset()
+        _databases.add(self)
+
+    def _reset(self):
+        self.storage = None
+        self.read_storage = None
+        self.change_log = None
+        self.quadrant_folders = None
+        self.last_check = None
+        self.last_error = None
+        self._connected = False
+        self._backend_storage = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+        self._monitor_lock = threading.Lock()
+
+    def _after_fork(self):
+        # Threads don't survive a fork and the parent's client must not be
+        # reused, so start over; the monitor restarts if it was running
+        monitoring = self._monitor is not None and not self._stop.is_set()
+        self._reset()
+        self.breaker = CircuitBreaker(self.breaker.failure_threshold, self.breaker.reset_timeout)
+        if monitoring:
+            self.start_monitor()
+
+    @property
+    def available(self):
+        return self._connected and self.breaker.state != OPEN
+
+    def connect(self):
+        """Create the storage on first use and check that it answers.
+
+        Raises whatever the backend raises when it cannot be reached.
+        """
+        with self._lock:
+            # The client is created once and reused across failed pings
+            if self._backend_storage is None:
+                self._backend_storage = create_storage(
+                    self.backend, mongo_uri=self.mongo_uri, sqlite_path=self.sqlite_path, **self.storage_options
+                )
+            self._backend_storage.ping()
+            if self.storage is None:
+                self._set_up(self._backend_storage)
+                self.read_storage = self._backend_storage.for_reads()
+                self.storage = self._backend_storage
+
+    def _set_up(self, storage):
+        print(f"Connected successfully to the {storage.name} backend!")
+        self.change_log = TaskChangeLog(storage.tasks, storage.tombstones, storage.revisions)
+
+        # Create any missing indexes and upgrade documents older versions
+        # wrote; both are no-ops once done
+        try:
+            for collection_name, index_name, error in storage.ensure_indexes():
+                print(f"Failed to create index {index_name} on {collection_name}. Error: {error}")
+            upgraded = storage.upgrade()
+            if self.logger is not None and any(upgraded.values()):
+                log_event(self.logger, 'storage-upgraded', **upgraded)
+        except ConnectionFailure as e:
+            print(f"Failed to create indexes at startup. Error: {e}")
+
+        # Resolve the four quadrant folders once so task writes need no lookup
+        self.quadrant_folders = QuadrantFolderRegistry(storage.folders, self.quadrants, storage.tombstones)
+        try:
+            self.quadrant_folders.resolve_all()
+        except (ConnectionFailure, OperationFailure) as e:
+            # Lookups fall back to resolving lazily on first use
+            print(f"Failed to resolve quadrant folders at startup. Error: {e}")
+
+    def check(self):
+        """Ping the backend once and update availability; returns it."""
+        try:
+            self.connect()
+        except Exception as e:
+            if self._connected or self.last_error is None:
+                print(f"Database unavailable. Error: {e}")
+            self._connected = False
+            self.last_error = str(e)
+            self.breaker.trip()
+        else:
+            if not self._connected and self.last_error is not None:
+                print("Database connection restored")
+            self._connected = True
+            self.last_error = None
+            self.breaker.record_success()
+        self.last_check = datetime.now()
+        return self._connected
+
+    def notify_healthy(self):
+        """Call every ``on_healthy`` function; one failing stops no other."""
+        for callback in self.on_healthy:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Health check callback failed. Error: {e}")
+
+    def start_monitor(self):
+        """Connect and keep checking the backend in a daemon thread."""
+        if self._monitor is not None:
+            return
+        self._monitor = threading.Thread(target=self._run_monitor, name='db-health-monitor', daemon=True)
+        self._monitor.start()
+
+    def ensure_monitor(self):
+        """Start the monitor unless it is running.
+
+        Doesn't wait for it to connect: until its first check succeeds,
+        ``allow_request`` refuses requests rather than hold them for a
+        backend that may not answer.
+        """
+        if self._monitor is not None:
+            return
+        with self._monitor_lock:
+            self.start_monitor()
+
+    def stop_monitor(self):
+        self._stop.set()
+
+    def _run_monitor(self):
+        while not self._stop.is_set():
+            if self.check():
+                self.notify_healthy()
+            self._stop.wait(self.check_interval)
+
+    def allow_request(self):
+        return self._connected and self.breaker.allow_request()
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.breaker.record_failure()
+
+    def status(self):
+        if self.available:
+            database = 'connected'
+        elif self.last_check is None:
+            database = 'connecting'
+        else:
+            database = 'disconnected'
+        return {
+            'status': 'healthy' if self.available else 'unhealthy',
+            'database': database,
+            'backend': self.backend,
+            'circuit': self.breaker.state,
+            'last_check': self.last_check,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,62 @@
+import itertools
+import queue
+import threading
+
+# Events a subscriber may fall behind by before it is disconnected; the
+# browser reconnects on its own and catches up through GET /task/changes
+SUBSCRIBER_QUEUE_SIZE = 256
+
+class Subscription:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Next encoded event, or None when nothing arrived within ``timeout``."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventBroker:
+    """In-process publish/subscribe fan-out for Server-Sent Events.
+
+    ``publish`` encodes an event once and hands the same frame to every
+    subscriber queue, so one write reaches any number of open /events
+    streams without extra database reads or per-subscriber serialization.
+    Only subscribers connected to this process see its events.
+    """
+
+    def __init__(self, dumps):
+        self._dumps = dumps
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self):
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event, data):
+        with self._lock:
+            if not self._subscribers:
+                return
+            subscribers = list(self._subscribers)
+        frame = f"id: {next(self._ids)}\nevent: {event}\ndata: {self._dumps(data)}\n\n"
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(frame)
+            except queue.Full:
+                # Dropping events silently would leave the client out of
+                # date, so end its stream and let it resync instead
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
@@ -0,0 +1,44 @@
+"""Gunicorn settings for serving Time2Learn in production.
+
+    gunicorn -c gunicorn.conf.py App:app
+
+Each worker process gets its own database client, created after the
+fork (see database.py), and connects before it takes any traffic.
+Settings can be overridden with the environment variables below or on
+the command line.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Worker processes; requests are CPU bound in Python, so scale with cores
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Threads let a worker overlap database round trips and hold /events
+# streams open; each open stream occupies one thread
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Import the app once in the master so workers fork with it loaded; the
+# app doesn't connect until post_worker_init, so database clients, the
+# health monitor and background jobs only exist in the workers
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+
+def post_worker_init(worker):
+    # Connect before serving, so a fresh worker doesn't answer 503 while
+    # its monitor makes the first connection
+    database = worker.wsgi.extensions['database']
+    database.check()
+    database.ensure_monitor()
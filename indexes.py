@@ -0,0 +1,203 @@
+from datetime import datetime
+from pymongo import ASCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+from bson.objectid import ObjectId
+from quadrants import QUADRANT_INDEX_NAME
+from timers import ACTIVE_TIMER_INDEX_NAME, STOPPED_TIMER_TTL_SECONDS
+from sync import TOMBSTONE_TTL_SECONDS
+from jobs import UNFINISHED, JOB_TTL_SECONDS
+
+# Every index the routes in App.py rely on, per collection. The default
+# _id index is implied and never listed here.
+REQUIRED_INDEXES = {
+    'tasks': [
+        # get_folder_tasks, filtered by folder and paged by _id; also
+        # feeds GET /matrix's $group in index order
+        IndexModel([('folder_id', ASCENDING), ('_id', ASCENDING)], name='folder_id_1__id_1'),
+        # GET /task/changes, tasks written after a sync token
+        IndexModel([('rev', ASCENDING)], name='rev_1'),
+        # GET /task/search, whole words of task names; no stemming or stop
+        # words, so it matches exactly like the other backends
+        IndexModel([('name', TEXT)], name='name_text', default_language='none'),
+        # GET /next while its in-process index loads: each quadrant's
+        # oldest tasks and, for tasks with a due date, its latest starts
+        IndexModel(
+            [('priority.urgent', ASCENDING), ('priority.important', ASCENDING), ('created_at', ASCENDING)],
+            name='priority_created_at',
+        ),
+        IndexModel(
+            [('priority.urgent', ASCENDING), ('priority.important', ASCENDING), ('latest_start', ASCENDING)],
+            name='priority_latest_start',
+            partialFilterExpression={'latest_start': {'$exists': True}},
+        ),
+    ],
+    'task_tombstones': [
+        # GET /task/changes, deletes after a sync token
+        IndexModel([('rev', ASCENDING)], name='rev_1'),
+        # Folder deletes after a revision, which QuadrantFolderRegistry
+        # polls to notice quadrant folders deleted by other workers
+        IndexModel([('kind', ASCENDING), ('rev', ASCENDING)], name='kind_1_rev_1'),
+        # Deletes are forgotten once no valid sync token can predate them
+        IndexModel([('deleted_at', ASCENDING)], name='deleted_at_ttl', expireAfterSeconds=TOMBSTONE_TTL_SECONDS),
+    ],
+    'folders': [
+        # Quadrant lookups by name
+        IndexModel([('name', ASCENDING)], name='name_1'),
+        # Only one folder per quadrant, see QuadrantFolderRegistry
+        IndexModel(
+            [('name', ASCENDING), ('quadrant', ASCENDING)],
+            name=QUADRANT_INDEX_NAME,
+            unique=True,
+            partialFilterExpression={'quadrant': True},
+        ),
+    ],
+    'timers': [
+        # Timer cleanup in delete_task and the batch delete
+        IndexModel([('task_id', ASCENDING), ('state', ASCENDING)], name='task_id_1_state_1'),
+        # At most one running or paused timer per task; also serves every
+        # state transition, which all filter on active timers
+        IndexModel(
+            [('task_id', ASCENDING)],
+            name=ACTIVE_TIMER_INDEX_NAME,
+            unique=True,
+            partialFilterExpression={'active': True},
+        ),
+        # Stopped timers are only kept long enough to read back
+        IndexModel([('stopped_at', ASCENDING)], name='stopped_at_ttl', expireAfterSeconds=STOPPED_TIMER_TTL_SECONDS),
+        # Stopped timers whose time entry still needs recording
+        IndexModel(
+            [('unlogged', ASCENDING), ('stopped_at', ASCENDING)],
+            name='unlogged_1_stopped_at_1',
+            partialFilterExpression={'unlogged': True},
+        ),
+    ],
+    'time_entries': [
+        # History of one task in time order
+        IndexModel([('task_id', ASCENDING), ('stopped_at', ASCENDING)], name='task_id_1_stopped_at_1'),
+        # One entry per timer, so recording one again is a no-op
+        IndexModel([('timer_id', ASCENDING)], name='timer_id_unique', unique=True),
+    ],
+    'time_rollups': [
+        # /report/time, one group over a range of days
+        IndexModel([('group', ASCENDING), ('day', ASCENDING)], name='group_1_day_1'),
+    ],
+    'jobs': [
+        # JobRunner.resume_stale, unfinished jobs nobody has reported on
+        IndexModel([('status', ASCENDING), ('updated_at', ASCENDING)], name='status_1_updated_at_1'),
+        # Finished jobs are only kept long enough to read back; unfinished
+        # ones have no finished_at and never expire
+        IndexModel([('finished_at', ASCENDING)], name='finished_at_ttl', expireAfterSeconds=JOB_TTL_SECONDS),
+    ],
+}
+
+# One representative query per route: (route, collection, filter, sort).
+# The full, unpaginated GET /task is a deliberate scan and is left out.
+ROUTE_QUERIES = [
+    ('get_task', 'tasks', lambda: {'_id': ObjectId()}, None),
+    ('get_all_tasks (page)', 'tasks', lambda: {'_id': {'$gt': ObjectId()}}, [('_id', ASCENDING)]),
+    ('get_folder_tasks', 'tasks', lambda: {'folder_id': str(ObjectId())}, [('_id', ASCENDING)]),
+    ('get_matrix', 'tasks', lambda: {'folder_id': {'$in': [str(ObjectId()), str(ObjectId())]}}, [('folder_id', ASCENDING), ('_id', ASCENDING)]),
+    ('get_task_changes', 'tasks', lambda: {'rev': {'$gt': 0}}, [('rev', ASCENDING)]),
+    ('search_tasks', 'tasks', lambda: {'$text': {'$search': 'report'}}, None),
+    ('next_tasks (age)', 'tasks', lambda: {'priority.urgent': True, 'priority.important': False, 'created_at': {'$exists': True}}, [('created_at', ASCENDING)]),
+    ('next_tasks (due)', 'tasks', lambda: {'priority.urgent': True, 'priority.important': False, 'latest_start': {'$exists': True}}, [('latest_start', ASCENDING)]),
+    ('get_task_changes (deletes)', 'task_tombstones', lambda: {'rev': {'$gt': 0}}, [('rev', ASCENDING)]),
+    ('quadrant folder refresh', 'task_tombstones', lambda: {'rev': {'$gt': 0}, 'kind': 'folder'}, [('rev', ASCENDING)]),
+    ('create_task (quadrant folder)', 'folders', lambda: {'name': 'urgent_important'}, None),
+    ('delete_task (timers)', 'timers', lambda: {'task_id': str(ObjectId())}, None),
+    ('pause_timer', 'timers', lambda: {'task_id': str(ObjectId()), 'active': True, 'state': 'running'}, None),
+    ('resume_timer', 'timers', lambda: {'task_id': str(ObjectId()), 'active': True, 'state': 'paused'}, None),
+    ('stop_timer', 'timers', lambda: {'task_id': str(ObjectId()), 'active': True}, None),
+    ('record_unlogged_timers', 'timers', lambda: {'unlogged': True, 'stopped_at': {'$lt': datetime.now()}}, None),
+    ('stop_timer (time entry)', 'time_entries', lambda: {'timer_id': ObjectId()}, None),
+    ('resume_stale (jobs)', 'jobs', lambda: {'status': {'$in': list(UNFINISHED)}, 'updated_at': {'$lt': datetime.now()}}, None),
+    ('time_report', 'time_rollups', lambda: {'group': 'quadrant', 'day': {'$gte': '2024-01-01', '$lte': '2024-12-31'}}, None),
+]
+
+# Index options compared when looking for drift
+_COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds', 'default_language')
+
+def ensure_indexes(db):
+    """Create every required index that is missing.
+
+    Safe to run repeatedly: MongoDB treats an identical index as a no-op.
+    Returns a list of ``(collection, index name, error)`` for indexes that
+    could not be created, typically because an index with the same name
+    but different options already exists.
+    """
+    failures = []
+    for collection_name, models in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        for model in models:
+            try:
+                collection.create_indexes([model])
+            except OperationFailure as e:
+                failures.append((collection_name, model.document['name'], str(e)))
+    return failures
+
+def _live_key(actual):
+    # A text index reports its key as _fts/_ftsx and its fields as weights
+    key = []
+    for field, direction in actual['key']:
+        if field == '_fts':
+            key.extend((name, TEXT) for name in sorted(actual.get('weights', {})))
+        elif field != '_ftsx':
+            key.append((field, direction))
+    return key
+
+def _index_matches(expected, actual):
+    if list(expected['key'].items()) != _live_key(actual):
+        return False
+    for option in _COMPARED_OPTIONS:
+        if expected.get(option) != actual.get(option):
+            return False
+    return True
+
+def index_drift(db):
+    """Compare the live indexes against REQUIRED_INDEXES.
+
+    Returns ``{collection: {'missing': [...], 'mismatched': [...], 'extra': [...]}}``
+    for every collection that differs; an empty dict means no drift.
+    """
+    report = {}
+    for collection_name, models in REQUIRED_INDEXES.items():
+        live = db[collection_name].index_information()
+        live.pop('_id_', None)
+        expected = {model.document['name']: model.document for model in models}
+
+        missing = sorted(name for name in expected if name not in live)
+        mismatched = sorted(
+            name for name in expected
+            if name in live and not _index_matches(expected[name], live[name])
+        )
+        extra = sorted(name for name in live if name not in expected)
+        if missing or mismatched or extra:
+            report[collection_name] = {'missing': missing, 'mismatched': mismatched, 'extra': extra}
+    return report
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+def find_collection_scans(db):
+    """Run explain() on every route query and return the ones that scan.
+
+    Returns a list of ``(route, collection, stages)`` for each query whose
+    winning plan contains a COLLSCAN stage.
+    """
+    scans = []
+    for route, collection_name, make_filter, sort in ROUTE_QUERIES:
+        cursor = db[collection_name].find(make_filter())
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(_plan_stages(winning_plan))
+        if 'COLLSCAN' in stages:
+            scans.append((route, collection_name, stages))
+    return scans
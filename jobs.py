@@ -0,0 +1,142 @@
+"""Background jobs for work too big to finish inside a request.
+
+A job is a record in the backend's JobStore (see storage/base.py), so any
+worker process can report on it, plus a run on one process's thread
+pool. Handlers are registered by kind and called as
+``handler(job, progress)`` inside an app context; ``progress(**counts)``
+saves counters on the record, which doubles as a heartbeat.
+
+A job whose record has not been touched for ``stale_after`` seconds is
+taken to have died with its process and is run again by the next runner
+that checks, so handlers must be safe to run more than once and should
+pick up from what is left to do rather than from the start.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo.errors import ConnectionFailure
+
+from logs import log_event
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# Jobs in these states still have work to do
+UNFINISHED = (QUEUED, RUNNING)
+
+# How long finished job records are kept to be read back
+JOB_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Seconds without a progress report after which an unfinished job is resumed
+STALE_JOB_SECONDS = 300
+
+def new_job(kind, params, now=None):
+    now = now or datetime.now()
+    return {
+        'kind': kind,
+        'params': params,
+        'status': QUEUED,
+        'progress': {},
+        'error': None,
+        'created_at': now,
+        'updated_at': now,
+        'started_at': None,
+        'finished_at': None,
+    }
+
+class JobRunner:
+    """Runs an app's jobs on a small thread pool in this process.
+
+    The pool is created on first use and again in a forked child, whose
+    copy of the parent's pool has no threads behind it.
+    """
+
+    def __init__(self, app, handlers, max_workers=2, stale_after=STALE_JOB_SECONDS):
+        self.app = app
+        self.handlers = dict(handlers)
+        self.max_workers = max_workers
+        self.stale_after = stale_after
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _store(self):
+        return self.app.extensions['database'].storage.jobs
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='job')
+                self._pid = os.getpid()
+            return self._pool
+
+    def create(self, kind, **params):
+        """Record a new job without queueing it yet; returns the record.
+
+        Left unstarted, it is resumed once stale like any other job.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job = new_job(kind, params)
+        self._store().insert(job)
+        return job
+
+    def start(self, job):
+        self._executor().submit(self._run, job['_id'])
+
+    def submit(self, kind, **params):
+        """Record a new job and queue it; returns the job record."""
+        job = self.create(kind, **params)
+        self.start(job)
+        return job
+
+    def cancel(self, job, reason):
+        """Finish a created job that will not be started."""
+        now = datetime.now()
+        self._store().update(job['_id'], {'status': FAILED, 'error': reason, 'updated_at': now, 'finished_at': now})
+
+    def resume_stale(self):
+        """Queue every unfinished job nobody has reported on lately."""
+        store = self._store()
+        while True:
+            now = datetime.now()
+            job = store.claim_stale(now - timedelta(seconds=self.stale_after), now)
+            if job is None:
+                return
+            log_event(self.app.logger, 'job-resumed', job_id=str(job['_id']), kind=job['kind'])
+            self._executor().submit(self._run, job['_id'])
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            store = self._store()
+            job = store.get(job_id)
+            if job is None or job['status'] not in UNFINISHED:
+                return
+            now = datetime.now()
+            store.update(job_id, {'status': RUNNING, 'started_at': job['started_at'] or now, 'updated_at': now})
+
+            def progress(**counts):
+                job['progress'].update(counts)
+                store.update(job_id, {'progress': job['progress'], 'updated_at': datetime.now()})
+
+            try:
+                self.handlers[job['kind']](job, progress)
+            except ConnectionFailure as e:
+                # Left unfinished; it goes stale and is resumed once the
+                # database is back
+                log_event(self.app.logger, 'job-interrupted', logging.WARNING,
+                          job_id=str(job_id), kind=job['kind'], error=str(e))
+                return
+            except Exception as e:
+                log_event(self.app.logger, 'job-failed', logging.ERROR,
+                          job_id=str(job_id), kind=job['kind'], error=str(e))
+                now = datetime.now()
+                store.update(job_id, {'status': FAILED, 'error': str(e), 'updated_at': now, 'finished_at': now})
+                return
+            now = datetime.now()
+            store.update(job_id, {'status': SUCCEEDED, 'updated_at': now, 'finished_at': now})
+            log_event(self.app.logger, 'job-succeeded', job_id=str(job_id), kind=job['kind'], **job['progress'])
@@ -0,0 +1,45 @@
+from datetime import datetime
+from flask.json.provider import DefaultJSONProvider
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, Flask's json module is the fallback
+    orjson = None
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    # orjson handles datetimes itself; this keeps the fallback output identical
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes Mongo documents as they come back.
+
+    ObjectId becomes its hex string and datetime its ISO 8601 form, so
+    routes can return documents without converting them field by field.
+    Uses orjson when it is installed and Flask's json module otherwise.
+    """
+
+    default = staticmethod(_default)
+    # Key order follows the documents; sorting every response costs CPU
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # Skip the bytes -> str -> bytes round trip that dumps() would add
+        return self._app.response_class(orjson.dumps(obj, default=_default), mimetype=self.mimetype)
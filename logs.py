@@ -0,0 +1,152 @@
+"""Structured, low-overhead logging for the app.
+
+Log records carry their data as a ``fields`` dict instead of a formatted
+message. The request thread only puts the record on a queue; a
+QueueListener thread turns it into one JSON line and does the I/O.
+
+Each request produces a single ``request`` event with the method, route,
+status and duration plus whatever the route added with ``annotate``.
+Fields added with ``annotate_detail`` (request bodies and the like) are
+kept only for a sampled fraction of each route's requests.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+import weakref
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+# Fraction of requests whose annotate_detail fields are logged, unless
+# LOG_DEBUG_SAMPLE_RATES names a rate for the route
+DEFAULT_DEBUG_SAMPLE_RATE = 0.01
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': record.getMessage(),
+        }
+        event.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            event['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+
+    The stock handler formats the message before queueing it. Records
+    here hold an event name and a dict of plain values, so they can be
+    passed on untouched.
+    """
+
+    def prepare(self, record):
+        return record
+
+class LogPipeline:
+    """A queue handler plus the listener thread that drains it."""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.handler = LazyQueueHandler(queue.SimpleQueue())
+        self.listener = None
+
+    def start(self):
+        self.listener = QueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+    def _after_fork(self):
+        # The listener thread didn't survive the fork, and records the
+        # parent still had queued are the parent's to write
+        if self.listener:
+            self.handler.queue = queue.SimpleQueue()
+            self.start()
+
+_pipelines = weakref.WeakSet()
+
+def _restart_after_fork():
+    for pipeline in list(_pipelines):
+        pipeline._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+def parse_sample_rates(value):
+    """Parse ``"/task=0.5,/timer/stop=1"`` into ``{route: rate}``."""
+    rates = {}
+    for item in (value or '').split(','):
+        if item.strip():
+            route, _, rate = item.partition('=')
+            rates[route.strip()] = float(rate)
+    return rates
+
+def configure_logging(app):
+    """Send the app's logs through a LogPipeline and log one event per request."""
+    stream = logging.StreamHandler()
+    stream.setFormatter(JSONFormatter())
+    pipeline = LogPipeline([stream])
+    # Replaces Flask's default handler, which formats and writes inline
+    app.logger.handlers[:] = [pipeline.handler]
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+    app.logger.propagate = False
+    pipeline.start()
+    _pipelines.add(pipeline)
+    atexit.register(pipeline.stop)
+    app.extensions['log_pipeline'] = pipeline
+
+    default_rate = app.config['LOG_DEBUG_SAMPLE_RATE']
+    rates = app.config['LOG_DEBUG_SAMPLE_RATES']
+
+    @app.before_request
+    def start_request_log():
+        g.log_started = time.perf_counter()
+        g.log_fields = {}
+        route = request.url_rule.rule if request.url_rule else None
+        g.log_sampled = random.random() < rates.get(route, default_rate)
+
+    @app.after_request
+    def log_request(response):
+        # Requests rejected before before_request ran (e.g. a 405) have no state
+        if 'log_started' not in g:
+            return response
+        level = logging.ERROR if response.status_code >= 500 else logging.INFO
+        if app.logger.isEnabledFor(level):
+            fields = {
+                'method': request.method,
+                'route': request.url_rule.rule if request.url_rule else request.path,
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - g.log_started) * 1000, 2),
+            }
+            fields.update(g.log_fields)
+            if g.log_sampled:
+                fields['sampled'] = True
+            app.logger.log(level, 'request', extra={'fields': fields})
+        return response
+
+    return pipeline
+
+def annotate(**fields):
+    """Add fields to the current request's summary event."""
+    if has_request_context() and 'log_fields' in g:
+        g.log_fields.update(fields)
+
+def annotate_detail(**fields):
+    """Like annotate, but only for requests picked by the route's sample rate."""
+    if has_request_context() and g.get('log_sampled'):
+        g.log_fields.update(fields)
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Log a structured event outside of a request summary."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
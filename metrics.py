@@ -0,0 +1,276 @@
+"""Request and database metrics, exposed in the Prometheus text format.
+
+Every request is timed per route and counted while in flight. A PyMongo
+CommandListener times each database command by collection and command
+name and charges it to the request that issued it (PyMongo runs command
+listeners on the thread that runs the command). The split between
+database time and everything else (Python work, serialization) can also
+be sent back on each response as a ``Server-Timing`` header.
+
+Metrics live in process memory, so each server worker reports its own.
+"""
+import bisect
+import threading
+import time
+
+from flask import g, request
+from pymongo import monitoring
+
+from logs import annotate
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Route label for requests that matched no route, so stray URLs can't
+# create unbounded label values
+UNMATCHED_ROUTE = '<unmatched>'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + _labels(self.labelnames, labels), value
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{bound}"'
+                yield self.name + '_bucket' + _labels(self.labelnames, labels, le), cumulative
+            yield self.name + '_sum' + _labels(self.labelnames, labels), total
+            yield self.name + '_count' + _labels(self.labelnames, labels), cumulative
+
+class CallbackMetric:
+    """A metric whose ``(labels, value)`` pairs are read when scraped."""
+
+    def __init__(self, name, help, kind, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        self._collect = collect
+
+    def samples(self):
+        for labels, value in sorted(self._collect()):
+            yield self.name + _labels(self.labelnames, labels), value
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample, value in metric.samples():
+                lines.append(f'{sample} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+# Database commands issued by the request running on this thread
+_request_commands = threading.local()
+
+def _command_collection(event):
+    # Most commands name their collection as the command's value
+    target = event.command.get(event.command_name)
+    if isinstance(target, str):
+        return target
+    return event.command.get('collection', '-')
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every command PyMongo sends, by collection and command name."""
+
+    def __init__(self, registry):
+        self.durations = registry.add(Histogram(
+            'time2learn_db_command_duration_seconds',
+            'Database command round trip time by collection and command.',
+            ('collection', 'command'),
+        ))
+        self.failures = registry.add(Counter(
+            'time2learn_db_command_failures_total',
+            'Database commands that failed, by collection and command.',
+            ('collection', 'command'),
+        ))
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = _command_collection(event)
+
+    def _finished(self, event):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), '-')
+        labels = (collection, event.command_name)
+        seconds = event.duration_micros / 1e6
+        self.durations.observe(labels, seconds)
+        commands = getattr(_request_commands, 'value', None)
+        if commands is not None:
+            entry = commands.setdefault(labels, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        return labels
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self.failures.inc(self._finished(event))
+
+def register_cache_metrics(registry, caches):
+    """Report the hit rates and sizes of ReadThroughCaches (see cache.py)."""
+    def requests():
+        for cache in caches:
+            stats = cache.stats()
+            for result, key in (('hit', 'hits'), ('miss', 'misses'), ('coalesced', 'coalesced')):
+                yield (cache.name, result), stats[key]
+
+    def removals():
+        for cache in caches:
+            stats = cache.stats()
+            yield (cache.name, 'evicted'), stats['evictions']
+            yield (cache.name, 'expired'), stats['expirations']
+
+    registry.add(CallbackMetric(
+        'time2learn_cache_requests_total',
+        'Cache lookups by cache and result; coalesced misses waited on another request\'s load.',
+        'counter', ('cache', 'result'), requests,
+    ))
+    registry.add(CallbackMetric(
+        'time2learn_cache_removals_total',
+        'Cache entries dropped to stay within the size limit (evicted) or once too old (expired).',
+        'counter', ('cache', 'reason'), removals,
+    ))
+    registry.add(CallbackMetric(
+        'time2learn_cache_entries',
+        'Entries currently held, by cache.',
+        'gauge', ('cache',), lambda: [((cache.name,), cache.stats()['entries']) for cache in caches],
+    ))
+
+def configure_metrics(app):
+    """Time the app's requests and return the CommandListener to give PyMongo."""
+    registry = MetricsRegistry()
+    request_durations = registry.add(Histogram(
+        'time2learn_http_request_duration_seconds',
+        'Request latency by method, route and status.',
+        ('method', 'route', 'status'),
+    ))
+    in_flight = registry.add(Gauge(
+        'time2learn_http_requests_in_flight',
+        'Requests currently being handled, by route.',
+        ('route',),
+    ))
+    route_db_commands = registry.add(Counter(
+        'time2learn_route_db_commands_total',
+        'Database commands issued by each route, by collection and command.',
+        ('route', 'collection', 'command'),
+    ))
+    route_db_seconds = registry.add(Counter(
+        'time2learn_route_db_seconds_total',
+        'Database time spent by each route, by collection and command.',
+        ('route', 'collection', 'command'),
+    ))
+    listener = CommandMetrics(registry)
+    app.extensions['metrics'] = registry
+    server_timing = app.config['SERVER_TIMING']
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+        g.metrics_started = time.perf_counter()
+        in_flight.inc((g.metrics_route,))
+        _request_commands.value = {}
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_started' not in g:
+            return response
+        route = g.metrics_route
+        elapsed = time.perf_counter() - g.metrics_started
+        request_durations.observe((request.method, route, str(response.status_code)), elapsed)
+
+        commands = getattr(_request_commands, 'value', None) or {}
+        db_count = db_seconds = 0
+        for (collection, command), (count, seconds) in commands.items():
+            route_db_commands.inc((route, collection, command), count)
+            route_db_seconds.inc((route, collection, command), seconds)
+            db_count += count
+            db_seconds += seconds
+        if db_count:
+            annotate(db_commands=db_count, db_ms=round(db_seconds * 1000, 2))
+        if server_timing:
+            response.headers['Server-Timing'] = (
+                f'db;dur={db_seconds * 1000:.2f};desc="{db_count} commands", '
+                f'app;dur={max(elapsed - db_seconds, 0) * 1000:.2f}, '
+                f'total;dur={elapsed * 1000:.2f}'
+            )
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        # Runs even when the request failed before after_request
+        if 'metrics_route' in g:
+            in_flight.dec((g.metrics_route,))
+        _request_commands.value = None
+
+    return listener
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from sync import SYNC_OVERLAP
+
+# Quadrant folders are flagged with ``quadrant: True`` so the unique index
+# (declared in indexes.py) only covers them and user-created folders may
+# still share names
+QUADRANT_INDEX_NAME = 'quadrant_name_unique'
+
+def get_eisenhower_quadrant(priority):
+    if priority['urgent'] and priority['important']:
+        return "urgent_important"
+    elif not priority['urgent'] and priority['important']:
+        return "not_urgent_important"
+    elif priority['urgent'] and not priority['important']:
+        return "urgent_not_important"
+    else:
+        return "not_urgent_not_important"
+
+# Seconds between checks for quadrant folders deleted by other processes
+QUADRANT_REFRESH_SECONDS = 1.0
+
+# Folder tombstones read per query while checking
+_FOLDER_DELETES_PAGE = 1000
+
+class QuadrantFolderRegistry:
+    """Process-wide map from Eisenhower quadrant name to its folder ID.
+
+    Folders are resolved once through the folder store's atomic upsert, so
+    concurrent first writes (across threads or processes) can never create
+    duplicates, and the IDs are then served from memory. Deleting a
+    quadrant folder invalidates its entry and the next lookup upserts it
+    again.
+
+    Deletes made by other processes are noticed through the folder
+    tombstones in ``tombstone_store``, checked at most once per
+    ``refresh_interval``.
+    """
+
+    def __init__(self, folder_store, names, tombstone_store=None, refresh_interval=QUADRANT_REFRESH_SECONDS):
+        self._folders = folder_store
+        self._names = tuple(names)
+        self._tombstones = tombstone_store
+        self.refresh_interval = refresh_interval
+        self._ids = {}
+        self._seen_rev = 0
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def resolve_all(self):
+        for name in self._names:
+            self.folder_id(name)
+
+    def folder_id(self, name):
+        self._refresh()
+        folder_id = self._ids.get(name)
+        if folder_id is not None:
+            return folder_id
+        with self._lock:
+            folder_id = self._ids.get(name)
+            if folder_id is None:
+                folder_id = self._folders.resolve_quadrant(name)
+                self._ids[name] = folder_id
+            return folder_id
+
+    def invalidate(self, folder_id):
+        """Forget a quadrant folder that has been deleted.
+
+        Returns True if ``folder_id`` belonged to a quadrant.
+        """
+        with self._lock:
+            for name, known_id in list(self._ids.items()):
+                if known_id == folder_id:
+                    del self._ids[name]
+                    return True
+        return False
+
+    def _refresh(self):
+        if self._tombstones is None or time.monotonic() - self._checked < self.refresh_interval:
+            return
+        # One thread checks; the others carry on with the IDs they have
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            # Revisions are allocated before the write that uses them, so
+            # a delete can land behind one already seen; see SYNC_OVERLAP
+            after = max(self._seen_rev - SYNC_OVERLAP, 0)
+            while True:
+                deletes = self._tombstones.since(after, _FOLDER_DELETES_PAGE, kind='folder')
+                for tombstone in deletes:
+                    self.invalidate(tombstone['folder_id'])
+                if deletes:
+                    after = deletes[-1]['rev']
+                    self._seen_rev = max(self._seen_rev, after)
+                if len(deletes) < _FOLDER_DELETES_PAGE:
+                    break
+            self._checked = time.monotonic()
+        finally:
+            self._refresh_lock.release()
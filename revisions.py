@@ -0,0 +1,22 @@
+import zlib
+
+# Scope bumped by every write to the tasks collection
+TASKS_SCOPE = 'tasks'
+
+# Revision numbers are kept per listing scope and shared by all workers
+# through the storage backend's RevisionStore. Write routes bump the scopes
+# they touch after the write succeeds, and listing routes read the
+# revision before querying, so an ETag can only ever be older than the
+# data it was sent with, never newer.
+
+def folder_scope(folder_id):
+    return f"folder:{folder_id}"
+
+def listing_etag(scope, revision, query_string):
+    """Strong ETag for one representation of a listing.
+
+    The query string is folded in because fields, limit and after each
+    change the body returned for the same revision.
+    """
+    variant = zlib.crc32(query_string) & 0xffffffff
+    return f"{scope}-{revision}-{variant:08x}"
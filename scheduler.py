@@ -0,0 +1,172 @@
+"""Ranking behind GET /next: which tasks to work on next.
+
+Every task with a priority gets a ``start_by`` time, the latest moment it
+should be started, and tasks are ranked earliest first:
+
+- A task without a due date can wait ``WAIT_HORIZONS[quadrant]`` after it
+  was created, so older tasks move up and less important quadrants wait
+  longer before they catch up.
+- A task with a due date must start by ``due_at`` minus its ``estimate``
+  (its ``latest_start``, stored with the task) minus
+  ``DUE_LEADS[quadrant]``, the margin its quadrant deserves; if that is
+  earlier than its wait horizon it is what counts.
+
+``start_by`` never changes as time passes, so neither does the ranking;
+only writes change it. That lets a ``NextUpIndex`` keep every task in a
+heap that is updated as tasks change instead of scoring and sorting them
+all per request, and lets the stores answer the same ranking from
+ordinary indexes (see ``next_up_from_store``) until the heap has loaded.
+"""
+import heapq
+from datetime import datetime, timedelta
+
+from quadrants import get_eisenhower_quadrant
+from task_index import SyncedTaskIndex, REFRESH_SECONDS
+
+WAIT_HORIZONS = {
+    'urgent_important': timedelta(0),
+    'urgent_not_important': timedelta(days=1),
+    'not_urgent_important': timedelta(days=3),
+    'not_urgent_not_important': timedelta(days=14),
+}
+
+DUE_LEADS = {
+    'urgent_important': timedelta(days=1),
+    'not_urgent_important': timedelta(days=1),
+    'urgent_not_important': timedelta(hours=4),
+    'not_urgent_not_important': timedelta(0),
+}
+
+# Largest accepted estimate, in minutes (a working year)
+MAX_ESTIMATE_MINUTES = 365 * 8 * 60
+
+# Task fields the ranking reads, and the ones GET /next returns
+SCHEDULE_FIELDS = ['name', 'folder_id', 'priority', 'created_at', 'due_at', 'estimate', 'latest_start']
+
+def parse_schedule(data):
+    """Read the optional ``due_at`` (ISO 8601) and ``estimate`` (minutes)
+    of a task being created.
+
+    Returns the fields to store, including the derived ``latest_start``;
+    raises ValueError for malformed values.
+    """
+    fields = {}
+    due_at = data.get('due_at')
+    estimate = data.get('estimate')
+    if estimate is not None:
+        if isinstance(estimate, bool) or not isinstance(estimate, (int, float)) or not 0 < estimate <= MAX_ESTIMATE_MINUTES:
+            raise ValueError(f"'estimate' must be a number of minutes between 0 and {MAX_ESTIMATE_MINUTES}")
+        fields['estimate'] = estimate
+    if due_at is not None:
+        try:
+            due_at = datetime.fromisoformat(due_at)
+        except (TypeError, ValueError):
+            raise ValueError("'due_at' must be an ISO 8601 date and time")
+        # Stored like created_at, as naive local time
+        if due_at.tzinfo is not None:
+            due_at = due_at.astimezone().replace(tzinfo=None)
+        fields['due_at'] = due_at
+        fields['latest_start'] = due_at - timedelta(minutes=estimate or 0)
+    return fields
+
+def start_by(task):
+    """When work on ``task`` should start at the latest; None for tasks
+    without a priority, which GET /next leaves out."""
+    priority = task.get('priority')
+    if not priority:
+        return None
+    quadrant = get_eisenhower_quadrant(priority)
+    deadline = task['created_at'] + WAIT_HORIZONS[quadrant]
+    if task.get('latest_start') is not None:
+        deadline = min(deadline, task['latest_start'] - DUE_LEADS[quadrant])
+    return deadline
+
+def describe(task, key, now):
+    """A ranked task as GET /next returns it."""
+    described = {field: task.get(field) for field in SCHEDULE_FIELDS if field != 'latest_start'}
+    described['_id'] = task['_id']
+    described['quadrant'] = get_eisenhower_quadrant(task['priority'])
+    described['start_by'] = key
+    # Negative once the task should already have been started
+    described['slack_hours'] = round((key - now).total_seconds() / 3600, 2)
+    return described
+
+def next_up_from_store(task_store, n):
+    """The ``n`` first tasks by ``start_by``, from the store's indexes.
+
+    ``start_by`` is the earlier of two keys, each a fixed offset per
+    quadrant from a stored field, so a quadrant's first ``n`` tasks are
+    among its first ``n`` by ``created_at`` and its first ``n`` by
+    ``latest_start``: eight short indexed queries whose results are merged.
+    """
+    candidates = {}
+    for urgent in (True, False):
+        for important in (True, False):
+            priority = {'urgent': urgent, 'important': important}
+            for field in ('created_at', 'latest_start'):
+                for task in task_store.earliest(priority, field, n, fields=SCHEDULE_FIELDS):
+                    candidates[task['_id']] = task
+    ranked = heapq.nsmallest(n, ((start_by(task), task['_id']) for task in candidates.values()))
+    return [(candidates[task_id], key) for key, task_id in ranked]
+
+class NextUpIndex(SyncedTaskIndex):
+    """Every task with a priority in a heap ordered by ``start_by``.
+
+    Changed and deleted tasks are not searched for in the heap: the
+    current key of each task is kept in ``_current`` and heap entries that
+    no longer match it are dropped as they surface. The heap is rebuilt
+    when such dead entries outnumber the live ones.
+    """
+
+    fields = SCHEDULE_FIELDS
+    name = 'next-up-index'
+
+    def __init__(self, refresh_interval=REFRESH_SECONDS):
+        super().__init__(refresh_interval)
+        self._heap = []
+        self._current = {}
+
+    def _rebuild(self, tasks):
+        self._current = {}
+        for task in tasks:
+            key = start_by(task)
+            if key is not None:
+                self._current[task['_id']] = (key, {field: task.get(field) for field in SCHEDULE_FIELDS})
+        self._heapify()
+
+    def _heapify(self):
+        self._heap = [(key, task_id) for task_id, (key, _) in self._current.items()]
+        heapq.heapify(self._heap)
+
+    def _add(self, task):
+        key = start_by(task)
+        if key is None:
+            self._current.pop(task['_id'], None)
+            return
+        self._current[task['_id']] = (key, {field: task.get(field) for field in SCHEDULE_FIELDS})
+        heapq.heappush(self._heap, (key, task['_id']))
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._heapify()
+
+    def _remove(self, task_id):
+        self._current.pop(task_id, None)
+
+    def top(self, n):
+        """The ``n`` first tasks as ``(task, start_by)`` pairs.
+
+        Pops them off the heap and pushes them back, so a request costs
+        O(n log N) however many tasks there are.
+        """
+        ranked = []
+        with self._lock:
+            while self._heap and len(ranked) < n:
+                key, task_id = heapq.heappop(self._heap)
+                current = self._current.get(task_id)
+                # Dead entries, and repeats left by a task re-added with
+                # an unchanged key, are dropped for good
+                if current is None or current[0] != key or (ranked and ranked[-1][0] == (key, task_id)):
+                    continue
+                ranked.append(((key, task_id), current[1]))
+            for entry, _ in ranked:
+                heapq.heappush(self._heap, entry)
+        return [(dict(task, _id=task_id), key) for (key, task_id), task in ranked]
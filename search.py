@@ -0,0 +1,97 @@
+"""Task name search behind GET /task/search.
+
+Full-word queries go to the storage backend's text index, see
+``TaskStore.search``. Autocomplete is served from a ``TaskPrefixIndex``:
+every word of every task name, paired with the task's ID, in one sorted
+list that bisect narrows to the words starting with a prefix.
+
+The prefix index lives in process memory and is kept current as
+described in task_index.py.
+"""
+import bisect
+import heapq
+import re
+
+from task_index import SyncedTaskIndex, REFRESH_SECONDS
+
+_WORD = re.compile(r'\w+')
+
+# Index entries examined per prefix query, which bounds the cost of a
+# one-letter prefix; ranking only considers the entries examined
+MAX_PREFIX_SCAN = 5000
+
+def tokenize(text):
+    """Split text into lowercase words, the unit every search matches on."""
+    # Routes only accept string names, but older tasks may hold anything
+    if not isinstance(text, str):
+        text = '' if text is None else str(text)
+    return _WORD.findall(text.lower())
+
+class TaskPrefixIndex(SyncedTaskIndex):
+    """Sorted ``(word, task ID)`` pairs for every task in the database.
+
+    Holds only each task's ``_id``, ``name`` and ``folder_id``, which is
+    what prefix results carry.
+    """
+
+    fields = ['name', 'folder_id']
+    name = 'prefix-index'
+
+    def __init__(self, refresh_interval=REFRESH_SECONDS):
+        super().__init__(refresh_interval)
+        self._entries = []
+        self._tasks = {}
+
+    def _rebuild(self, tasks):
+        self._tasks = {}
+        self._entries = []
+        for task in tasks:
+            self._tasks[task['_id']] = {'_id': task['_id'], 'name': task['name'], 'folder_id': task.get('folder_id')}
+            self._entries.extend((word, task['_id']) for word in set(tokenize(task['name'])))
+        self._entries.sort()
+
+    def _add(self, task):
+        self._remove(task['_id'])
+        self._tasks[task['_id']] = {'_id': task['_id'], 'name': task['name'], 'folder_id': task.get('folder_id')}
+        for word in set(tokenize(task['name'])):
+            bisect.insort(self._entries, (word, task['_id']))
+
+    def _remove(self, task_id):
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return
+        for word in set(tokenize(task['name'])):
+            index = bisect.bisect_left(self._entries, (word, task_id))
+            if index < len(self._entries) and self._entries[index] == (word, task_id):
+                del self._entries[index]
+
+    def search(self, query, folder_id=None, limit=20):
+        """Tasks matching ``query`` as typed so far, best matches first.
+
+        The last word is a prefix; any earlier words must appear whole in
+        the name. Exact words rank first, then words nearer the start of
+        the name, then shorter names.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        *whole_words, prefix = words
+        best = {}
+        with self._lock:
+            start = bisect.bisect_left(self._entries, (prefix,))
+            end = min(start + MAX_PREFIX_SCAN, len(self._entries))
+            for word, task_id in self._entries[start:end]:
+                if not word.startswith(prefix):
+                    break
+                task = self._tasks[task_id]
+                if folder_id is not None and task['folder_id'] != folder_id:
+                    continue
+                name_words = tokenize(task['name'])
+                if any(whole not in name_words for whole in whole_words):
+                    continue
+                name = str(task['name'])
+                rank = (word != prefix, name_words.index(word), len(name), name, task_id)
+                if task_id not in best or rank < best[task_id]:
+                    best[task_id] = rank
+            ranked = heapq.nsmallest(limit, best.values())
+            return [dict(self._tasks[rank[-1]]) for rank in ranked]
@@ -38,10 +38,27 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // How often to ask the server for tasks changed since the last sync.
+    // While the /events stream is open it delivers changes as they happen,
+    // and polling only catches what was published by other server workers.
+    const SYNC_INTERVAL_MS = 5000;
+    const LIVE_SYNC_INTERVAL_MS = 60000;
+    let syncToken = null;
+    let liveUpdates = false;
+
     function addTaskToQuadrant(task) {
-        const quadrantId = getQuadrantId(task.priority);
-        const taskElement = createTaskElement(task);
-        quadrants[quadrantId].appendChild(taskElement);
+        // A task seen again (e.g. after a move) replaces its old entry
+        removeTaskElement(task._id);
+        // Tasks added straight to a folder have no priority and no quadrant
+        if (!task.priority) return;
+        const list = quadrants[getQuadrantId(task.priority)];
+        // Keep the "more tasks" note, if any, at the end of the list
+        list.insertBefore(createTaskElement(task), list.querySelector('.more-tasks'));
+    }
+
+    function removeTaskElement(taskId) {
+        const existing = document.querySelector(`.task-item[data-task-id="${taskId}"]`);
+        if (existing) existing.remove();
     }
 
     function getQuadrantId(priority) {
@@ -54,21 +71,100 @@ document.addEventListener('DOMContentLoaded', function() {
     function createTaskElement(task) {
         const li = document.createElement('li');
         li.className = 'task-item';
-        li.innerHTML = `
-            ${task.name}
-            <button onclick="deleteTask('${task._id}', this)">Delete</button>
-        `;
+        li.dataset.taskId = task._id;
+        const button = document.createElement('button');
+        button.textContent = 'Delete';
+        button.addEventListener('click', () => deleteTask(task._id, button));
+        li.append(task.name, ' ', button);
         return li;
     }
 
-    // Load existing tasks
-    fetch('/task')
-        .then(response => response.json())
-        .then(tasks => {
-            tasks.forEach(addTaskToQuadrant);
-        })
+    function renderMatrix(matrix) {
+        // The server takes the sync token before reading the tasks, so
+        // nothing written in between is missed
+        syncToken = matrix.next;
+        Object.entries(matrix.quadrants).forEach(([name, quadrant]) => {
+            // Build each list off-document and insert it in one go, so a
+            // quadrant costs one layout rather than one per task
+            const fragment = document.createDocumentFragment();
+            quadrant.tasks.forEach(task => fragment.appendChild(createTaskElement(task)));
+            const hidden = quadrant.count - quadrant.tasks.length;
+            if (hidden > 0) {
+                const more = document.createElement('li');
+                more.className = 'more-tasks';
+                more.textContent = `and ${hidden} more`;
+                fragment.appendChild(more);
+            }
+            // Server quadrant names use underscores, element IDs dashes
+            quadrants[name.replace(/_/g, '-')].replaceChildren(fragment);
+        });
+    }
+
+    function loadAllTasks() {
+        return fetch('/matrix')
+            .then(response => response.json())
+            .then(renderMatrix);
+    }
+
+    function loadInitialTasks() {
+        // index() embeds the matrix in the page when the database is up
+        const matrix = JSON.parse(document.getElementById('initial-matrix').textContent);
+        if (!matrix) return loadAllTasks();
+        renderMatrix(matrix);
+        return Promise.resolve();
+    }
+
+    function syncChanges() {
+        if (syncToken === null) return loadAllTasks();
+        return fetch(`/task/changes?since=${encodeURIComponent(syncToken)}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.reset) return loadAllTasks();
+                data.tasks.forEach(addTaskToQuadrant);
+                data.deleted.forEach(removeTaskElement);
+                syncToken = data.next;
+                if (data.has_more) return syncChanges();
+            });
+    }
+
+    function listenForEvents() {
+        if (!window.EventSource) return;
+        const events = new EventSource('/events');
+        events.onopen = function() {
+            liveUpdates = true;
+            // Catch up on anything missed while disconnected
+            syncChanges().catch((error) => {
+                console.error('Error:', error);
+            });
+        };
+        events.onerror = function() {
+            // EventSource reconnects by itself; poll quickly in the meantime
+            liveUpdates = false;
+        };
+        events.addEventListener('task-created', (e) => addTaskToQuadrant(JSON.parse(e.data)));
+        events.addEventListener('task-moved', (e) => addTaskToQuadrant(JSON.parse(e.data)));
+        events.addEventListener('task-deleted', (e) => removeTaskElement(JSON.parse(e.data)._id));
+    }
+
+    function scheduleSync() {
+        setTimeout(() => {
+            syncChanges()
+                .catch((error) => {
+                    console.error('Error:', error);
+                })
+                .finally(scheduleSync);
+        }, liveUpdates ? LIVE_SYNC_INTERVAL_MS : SYNC_INTERVAL_MS);
+    }
+
+    // Show existing tasks, then keep them up to date with pushed events
+    // and deltas
+    loadInitialTasks()
         .catch((error) => {
             console.error('Error:', error);
+        })
+        .finally(() => {
+            listenForEvents();
+            scheduleSync();
         });
 });
 
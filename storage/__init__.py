@@ -0,0 +1,27 @@
+"""Storage backends behind the routes in App.py.
+
+Every route goes through a Storage object's task, folder, timer, time log,
+revision and tombstone stores (see storage/base.py). The backend is chosen
+with ``create_storage``:
+
+- ``mongo``: MongoDB, the production backend
+- ``sqlite``: an embedded SQLite file, for local runs and edge deployments
+- ``memory``: plain Python dicts, for tests and benchmarks
+"""
+from storage.base import Storage
+# Imported up front rather than on first use: a process forked while a
+# background thread was importing one would inherit a half-built module
+from storage.memory import MemoryStorage
+from storage.mongo import MongoStorage
+from storage.sqlite import SQLiteStorage
+
+BACKENDS = ('mongo', 'sqlite', 'memory')
+
+def create_storage(backend, mongo_uri=None, sqlite_path=None, **options):
+    if backend == 'mongo':
+        return MongoStorage(mongo_uri, **options)
+    if backend == 'sqlite':
+        return SQLiteStorage(sqlite_path)
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
@@ -0,0 +1,233 @@
+"""Interfaces every storage backend implements.
+
+Documents cross this boundary in the shape MongoDB uses: tasks, folders
+and timers are dicts whose ``_id`` is an ObjectId, timestamps are naive
+datetimes, and a task's ``folder_id`` is the folder's ID as a string.
+"""
+
+def project(doc, fields):
+    """Keep only ``fields`` (plus ``_id``) of a document; None keeps everything."""
+    if doc is None or fields is None:
+        return doc
+    projected = {'_id': doc['_id']}
+    for field in fields:
+        if field in doc:
+            projected[field] = doc[field]
+    return projected
+
+class TaskStore:
+    def insert(self, task):
+        """Store a new task, setting ``task['_id']``."""
+        raise NotImplementedError
+
+    def insert_many(self, tasks):
+        """Store new tasks, setting each ``_id``.
+
+        Returns ``{position: error message}`` for tasks that were not stored.
+        """
+        raise NotImplementedError
+
+    def get(self, task_id, fields=None):
+        raise NotImplementedError
+
+    def find(self, folder_id=None, after=None, limit=None, fields=None):
+        """Iterate tasks in ``_id`` order, optionally within one folder,
+        strictly after the ``after`` ID and at most ``limit`` of them.
+
+        The iterator may hold a cursor; close it if not exhausted.
+        """
+        raise NotImplementedError
+
+    def update(self, task_id, changes):
+        """Set ``changes`` on one task and return the task as it was before,
+        or None if there is no such task."""
+        raise NotImplementedError
+
+    def update_many(self, updates):
+        """Apply ``[(task_id, changes), ...]``.
+
+        Returns ``(before, errors)``: the pre-update task for every ID that
+        exists and ``{position: error message}`` for updates that failed.
+        """
+        raise NotImplementedError
+
+    def delete(self, task_id):
+        """Delete one task and return it, or None if there is no such task."""
+        raise NotImplementedError
+
+    def delete_many(self, task_ids):
+        """Delete tasks and return the ones that existed."""
+        raise NotImplementedError
+
+    def changed_since(self, rev, limit):
+        """Tasks whose ``rev`` is greater than ``rev``, in ``rev`` order."""
+        raise NotImplementedError
+
+    def group_by_folder(self, folder_ids, limit):
+        """Count the tasks in each of ``folder_ids`` and take the first
+        ``limit`` of them in ``_id`` order, in one query.
+
+        Returns ``{folder_id: {'count': n, 'tasks': [...]}}``; folders
+        without tasks are left out.
+        """
+        raise NotImplementedError
+
+    def earliest(self, priority, field, limit, fields=None):
+        """The first ``limit`` tasks with exactly this ``priority``
+        (``{'urgent': bool, 'important': bool}``) in ascending order of
+        ``field``; tasks without the field are left out. Feeds GET /next
+        while its in-process index loads, see scheduler.py.
+        """
+        raise NotImplementedError
+
+    def search(self, words, folder_id=None, limit=20):
+        """Tasks whose name contains any of ``words``, best matches first.
+
+        ``words`` are whole words as split by ``search.tokenize``; served
+        by the backend's text index.
+        """
+        raise NotImplementedError
+
+class FolderStore:
+    def insert(self, folder):
+        """Store a new folder, setting ``folder['_id']``."""
+        raise NotImplementedError
+
+    def get(self, folder_id):
+        raise NotImplementedError
+
+    def delete(self, folder_id):
+        """Delete a folder; returns False if there was no such folder."""
+        raise NotImplementedError
+
+    def resolve_quadrant(self, name):
+        """Return the ID (as a string) of the quadrant folder called ``name``,
+        creating it if needed. Concurrent callers always get the same folder.
+        """
+        raise NotImplementedError
+
+class TimerStore:
+    """Timer state machine, see timers.py for the states.
+
+    Every transition is atomic and returns the updated timer, or None when
+    the task has no timer in the required state.
+    """
+
+    def start(self, task_id, now=None):
+        raise NotImplementedError
+
+    def pause(self, task_id, now=None):
+        raise NotImplementedError
+
+    def resume(self, task_id, now=None):
+        raise NotImplementedError
+
+    def stop(self, task_id, now=None):
+        raise NotImplementedError
+
+    def delete_for_tasks(self, task_ids):
+        """Delete every timer of the given tasks (IDs as strings)."""
+        raise NotImplementedError
+
+    def mark_logged(self, timer_id):
+        """Note that a stopped timer's time entry has been recorded."""
+        raise NotImplementedError
+
+    def unlogged(self, stopped_before, limit):
+        """Stopped timers whose time entry is not recorded yet, stopped
+        before ``stopped_before``."""
+        raise NotImplementedError
+
+class TimeLogStore:
+    """Stopped-timer history plus per-day rollups, see time_entries.py."""
+
+    def record(self, timer, folder_id=None, quadrant=None):
+        """Record a stopped timer's entry and add it to the rollups.
+
+        Entries are keyed by the timer's ``_id``: recording a timer again
+        adds nothing, so a failed recording can simply be retried.
+        """
+        raise NotImplementedError
+
+    def totals(self, group, start_day=None, end_day=None):
+        """Sum one rollup group over an inclusive day range.
+
+        Returns ``[{'key', 'seconds', 'entries'}]`` ordered by time spent.
+        """
+        raise NotImplementedError
+
+class RevisionStore:
+    """Named counters shared by every worker, see revisions.py."""
+
+    def current(self, scope):
+        raise NotImplementedError
+
+    def allocate(self, scope, count=1):
+        """Reserve ``count`` consecutive revisions and return the first one."""
+        raise NotImplementedError
+
+    def bump(self, *scopes):
+        raise NotImplementedError
+
+class TombstoneStore:
+    def add_many(self, tombstones):
+        raise NotImplementedError
+
+    def since(self, rev, limit, kind=None):
+        """Tombstones whose ``rev`` is greater than ``rev``, in ``rev`` order;
+        only those of one ``kind`` ('task' or 'folder') if given."""
+        raise NotImplementedError
+
+class JobStore:
+    """Records of background jobs, see jobs.py."""
+
+    def insert(self, job):
+        """Store a new job, setting ``job['_id']``."""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def update(self, job_id, changes):
+        raise NotImplementedError
+
+    def claim_stale(self, before, now):
+        """Take one unfinished job last updated before ``before``.
+
+        Sets its ``updated_at`` to ``now`` and returns it, or None if there
+        is no such job. Concurrent callers never get the same job.
+        """
+        raise NotImplementedError
+
+class Storage:
+    """One backend's set of stores, as used by the routes."""
+
+    name = None
+
+    tasks = None
+    folders = None
+    timers = None
+    time_log = None
+    revisions = None
+    tombstones = None
+    jobs = None
+
+    def ping(self):
+        """Raise if the backend cannot be reached."""
+
+    def ensure_indexes(self):
+        """Create missing indexes; returns ``(collection, index, error)`` failures."""
+        return []
+
+    def upgrade(self):
+        """Bring documents written by older versions up to date; run after
+        ``ensure_indexes``. Returns how many were changed, by collection."""
+        return {}
+
+    def for_reads(self):
+        """The stores GET routes read from; may lag writes slightly on
+        backends that can read from replicas."""
+        return self
+
+    def close(self):
+        pass
@@ -0,0 +1,399 @@
+import bisect
+import copy
+import heapq
+import threading
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from storage.base import (
+    Storage, TaskStore, FolderStore, TimerStore, TimeLogStore, RevisionStore, TombstoneStore, JobStore, project,
+)
+from jobs import UNFINISHED, JOB_TTL_SECONDS
+from search import tokenize
+from timers import RUNNING, PAUSED, STOPPED_TIMER_TTL_SECONDS, new_timer, apply_pause, apply_resume, apply_stop
+from time_entries import build_entry, rollup_keys
+from sync import TOMBSTONE_TTL_SECONDS
+
+# Documents are copied on the way in and out so callers can never mutate
+# what the store holds, the same as with a real database.
+
+class _SortedIds:
+    def __init__(self):
+        self._ids = []
+
+    def add(self, key):
+        bisect.insort(self._ids, key)
+
+    def remove(self, key):
+        index = bisect.bisect_left(self._ids, key)
+        if index < len(self._ids) and self._ids[index] == key:
+            del self._ids[index]
+
+    def after(self, key=None):
+        start = 0 if key is None else bisect.bisect_right(self._ids, key)
+        return self._ids[start:]
+
+    def __len__(self):
+        return len(self._ids)
+
+class MemoryTaskStore(TaskStore):
+    def __init__(self, lock):
+        self._lock = lock
+        self._tasks = {}
+        self._ids = _SortedIds()
+        self._by_folder = {}
+        self._by_rev = _SortedIds()
+        self._by_word = {}
+
+    def _index(self, task):
+        self._ids.add(task['_id'])
+        self._by_folder.setdefault(task.get('folder_id'), _SortedIds()).add(task['_id'])
+        if task.get('rev') is not None:
+            self._by_rev.add((task['rev'], task['_id']))
+        for word in set(tokenize(task.get('name'))):
+            self._by_word.setdefault(word, set()).add(task['_id'])
+
+    def _unindex(self, task):
+        self._ids.remove(task['_id'])
+        folder_ids = self._by_folder.get(task.get('folder_id'))
+        if folder_ids is not None:
+            folder_ids.remove(task['_id'])
+            if not len(folder_ids):
+                del self._by_folder[task.get('folder_id')]
+        if task.get('rev') is not None:
+            self._by_rev.remove((task['rev'], task['_id']))
+        for word in set(tokenize(task.get('name'))):
+            word_ids = self._by_word.get(word)
+            if word_ids is not None:
+                word_ids.discard(task['_id'])
+                if not word_ids:
+                    del self._by_word[word]
+
+    def _insert(self, task):
+        task.setdefault('_id', ObjectId())
+        if task['_id'] in self._tasks:
+            raise ValueError(f"Duplicate task ID {task['_id']}")
+        stored = copy.deepcopy(task)
+        self._tasks[task['_id']] = stored
+        self._index(stored)
+
+    def insert(self, task):
+        with self._lock:
+            self._insert(task)
+
+    def insert_many(self, tasks):
+        errors = {}
+        with self._lock:
+            for position, task in enumerate(tasks):
+                try:
+                    self._insert(task)
+                except ValueError as e:
+                    errors[position] = str(e)
+        return errors
+
+    def get(self, task_id, fields=None):
+        with self._lock:
+            return project(copy.deepcopy(self._tasks.get(task_id)), fields)
+
+    def find(self, folder_id=None, after=None, limit=None, fields=None):
+        with self._lock:
+            ids = self._ids if folder_id is None else self._by_folder.get(folder_id, _SortedIds())
+            selected = ids.after(after)
+            if limit is not None:
+                selected = selected[:limit]
+            tasks = [project(copy.deepcopy(self._tasks[task_id]), fields) for task_id in selected]
+        # A generator, like the other stores' cursors, so callers can close it
+        yield from tasks
+
+    def _update(self, task_id, changes):
+        task = self._tasks.get(task_id)
+        if task is None:
+            return None
+        before = copy.deepcopy(task)
+        self._unindex(task)
+        task.update(copy.deepcopy(changes))
+        self._index(task)
+        return before
+
+    def update(self, task_id, changes):
+        with self._lock:
+            return self._update(task_id, changes)
+
+    def update_many(self, updates):
+        before = {}
+        with self._lock:
+            for task_id, changes in updates:
+                previous = self._update(task_id, changes)
+                if previous is not None:
+                    before[task_id] = previous
+        return before, {}
+
+    def _delete(self, task_id):
+        task = self._tasks.pop(task_id, None)
+        if task is not None:
+            self._unindex(task)
+        return task
+
+    def delete(self, task_id):
+        with self._lock:
+            return self._delete(task_id)
+
+    def delete_many(self, task_ids):
+        with self._lock:
+            deleted = [self._delete(task_id) for task_id in task_ids]
+        return [task for task in deleted if task is not None]
+
+    def changed_since(self, rev, limit):
+        with self._lock:
+            # No ObjectId sorts after ff..ff, so this skips every task at exactly rev
+            keys = self._by_rev.after((rev, ObjectId('f' * 24)))[:limit]
+            return [copy.deepcopy(self._tasks[task_id]) for _, task_id in keys]
+
+    def group_by_folder(self, folder_ids, limit):
+        groups = {}
+        with self._lock:
+            for folder_id in folder_ids:
+                ids = self._by_folder.get(folder_id)
+                if ids:
+                    tasks = [copy.deepcopy(self._tasks[task_id]) for task_id in ids.after()[:limit]]
+                    groups[folder_id] = {'count': len(ids), 'tasks': tasks}
+        return groups
+
+    def earliest(self, priority, field, limit, fields=None):
+        with self._lock:
+            matches = [
+                task for task in self._tasks.values()
+                if task.get(field) is not None and task.get('priority')
+                and bool(task['priority']['urgent']) == priority['urgent']
+                and bool(task['priority']['important']) == priority['important']
+            ]
+            ranked = heapq.nsmallest(limit, matches, key=lambda task: (task[field], task['_id']))
+            return [project(copy.deepcopy(task), fields) for task in ranked]
+
+    def search(self, words, folder_id=None, limit=20):
+        with self._lock:
+            # Ranked by how many of the words each name contains
+            matches = {}
+            for word in set(words):
+                for task_id in self._by_word.get(word, ()):
+                    matches[task_id] = matches.get(task_id, 0) + 1
+            if folder_id is not None:
+                matches = {task_id: count for task_id, count in matches.items()
+                           if self._tasks[task_id].get('folder_id') == folder_id}
+            ranked = heapq.nsmallest(limit, matches, key=lambda task_id: (-matches[task_id], task_id))
+            return [copy.deepcopy(self._tasks[task_id]) for task_id in ranked]
+
+class MemoryFolderStore(FolderStore):
+    def __init__(self, lock):
+        self._lock = lock
+        self._folders = {}
+
+    def insert(self, folder):
+        folder.setdefault('_id', ObjectId())
+        with self._lock:
+            self._folders[folder['_id']] = copy.deepcopy(folder)
+
+    def get(self, folder_id):
+        with self._lock:
+            return copy.deepcopy(self._folders.get(folder_id))
+
+    def delete(self, folder_id):
+        with self._lock:
+            return self._folders.pop(folder_id, None) is not None
+
+    def resolve_quadrant(self, name):
+        with self._lock:
+            named = [folder for folder in self._folders.values() if folder['name'] == name]
+            # Prefer the flagged quadrant folder, then adopt a plain one
+            named.sort(key=lambda folder: not folder.get('quadrant'))
+            if named:
+                folder = named[0]
+                folder['quadrant'] = True
+            else:
+                folder = {'_id': ObjectId(), 'name': name, 'quadrant': True, 'created_at': datetime.now()}
+                self._folders[folder['_id']] = folder
+            return str(folder['_id'])
+
+class MemoryTimerStore(TimerStore):
+    def __init__(self, lock):
+        self._lock = lock
+        self._timers = {}
+        self._active = {}
+
+    def start(self, task_id, now=None):
+        timer = new_timer(task_id, now)
+        timer['_id'] = ObjectId()
+        with self._lock:
+            if task_id in self._active:
+                return None
+            self._timers[timer['_id']] = copy.deepcopy(timer)
+            self._active[task_id] = timer['_id']
+        return timer
+
+    def _transition(self, task_id, states, apply, now):
+        with self._lock:
+            timer_id = self._active.get(task_id)
+            timer = self._timers.get(timer_id)
+            if timer is None or timer['state'] not in states:
+                return None
+            apply(timer, now or datetime.now())
+            if not timer.get('active'):
+                del self._active[task_id]
+                self._purge_stopped(timer['stopped_at'])
+            return copy.deepcopy(timer)
+
+    def _purge_stopped(self, now):
+        horizon = now - timedelta(seconds=STOPPED_TIMER_TTL_SECONDS)
+        for timer_id, timer in list(self._timers.items()):
+            if timer.get('stopped_at') is not None and timer['stopped_at'] < horizon:
+                del self._timers[timer_id]
+
+    def pause(self, task_id, now=None):
+        return self._transition(task_id, (RUNNING,), apply_pause, now)
+
+    def resume(self, task_id, now=None):
+        return self._transition(task_id, (PAUSED,), apply_resume, now)
+
+    def stop(self, task_id, now=None):
+        return self._transition(task_id, (RUNNING, PAUSED), apply_stop, now)
+
+    def delete_for_tasks(self, task_ids):
+        task_ids = set(task_ids)
+        with self._lock:
+            for timer_id, timer in list(self._timers.items()):
+                if timer['task_id'] in task_ids:
+                    del self._timers[timer_id]
+            for task_id in task_ids:
+                self._active.pop(task_id, None)
+
+    def mark_logged(self, timer_id):
+        with self._lock:
+            timer = self._timers.get(timer_id)
+            if timer is not None:
+                timer.pop('unlogged', None)
+
+    def unlogged(self, stopped_before, limit):
+        with self._lock:
+            timers = [
+                copy.deepcopy(timer) for timer in self._timers.values()
+                if timer.get('unlogged') and timer['stopped_at'] < stopped_before
+            ]
+        return timers[:limit]
+
+class MemoryTimeLogStore(TimeLogStore):
+    def __init__(self, lock):
+        self._lock = lock
+        self._entries = {}
+        self._rollups = {}
+
+    def record(self, timer, folder_id=None, quadrant=None):
+        entry = build_entry(timer, folder_id, quadrant)
+        with self._lock:
+            if entry['timer_id'] in self._entries:
+                return entry
+            self._entries[entry['timer_id']] = copy.deepcopy(entry)
+            for group, key in rollup_keys(entry):
+                rollup = self._rollups.setdefault((group, key, entry['day']), {'seconds': 0, 'entries': 0})
+                rollup['seconds'] += entry['elapsed']
+                rollup['entries'] += 1
+        return entry
+
+    def totals(self, group, start_day=None, end_day=None):
+        totals = {}
+        with self._lock:
+            for (rollup_group, key, day), rollup in self._rollups.items():
+                if rollup_group != group:
+                    continue
+                if (start_day and day < start_day) or (end_day and day > end_day):
+                    continue
+                total = totals.setdefault(key, {'key': key, 'seconds': 0, 'entries': 0})
+                total['seconds'] += rollup['seconds']
+                total['entries'] += rollup['entries']
+        return sorted(totals.values(), key=lambda total: total['seconds'], reverse=True)
+
+class MemoryRevisionStore(RevisionStore):
+    def __init__(self, lock):
+        self._lock = lock
+        self._revisions = {}
+
+    def current(self, scope):
+        return self._revisions.get(scope, 0)
+
+    def allocate(self, scope, count=1):
+        with self._lock:
+            self._revisions[scope] = self._revisions.get(scope, 0) + count
+            return self._revisions[scope] - count + 1
+
+    def bump(self, *scopes):
+        with self._lock:
+            for scope in {scope for scope in scopes if scope}:
+                self._revisions[scope] = self._revisions.get(scope, 0) + 1
+
+class MemoryTombstoneStore(TombstoneStore):
+    def __init__(self, lock):
+        self._lock = lock
+        self._tombstones = []
+
+    def add_many(self, tombstones):
+        with self._lock:
+            for tombstone in tombstones:
+                bisect.insort(self._tombstones, copy.deepcopy(tombstone), key=lambda doc: doc['rev'])
+            horizon = datetime.now() - timedelta(seconds=TOMBSTONE_TTL_SECONDS)
+            self._tombstones = [doc for doc in self._tombstones if doc['deleted_at'] >= horizon]
+
+    def since(self, rev, limit, kind=None):
+        with self._lock:
+            start = bisect.bisect_right(self._tombstones, rev, key=lambda doc: doc['rev'])
+            found = self._tombstones[start:]
+            if kind is not None:
+                found = [doc for doc in found if doc['kind'] == kind]
+            return copy.deepcopy(found[:limit])
+
+class MemoryJobStore(JobStore):
+    def __init__(self, lock):
+        self._lock = lock
+        self._jobs = {}
+
+    def insert(self, job):
+        job.setdefault('_id', ObjectId())
+        horizon = datetime.now() - timedelta(seconds=JOB_TTL_SECONDS)
+        with self._lock:
+            for job_id, stored in list(self._jobs.items()):
+                if stored.get('finished_at') is not None and stored['finished_at'] < horizon:
+                    del self._jobs[job_id]
+            self._jobs[job['_id']] = copy.deepcopy(job)
+
+    def get(self, job_id):
+        with self._lock:
+            return copy.deepcopy(self._jobs.get(job_id))
+
+    def update(self, job_id, changes):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(copy.deepcopy(changes))
+
+    def claim_stale(self, before, now):
+        with self._lock:
+            for job in self._jobs.values():
+                if job['status'] in UNFINISHED and job['updated_at'] < before:
+                    job['updated_at'] = now
+                    return copy.deepcopy(job)
+        return None
+
+class MemoryStorage(Storage):
+    """Everything in process memory; data is lost when the process exits.
+
+    Meant for tests, benchmarks and single-process demos. Each worker
+    process gets its own independent data.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        lock = threading.RLock()
+        self.tasks = MemoryTaskStore(lock)
+        self.folders = MemoryFolderStore(lock)
+        self.timers = MemoryTimerStore(lock)
+        self.time_log = MemoryTimeLogStore(lock)
+        self.revisions = MemoryRevisionStore(lock)
+        self.tombstones = MemoryTombstoneStore(lock)
+        self.jobs = MemoryJobStore(lock)
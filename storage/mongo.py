@@ -0,0 +1,438 @@
+from datetime import datetime
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReadPreference, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from storage.base import Storage, TaskStore, FolderStore, TimerStore, TimeLogStore, RevisionStore, TombstoneStore, JobStore
+from timers import RUNNING, PAUSED, STOPPED, new_timer, apply_stop, upgrade_legacy_timer
+from jobs import UNFINISHED
+from time_entries import build_entry, rollup_keys
+import indexes
+
+DATABASE_NAME = 'Time2Learn'
+
+# Number of documents PyMongo pulls per getMore while iterating tasks
+FIND_BATCH_SIZE = 500
+
+# Read preferences accepted for GET routes, by their connection string names
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+def _projection(fields):
+    return {field: True for field in fields} if fields is not None else None
+
+class MongoTaskStore(TaskStore):
+    def __init__(self, collection):
+        self._tasks = collection
+
+    def insert(self, task):
+        self._tasks.insert_one(task)
+
+    def insert_many(self, tasks):
+        errors = {}
+        try:
+            # PyMongo assigns each _id client side, so every document knows
+            # its ID even when part of an unordered insert fails
+            self._tasks.insert_many(tasks, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details['writeErrors']:
+                errors[write_error['index']] = write_error['errmsg']
+        return errors
+
+    def get(self, task_id, fields=None):
+        return self._tasks.find_one({'_id': task_id}, _projection(fields))
+
+    def find(self, folder_id=None, after=None, limit=None, fields=None):
+        query = {}
+        if folder_id is not None:
+            query['folder_id'] = folder_id
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        cursor = self._tasks.find(query, _projection(fields)).sort('_id', ASCENDING).batch_size(FIND_BATCH_SIZE)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def update(self, task_id, changes):
+        return self._tasks.find_one_and_update({'_id': task_id}, {'$set': changes})
+
+    def update_many(self, updates):
+        # One query tells us which tasks exist so each update gets its own result
+        wanted = [task_id for task_id, _ in updates]
+        before = {task['_id']: task for task in self._tasks.find({'_id': {'$in': wanted}})}
+        errors = {}
+        try:
+            self._tasks.bulk_write(
+                [UpdateOne({'_id': task_id}, {'$set': changes}) for task_id, changes in updates],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            for write_error in e.details['writeErrors']:
+                errors[write_error['index']] = write_error['errmsg']
+        return before, errors
+
+    def delete(self, task_id):
+        return self._tasks.find_one_and_delete({'_id': task_id})
+
+    def delete_many(self, task_ids):
+        existing = list(self._tasks.find({'_id': {'$in': list(task_ids)}}, {'folder_id': True}))
+        if existing:
+            self._tasks.delete_many({'_id': {'$in': [task['_id'] for task in existing]}})
+        return existing
+
+    def changed_since(self, rev, limit):
+        return list(self._tasks.find({'rev': {'$gt': rev}}).sort('rev', ASCENDING).limit(limit))
+
+    def group_by_folder(self, folder_ids, limit):
+        # The sort runs on the folder_id_1__id_1 index; $firstN needs MongoDB 5.2
+        groups = self._tasks.aggregate([
+            {'$match': {'folder_id': {'$in': list(folder_ids)}}},
+            {'$sort': {'folder_id': ASCENDING, '_id': ASCENDING}},
+            {'$group': {
+                '_id': '$folder_id',
+                'count': {'$sum': 1},
+                'tasks': {'$firstN': {'input': '$$ROOT', 'n': limit}},
+            }},
+        ])
+        return {group['_id']: {'count': group['count'], 'tasks': group['tasks']} for group in groups}
+
+    def earliest(self, priority, field, limit, fields=None):
+        # Served by the priority_created_at and priority_latest_start indexes
+        query = {
+            'priority.urgent': priority['urgent'],
+            'priority.important': priority['important'],
+            field: {'$exists': True},
+        }
+        return list(self._tasks.find(query, _projection(fields)).sort(field, ASCENDING).limit(limit))
+
+    def search(self, words, folder_id=None, limit=20):
+        if not words:
+            return []
+        # Plain words, so $text matches any of them and ranks by relevance
+        query = {'$text': {'$search': ' '.join(words)}}
+        if folder_id is not None:
+            query['folder_id'] = folder_id
+        score = {'$meta': 'textScore'}
+        tasks = list(self._tasks.find(query, {'score': score}).sort([('score', score), ('_id', ASCENDING)]).limit(limit))
+        for task in tasks:
+            del task['score']
+        return tasks
+
+class MongoFolderStore(FolderStore):
+    def __init__(self, collection):
+        self._folders = collection
+
+    def insert(self, folder):
+        self._folders.insert_one(folder)
+
+    def get(self, folder_id):
+        return self._folders.find_one({'_id': folder_id})
+
+    def delete(self, folder_id):
+        return self._folders.delete_one({'_id': folder_id}).deleted_count > 0
+
+    def resolve_quadrant(self, name):
+        # Matching on name alone adopts quadrant folders created before the
+        # registry existed instead of creating a second one next to them
+        try:
+            folder = self._folders.find_one_and_update(
+                {'name': name},
+                {'$set': {'quadrant': True}, '$setOnInsert': {'created_at': datetime.now()}},
+                projection={'_id': True},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another writer inserted the folder between our match and insert
+            folder = self._folders.find_one({'name': name, 'quadrant': True}, {'_id': True})
+        return str(folder['_id'])
+
+def _seconds_between(later, earlier):
+    # Date subtraction yields milliseconds inside an aggregation expression
+    return {'$divide': [{'$subtract': [later, earlier]}, 1000]}
+
+def stop_legacy_timer(timer, now):
+    # Legacy timers left running were never stopped, so there is no real
+    # time entry to record for them
+    apply_stop(timer, now)
+    timer.pop('unlogged')
+
+class MongoTimerStore(TimerStore):
+    """Each transition is a single ``find_one_and_update`` whose filter is
+    the state precondition, so two concurrent pauses cannot both succeed,
+    and pause durations and elapsed time are computed inside the update
+    pipeline rather than from a previously read copy of the document.
+    """
+
+    def __init__(self, collection):
+        self._timers = collection
+
+    def backfill_states(self, now=None):
+        """Upgrade timers written before timers had states, see
+        ``upgrade_legacy_timer``; returns how many were upgraded.
+
+        A task may have several of them: its most recently started one
+        stays active and the others are stopped.
+        """
+        now = now or datetime.now()
+        legacy = [upgrade_legacy_timer(timer) for timer in self._timers.find({'state': {'$exists': False}})]
+        legacy.sort(key=lambda timer: timer['start_time'], reverse=True)
+        active = {timer['task_id'] for timer in self._timers.find({'active': True}, {'task_id': True})}
+        upgraded = 0
+        for timer in legacy:
+            if timer['task_id'] in active:
+                stop_legacy_timer(timer, now)
+            try:
+                result = self._timers.replace_one({'_id': timer['_id'], 'state': {'$exists': False}}, timer)
+            except DuplicateKeyError:
+                # Another process gave the task an active timer meanwhile
+                stop_legacy_timer(timer, now)
+                result = self._timers.replace_one({'_id': timer['_id'], 'state': {'$exists': False}}, timer)
+            active.add(timer['task_id'])
+            upgraded += result.modified_count
+        return upgraded
+
+    def start(self, task_id, now=None):
+        timer = new_timer(task_id, now)
+        try:
+            self._timers.insert_one(timer)
+        except DuplicateKeyError:
+            return None
+        return timer
+
+    def pause(self, task_id, now=None):
+        return self._timers.find_one_and_update(
+            {'task_id': task_id, 'active': True, 'state': RUNNING},
+            [{'$set': {'state': PAUSED, 'paused_time': now or datetime.now()}}],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def resume(self, task_id, now=None):
+        now = now or datetime.now()
+        return self._timers.find_one_and_update(
+            {'task_id': task_id, 'active': True, 'state': PAUSED},
+            [{'$set': {
+                'state': RUNNING,
+                'paused_time': None,
+                'total_pause_time': {'$add': ['$total_pause_time', _seconds_between(now, '$paused_time')]},
+            }}],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def stop(self, task_id, now=None):
+        now = now or datetime.now()
+        # A timer stopped while paused stops accruing at the moment it paused
+        current_pause = {'$cond': [
+            {'$eq': ['$state', PAUSED]},
+            _seconds_between(now, '$paused_time'),
+            0,
+        ]}
+        return self._timers.find_one_and_update(
+            {'task_id': task_id, 'active': True},
+            [
+                {'$set': {
+                    'state': STOPPED,
+                    'active': '$$REMOVE',
+                    'stopped_at': now,
+                    'unlogged': True,
+                    'paused_time': None,
+                    'total_pause_time': {'$add': ['$total_pause_time', current_pause]},
+                }},
+                {'$set': {
+                    'elapsed': {'$subtract': [_seconds_between('$stopped_at', '$start_time'), '$total_pause_time']},
+                }},
+            ],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def delete_for_tasks(self, task_ids):
+        task_ids = list(task_ids)
+        if len(task_ids) == 1:
+            self._timers.delete_many({'task_id': task_ids[0]})
+        elif task_ids:
+            self._timers.delete_many({'task_id': {'$in': task_ids}})
+
+    def mark_logged(self, timer_id):
+        self._timers.update_one({'_id': timer_id}, {'$unset': {'unlogged': ''}})
+
+    def unlogged(self, stopped_before, limit):
+        return list(self._timers.find({'unlogged': True, 'stopped_at': {'$lt': stopped_before}}).limit(limit))
+
+class MongoTimeLogStore(TimeLogStore):
+    """The entry and its rollup increments are separate writes. The entry
+    carries ``rolled_up: False`` until the increments are in, so a retry
+    finishes the job; a process dying between the increments and the flag
+    makes that retry count the entry twice, which beats losing it.
+    """
+
+    def __init__(self, entries_collection, rollups_collection):
+        self._entries = entries_collection
+        self._rollups = rollups_collection
+
+    def record(self, timer, folder_id=None, quadrant=None):
+        entry = build_entry(timer, folder_id, quadrant)
+        try:
+            self._entries.insert_one(dict(entry, rolled_up=False))
+        except DuplicateKeyError:
+            recorded = self._entries.find_one({'timer_id': entry['timer_id']})
+            if recorded is None or recorded.get('rolled_up', True):
+                return entry
+            # Count the entry as first recorded
+            entry = {field: recorded[field] for field in entry}
+        day = entry['day']
+        self._rollups.bulk_write(
+            [
+                UpdateOne(
+                    {'_id': f"{group}:{key}:{day}"},
+                    {
+                        '$inc': {'seconds': entry['elapsed'], 'entries': 1},
+                        '$setOnInsert': {'group': group, 'key': key, 'day': day},
+                    },
+                    upsert=True,
+                )
+                for group, key in rollup_keys(entry)
+            ],
+            ordered=False,
+        )
+        self._entries.update_one({'timer_id': entry['timer_id']}, {'$set': {'rolled_up': True}})
+        return entry
+
+    def totals(self, group, start_day=None, end_day=None):
+        match = {'group': group}
+        day_range = {}
+        if start_day:
+            day_range['$gte'] = start_day
+        if end_day:
+            day_range['$lte'] = end_day
+        if day_range:
+            match['day'] = day_range
+
+        pipeline = [
+            {'$match': match},
+            {'$group': {'_id': '$key', 'seconds': {'$sum': '$seconds'}, 'entries': {'$sum': '$entries'}}},
+            {'$sort': {'seconds': DESCENDING}},
+            {'$project': {'_id': 0, 'key': '$_id', 'seconds': 1, 'entries': 1}},
+        ]
+        return list(self._rollups.aggregate(pipeline))
+
+class MongoRevisionStore(RevisionStore):
+    def __init__(self, collection):
+        self._revisions = collection
+
+    def current(self, scope):
+        doc = self._revisions.find_one({'_id': scope}, {'rev': True})
+        return doc['rev'] if doc else 0
+
+    def allocate(self, scope, count=1):
+        doc = self._revisions.find_one_and_update(
+            {'_id': scope},
+            {'$inc': {'rev': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc['rev'] - count + 1
+
+    def bump(self, *scopes):
+        scopes = {scope for scope in scopes if scope}
+        if not scopes:
+            return
+        self._revisions.bulk_write(
+            [UpdateOne({'_id': scope}, {'$inc': {'rev': 1}}, upsert=True) for scope in scopes],
+            ordered=False,
+        )
+
+class MongoTombstoneStore(TombstoneStore):
+    def __init__(self, collection):
+        self._tombstones = collection
+
+    def add_many(self, tombstones):
+        self._tombstones.insert_many(tombstones)
+
+    def since(self, rev, limit, kind=None):
+        query = {'rev': {'$gt': rev}}
+        if kind is not None:
+            query['kind'] = kind
+        return list(self._tombstones.find(query, {'_id': False}).sort('rev', ASCENDING).limit(limit))
+
+class MongoJobStore(JobStore):
+    def __init__(self, collection):
+        self._jobs = collection
+
+    def insert(self, job):
+        self._jobs.insert_one(job)
+
+    def get(self, job_id):
+        return self._jobs.find_one({'_id': job_id})
+
+    def update(self, job_id, changes):
+        self._jobs.update_one({'_id': job_id}, {'$set': changes})
+
+    def claim_stale(self, before, now):
+        return self._jobs.find_one_and_update(
+            {'status': {'$in': list(UNFINISHED)}, 'updated_at': {'$lt': before}},
+            {'$set': {'updated_at': now}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+def _bind_stores(storage, db):
+    storage.tasks = MongoTaskStore(db['tasks'])
+    storage.folders = MongoFolderStore(db['folders'])
+    storage.timers = MongoTimerStore(db['timers'])
+    storage.time_log = MongoTimeLogStore(db['time_entries'], db['time_rollups'])
+    storage.revisions = MongoRevisionStore(db['revisions'])
+    storage.tombstones = MongoTombstoneStore(db['task_tombstones'])
+    storage.jobs = MongoJobStore(db['jobs'])
+
+class MongoReadStorage(Storage):
+    """A MongoStorage's stores bound to another read preference.
+
+    Shares the client, and so the connection pool, of its MongoStorage.
+    """
+
+    name = 'mongo'
+
+    def __init__(self, client, db):
+        self.client = client
+        self.db = db
+        _bind_stores(self, db)
+
+    def ping(self):
+        self.client.admin.command('ping')
+
+class MongoStorage(Storage):
+    name = 'mongo'
+
+    def __init__(self, uri, get_read_preference='primary', **client_options):
+        if get_read_preference not in READ_PREFERENCES:
+            raise ValueError(f"Unknown read preference '{get_read_preference}'. Choose one of: {', '.join(READ_PREFERENCES)}")
+        client_options.setdefault('serverSelectionTimeoutMS', 5000)
+        self.client = MongoClient(uri, **client_options)
+        self.db = self.client[DATABASE_NAME]
+        _bind_stores(self, self.db)
+        self._reader = self
+        if get_read_preference != 'primary':
+            read_db = self.db.with_options(read_preference=READ_PREFERENCES[get_read_preference])
+            self._reader = MongoReadStorage(self.client, read_db)
+
+    def for_reads(self):
+        return self._reader
+
+    def ping(self):
+        self.client.admin.command('ping')
+
+    def ensure_indexes(self):
+        return indexes.ensure_indexes(self.db)
+
+    def upgrade(self):
+        # After the indexes, so the active timer index turns away a second
+        # active timer for a task even when processes upgrade concurrently
+        return {'timers': self.timers.backfill_states()}
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,628 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from bson import json_util
+from bson.json_util import JSONOptions
+from bson.objectid import ObjectId
+from storage.base import (
+    Storage, TaskStore, FolderStore, TimerStore, TimeLogStore, RevisionStore, TombstoneStore, JobStore, project,
+)
+from jobs import UNFINISHED, JOB_TTL_SECONDS
+from search import tokenize
+from timers import RUNNING, PAUSED, STOPPED_TIMER_TTL_SECONDS, new_timer, apply_pause, apply_resume, apply_stop
+from time_entries import build_entry, rollup_keys
+from sync import TOMBSTONE_TTL_SECONDS
+
+# Documents are stored as extended JSON next to the columns that queries
+# filter or sort on, so ObjectIds and datetimes round-trip exactly as they
+# do through MongoDB (datetimes at millisecond precision).
+_JSON_OPTIONS = JSONOptions(tz_aware=False)
+
+# Sort keys of TaskStore.earliest, spelled exactly as in the indexes on
+# them. Dates are stored as extended JSON ISO strings, which julianday
+# puts in time order ("...:00Z" and "...:00.500Z" don't sort as text)
+_SCHEDULE_KEYS = {
+    field: f"""julianday(json_extract(doc, '$.{field}."$date"'))"""
+    for field in ('created_at', 'latest_start')
+}
+
+def _earliest_query(field):
+    key = _SCHEDULE_KEYS[field]
+    return f"""SELECT id, doc FROM tasks
+               WHERE json_extract(doc, '$.priority.urgent') = ?
+                 AND json_extract(doc, '$.priority.important') = ?
+                 AND {key} IS NOT NULL
+               ORDER BY {key}, id LIMIT ?"""
+
+# Rows fetched per round while iterating tasks
+FIND_BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    folder_id TEXT,
+    rev INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_folder_id ON tasks (folder_id, id);
+CREATE INDEX IF NOT EXISTS tasks_rev ON tasks (rev);
+-- TaskStore.earliest: tasks of one priority in created_at or latest_start
+-- order, on the keys in _SCHEDULE_KEYS
+CREATE INDEX IF NOT EXISTS tasks_priority_created_at ON tasks (
+    json_extract(doc, '$.priority.urgent'), json_extract(doc, '$.priority.important'),
+    julianday(json_extract(doc, '$.created_at."$date"'))
+);
+CREATE INDEX IF NOT EXISTS tasks_priority_latest_start ON tasks (
+    json_extract(doc, '$.priority.urgent'), json_extract(doc, '$.priority.important'),
+    julianday(json_extract(doc, '$.latest_start."$date"'))
+);
+
+-- Text index for search: one row per distinct word of each task's name
+CREATE TABLE IF NOT EXISTS task_words (
+    word TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    PRIMARY KEY (word, task_id)
+);
+CREATE INDEX IF NOT EXISTS task_words_task_id ON task_words (task_id);
+
+CREATE TABLE IF NOT EXISTS folders (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    quadrant INTEGER NOT NULL DEFAULT 0,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS folders_name ON folders (name);
+CREATE UNIQUE INDEX IF NOT EXISTS folders_quadrant_name ON folders (name) WHERE quadrant = 1;
+
+CREATE TABLE IF NOT EXISTS timers (
+    id TEXT PRIMARY KEY,
+    task_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    active INTEGER,
+    stopped_at TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timers_task_id ON timers (task_id, state);
+CREATE UNIQUE INDEX IF NOT EXISTS timers_active_task ON timers (task_id) WHERE active = 1;
+CREATE INDEX IF NOT EXISTS timers_stopped_at ON timers (stopped_at);
+
+CREATE TABLE IF NOT EXISTS time_entries (
+    id INTEGER PRIMARY KEY,
+    task_id TEXT NOT NULL,
+    stopped_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS time_entries_task_id ON time_entries (task_id, stopped_at);
+-- One entry per timer, so recording one again is a no-op
+CREATE UNIQUE INDEX IF NOT EXISTS time_entries_timer_id ON time_entries (json_extract(doc, '$.timer_id'));
+
+CREATE TABLE IF NOT EXISTS time_rollups (
+    grp TEXT NOT NULL,
+    key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    entries INTEGER NOT NULL,
+    PRIMARY KEY (grp, day, key)
+);
+
+CREATE TABLE IF NOT EXISTS revisions (
+    scope TEXT PRIMARY KEY,
+    rev INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tombstones (
+    rev INTEGER PRIMARY KEY,
+    deleted_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tombstones_deleted_at ON tombstones (deleted_at);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    finished_at TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+'''
+
+def _dumps(doc):
+    return json_util.dumps({key: value for key, value in doc.items() if key != '_id'}, json_options=_JSON_OPTIONS)
+
+def _loads(row_id, doc):
+    loaded = {'_id': ObjectId(row_id)} if row_id is not None else {}
+    loaded.update(json_util.loads(doc, json_options=_JSON_OPTIONS))
+    return loaded
+
+def _timestamp(value):
+    return value.isoformat(timespec='microseconds') if value is not None else None
+
+class _Database:
+    """Per-thread connections to one SQLite file in WAL mode.
+
+    Connections run in autocommit mode; multi-statement operations take
+    the write lock up front with BEGIN IMMEDIATE so they are atomic across
+    threads and processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+class SQLiteTaskStore(TaskStore):
+    def __init__(self, database):
+        self._db = database
+
+    def _insert(self, conn, task):
+        task.setdefault('_id', ObjectId())
+        conn.execute(
+            'INSERT INTO tasks (id, folder_id, rev, doc) VALUES (?, ?, ?, ?)',
+            (str(task['_id']), task.get('folder_id'), task.get('rev'), _dumps(task)),
+        )
+        self._index_words(conn, task)
+
+    def _index_words(self, conn, task):
+        conn.executemany(
+            'INSERT OR IGNORE INTO task_words (word, task_id) VALUES (?, ?)',
+            [(word, str(task['_id'])) for word in set(tokenize(task.get('name')))],
+        )
+
+    def insert(self, task):
+        with self._db.transaction() as conn:
+            self._insert(conn, task)
+
+    def insert_many(self, tasks):
+        errors = {}
+        with self._db.transaction() as conn:
+            for position, task in enumerate(tasks):
+                try:
+                    self._insert(conn, task)
+                except sqlite3.IntegrityError as e:
+                    errors[position] = str(e)
+        return errors
+
+    def _get(self, conn, task_id):
+        row = conn.execute('SELECT id, doc FROM tasks WHERE id = ?', (str(task_id),)).fetchone()
+        return _loads(*row) if row else None
+
+    def get(self, task_id, fields=None):
+        return project(self._get(self._db.connection(), task_id), fields)
+
+    def find(self, folder_id=None, after=None, limit=None, fields=None):
+        clauses = []
+        params = []
+        if folder_id is not None:
+            clauses.append('folder_id = ?')
+            params.append(folder_id)
+        if after is not None:
+            clauses.append('id > ?')
+            params.append(str(after))
+        sql = 'SELECT id, doc FROM tasks'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        cursor = self._db.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(FIND_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield project(_loads(*row), fields)
+        finally:
+            cursor.close()
+
+    def _update(self, conn, task_id, changes):
+        before = self._get(conn, task_id)
+        if before is None:
+            return None
+        task = dict(before, **changes)
+        conn.execute(
+            'UPDATE tasks SET folder_id = ?, rev = ?, doc = ? WHERE id = ?',
+            (task.get('folder_id'), task.get('rev'), _dumps(task), str(task_id)),
+        )
+        if task.get('name') != before.get('name'):
+            conn.execute('DELETE FROM task_words WHERE task_id = ?', (str(task_id),))
+            self._index_words(conn, task)
+        return before
+
+    def update(self, task_id, changes):
+        with self._db.transaction() as conn:
+            return self._update(conn, task_id, changes)
+
+    def update_many(self, updates):
+        before = {}
+        with self._db.transaction() as conn:
+            for task_id, changes in updates:
+                previous = self._update(conn, task_id, changes)
+                if previous is not None:
+                    before[task_id] = previous
+        return before, {}
+
+    def delete(self, task_id):
+        with self._db.transaction() as conn:
+            task = self._get(conn, task_id)
+            if task is not None:
+                conn.execute('DELETE FROM tasks WHERE id = ?', (str(task_id),))
+                conn.execute('DELETE FROM task_words WHERE task_id = ?', (str(task_id),))
+        return task
+
+    def delete_many(self, task_ids):
+        ids = [str(task_id) for task_id in task_ids]
+        if not ids:
+            return []
+        placeholders = ','.join('?' * len(ids))
+        with self._db.transaction() as conn:
+            rows = conn.execute(f'SELECT id, doc FROM tasks WHERE id IN ({placeholders})', ids).fetchall()
+            conn.execute(f'DELETE FROM tasks WHERE id IN ({placeholders})', ids)
+            conn.execute(f'DELETE FROM task_words WHERE task_id IN ({placeholders})', ids)
+        return [_loads(*row) for row in rows]
+
+    def changed_since(self, rev, limit):
+        rows = self._db.execute(
+            'SELECT id, doc FROM tasks WHERE rev > ? ORDER BY rev LIMIT ?', (rev, limit)
+        ).fetchall()
+        return [_loads(*row) for row in rows]
+
+    def group_by_folder(self, folder_ids, limit):
+        folder_ids = list(folder_ids)
+        if not folder_ids:
+            return {}
+        placeholders = ','.join('?' * len(folder_ids))
+        rows = self._db.execute(
+            f'''SELECT id, doc, folder_id, total FROM (
+                   SELECT id, doc, folder_id,
+                          COUNT(*) OVER (PARTITION BY folder_id) AS total,
+                          ROW_NUMBER() OVER (PARTITION BY folder_id ORDER BY id) AS position
+                   FROM tasks WHERE folder_id IN ({placeholders})
+               ) WHERE position <= ? ORDER BY folder_id, id''',
+            (*folder_ids, limit),
+        ).fetchall()
+        groups = {}
+        for row_id, doc, folder_id, total in rows:
+            group = groups.setdefault(folder_id, {'count': total, 'tasks': []})
+            group['tasks'].append(_loads(row_id, doc))
+        return groups
+
+    def earliest(self, priority, field, limit, fields=None):
+        rows = self._db.execute(_earliest_query(field), (priority['urgent'], priority['important'], limit))
+        return [project(_loads(*row), fields) for row in rows]
+
+    def search(self, words, folder_id=None, limit=20):
+        words = sorted(set(words))
+        if not words:
+            return []
+        placeholders = ','.join('?' * len(words))
+        # Ranked by how many of the words each name contains
+        sql = f'''SELECT t.id, t.doc FROM tasks t
+                  JOIN (SELECT task_id, COUNT(*) AS hits FROM task_words
+                        WHERE word IN ({placeholders}) GROUP BY task_id) m ON m.task_id = t.id'''
+        params = list(words)
+        if folder_id is not None:
+            sql += ' WHERE t.folder_id = ?'
+            params.append(folder_id)
+        sql += ' ORDER BY m.hits DESC, t.id LIMIT ?'
+        params.append(limit)
+        return [_loads(*row) for row in self._db.execute(sql, params).fetchall()]
+
+    def index_missing_words(self):
+        """Add tasks stored before the task_words table existed to it."""
+        with self._db.transaction() as conn:
+            rows = conn.execute(
+                'SELECT id, doc FROM tasks WHERE id NOT IN (SELECT task_id FROM task_words)'
+            ).fetchall()
+            for row in rows:
+                self._index_words(conn, _loads(*row))
+
+class SQLiteFolderStore(FolderStore):
+    def __init__(self, database):
+        self._db = database
+
+    def insert(self, folder):
+        folder.setdefault('_id', ObjectId())
+        self._db.execute(
+            'INSERT INTO folders (id, name, quadrant, doc) VALUES (?, ?, ?, ?)',
+            (str(folder['_id']), folder['name'], int(bool(folder.get('quadrant'))), _dumps(folder)),
+        )
+
+    def get(self, folder_id):
+        row = self._db.execute('SELECT id, doc FROM folders WHERE id = ?', (str(folder_id),)).fetchone()
+        return _loads(*row) if row else None
+
+    def delete(self, folder_id):
+        return self._db.execute('DELETE FROM folders WHERE id = ?', (str(folder_id),)).rowcount > 0
+
+    def resolve_quadrant(self, name):
+        with self._db.transaction() as conn:
+            # Prefer the flagged quadrant folder, then adopt a plain one
+            row = conn.execute(
+                'SELECT id, doc FROM folders WHERE name = ? ORDER BY quadrant DESC LIMIT 1', (name,)
+            ).fetchone()
+            if row:
+                folder = _loads(*row)
+                folder['quadrant'] = True
+                conn.execute('UPDATE folders SET quadrant = 1, doc = ? WHERE id = ?', (_dumps(folder), row[0]))
+            else:
+                folder = {'_id': ObjectId(), 'name': name, 'quadrant': True, 'created_at': datetime.now()}
+                conn.execute(
+                    'INSERT INTO folders (id, name, quadrant, doc) VALUES (?, ?, 1, ?)',
+                    (str(folder['_id']), name, _dumps(folder)),
+                )
+        return str(folder['_id'])
+
+class SQLiteTimerStore(TimerStore):
+    """Transitions read and rewrite the active timer inside one
+    BEGIN IMMEDIATE transaction, so concurrent transitions serialize and
+    the state precondition is checked against the latest row.
+    """
+
+    def __init__(self, database):
+        self._db = database
+
+    def _write(self, conn, timer):
+        conn.execute(
+            'UPDATE timers SET state = ?, active = ?, stopped_at = ?, doc = ? WHERE id = ?',
+            (timer['state'], 1 if timer.get('active') else None, _timestamp(timer.get('stopped_at')),
+             _dumps(timer), str(timer['_id'])),
+        )
+
+    def start(self, task_id, now=None):
+        timer = new_timer(task_id, now)
+        timer['_id'] = ObjectId()
+        try:
+            self._db.execute(
+                'INSERT INTO timers (id, task_id, state, active, doc) VALUES (?, ?, ?, 1, ?)',
+                (str(timer['_id']), task_id, timer['state'], _dumps(timer)),
+            )
+        except sqlite3.IntegrityError:
+            return None
+        return timer
+
+    def _transition(self, task_id, states, apply, now):
+        now = now or datetime.now()
+        placeholders = ','.join('?' * len(states))
+        with self._db.transaction() as conn:
+            row = conn.execute(
+                f'SELECT id, doc FROM timers WHERE task_id = ? AND active = 1 AND state IN ({placeholders})',
+                (task_id, *states),
+            ).fetchone()
+            if row is None:
+                return None
+            timer = _loads(*row)
+            apply(timer, now)
+            self._write(conn, timer)
+            if timer.get('stopped_at') is not None:
+                horizon = now - timedelta(seconds=STOPPED_TIMER_TTL_SECONDS)
+                conn.execute('DELETE FROM timers WHERE stopped_at < ?', (_timestamp(horizon),))
+        return timer
+
+    def pause(self, task_id, now=None):
+        return self._transition(task_id, (RUNNING,), apply_pause, now)
+
+    def resume(self, task_id, now=None):
+        return self._transition(task_id, (PAUSED,), apply_resume, now)
+
+    def stop(self, task_id, now=None):
+        return self._transition(task_id, (RUNNING, PAUSED), apply_stop, now)
+
+    def delete_for_tasks(self, task_ids):
+        ids = list(task_ids)
+        if ids:
+            placeholders = ','.join('?' * len(ids))
+            self._db.execute(f'DELETE FROM timers WHERE task_id IN ({placeholders})', ids)
+
+    def mark_logged(self, timer_id):
+        with self._db.transaction() as conn:
+            row = conn.execute('SELECT id, doc FROM timers WHERE id = ?', (str(timer_id),)).fetchone()
+            if row is not None:
+                timer = _loads(*row)
+                timer.pop('unlogged', None)
+                self._write(conn, timer)
+
+    def unlogged(self, stopped_before, limit):
+        rows = self._db.execute(
+            "SELECT id, doc FROM timers WHERE stopped_at < ? AND json_extract(doc, '$.unlogged') = 1 LIMIT ?",
+            (_timestamp(stopped_before), limit),
+        )
+        return [_loads(*row) for row in rows]
+
+class SQLiteTimeLogStore(TimeLogStore):
+    def __init__(self, database):
+        self._db = database
+
+    def record(self, timer, folder_id=None, quadrant=None):
+        entry = build_entry(timer, folder_id, quadrant)
+        with self._db.transaction() as conn:
+            inserted = conn.execute(
+                'INSERT OR IGNORE INTO time_entries (task_id, stopped_at, doc) VALUES (?, ?, ?)',
+                (entry['task_id'], _timestamp(entry['stopped_at']), _dumps(entry)),
+            ).rowcount
+            if not inserted:
+                return entry
+            conn.executemany(
+                '''INSERT INTO time_rollups (grp, key, day, seconds, entries) VALUES (?, ?, ?, ?, 1)
+                   ON CONFLICT (grp, day, key) DO UPDATE SET
+                       seconds = seconds + excluded.seconds, entries = entries + 1''',
+                [(group, key, entry['day'], entry['elapsed']) for group, key in rollup_keys(entry)],
+            )
+        return entry
+
+    def totals(self, group, start_day=None, end_day=None):
+        sql = 'SELECT key, SUM(seconds), SUM(entries) FROM time_rollups WHERE grp = ?'
+        params = [group]
+        if start_day:
+            sql += ' AND day >= ?'
+            params.append(start_day)
+        if end_day:
+            sql += ' AND day <= ?'
+            params.append(end_day)
+        sql += ' GROUP BY key ORDER BY SUM(seconds) DESC'
+        return [
+            {'key': key, 'seconds': seconds, 'entries': entries}
+            for key, seconds, entries in self._db.execute(sql, params)
+        ]
+
+class SQLiteRevisionStore(RevisionStore):
+    def __init__(self, database):
+        self._db = database
+
+    def current(self, scope):
+        row = self._db.execute('SELECT rev FROM revisions WHERE scope = ?', (scope,)).fetchone()
+        return row[0] if row else 0
+
+    def allocate(self, scope, count=1):
+        row = self._db.execute(
+            '''INSERT INTO revisions (scope, rev) VALUES (?, ?)
+               ON CONFLICT (scope) DO UPDATE SET rev = rev + excluded.rev
+               RETURNING rev''',
+            (scope, count),
+        ).fetchone()
+        return row[0] - count + 1
+
+    def bump(self, *scopes):
+        scopes = {scope for scope in scopes if scope}
+        if not scopes:
+            return
+        with self._db.transaction() as conn:
+            conn.executemany(
+                '''INSERT INTO revisions (scope, rev) VALUES (?, 1)
+                   ON CONFLICT (scope) DO UPDATE SET rev = rev + 1''',
+                [(scope,) for scope in scopes],
+            )
+
+class SQLiteTombstoneStore(TombstoneStore):
+    def __init__(self, database):
+        self._db = database
+
+    def add_many(self, tombstones):
+        horizon = datetime.now() - timedelta(seconds=TOMBSTONE_TTL_SECONDS)
+        with self._db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO tombstones (rev, deleted_at, doc) VALUES (?, ?, ?)',
+                [(doc['rev'], _timestamp(doc['deleted_at']), _dumps(doc)) for doc in tombstones],
+            )
+            conn.execute('DELETE FROM tombstones WHERE deleted_at < ?', (_timestamp(horizon),))
+
+    def since(self, rev, limit, kind=None):
+        if kind is None:
+            rows = self._db.execute('SELECT doc FROM tombstones WHERE rev > ? ORDER BY rev LIMIT ?', (rev, limit))
+        else:
+            rows = self._db.execute(
+                "SELECT doc FROM tombstones WHERE rev > ? AND json_extract(doc, '$.kind') = ? ORDER BY rev LIMIT ?",
+                (rev, kind, limit),
+            )
+        return [_loads(None, doc) for doc, in rows]
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, database):
+        self._db = database
+
+    def insert(self, job):
+        job.setdefault('_id', ObjectId())
+        horizon = datetime.now() - timedelta(seconds=JOB_TTL_SECONDS)
+        with self._db.transaction() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, updated_at, finished_at, doc) VALUES (?, ?, ?, ?, ?)',
+                (str(job['_id']), job['status'], _timestamp(job['updated_at']),
+                 _timestamp(job.get('finished_at')), _dumps(job)),
+            )
+            conn.execute('DELETE FROM jobs WHERE finished_at < ?', (_timestamp(horizon),))
+
+    def get(self, job_id):
+        row = self._db.execute('SELECT id, doc FROM jobs WHERE id = ?', (str(job_id),)).fetchone()
+        return _loads(*row) if row else None
+
+    def _write(self, conn, job):
+        conn.execute(
+            'UPDATE jobs SET status = ?, updated_at = ?, finished_at = ?, doc = ? WHERE id = ?',
+            (job['status'], _timestamp(job['updated_at']), _timestamp(job.get('finished_at')),
+             _dumps(job), str(job['_id'])),
+        )
+
+    def update(self, job_id, changes):
+        with self._db.transaction() as conn:
+            row = conn.execute('SELECT id, doc FROM jobs WHERE id = ?', (str(job_id),)).fetchone()
+            if row:
+                job = _loads(*row)
+                job.update(changes)
+                self._write(conn, job)
+
+    def claim_stale(self, before, now):
+        placeholders = ','.join('?' * len(UNFINISHED))
+        with self._db.transaction() as conn:
+            row = conn.execute(
+                f'SELECT id, doc FROM jobs WHERE status IN ({placeholders}) AND updated_at < ? LIMIT 1',
+                (*UNFINISHED, _timestamp(before)),
+            ).fetchone()
+            if row is None:
+                return None
+            job = _loads(*row)
+            job['updated_at'] = now
+            self._write(conn, job)
+        return job
+
+class SQLiteStorage(Storage):
+    """Embedded single-file database, shared safely by threads and processes."""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self._db = _Database(path)
+        self.tasks = SQLiteTaskStore(self._db)
+        self.folders = SQLiteFolderStore(self._db)
+        self.timers = SQLiteTimerStore(self._db)
+        self.time_log = SQLiteTimeLogStore(self._db)
+        self.revisions = SQLiteRevisionStore(self._db)
+        self.tombstones = SQLiteTombstoneStore(self._db)
+        self.jobs = SQLiteJobStore(self._db)
+
+    def ping(self):
+        self._db.execute('SELECT 1')
+
+    def ensure_indexes(self):
+        self._db.connection().executescript(SCHEMA)
+        self.tasks.index_missing_words()
+        return []
+
+    def close(self):
+        self._db.close()
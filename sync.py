@@ -0,0 +1,101 @@
+import time
+from datetime import datetime
+
+# Revision counter that hands out task revisions
+SYNC_SEQUENCE = 'task_seq'
+
+# How long deletes are remembered; clients that last synced earlier than
+# this are told to reset and reload the full task list
+TOMBSTONE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Revisions are allocated before the write that uses them, so a write can
+# commit after one holding a later revision. Re-reading this many revisions
+# behind the client's token lets such late commits still reach it; the
+# repeats are harmless because applying a change is idempotent.
+SYNC_OVERLAP = 100
+
+def make_sync_token(rev, issued=None):
+    return f"{rev}.{int(issued if issued is not None else time.time())}"
+
+def parse_sync_token(token):
+    """Split a sync token into ``(rev, issued)``; raises ValueError if malformed."""
+    rev, issued = token.split('.')
+    rev, issued = int(rev), int(issued)
+    if rev < 0:
+        raise ValueError(token)
+    return rev, issued
+
+class TaskChangeLog:
+    """Revision stamps and tombstones behind GET /task/changes.
+
+    Every task write stores ``rev`` from the shared SYNC_SEQUENCE counter on
+    the task itself, and every delete leaves a tombstone carrying its own
+    revision, so the changes since a token are just the tasks and
+    tombstones with a higher ``rev``.
+    """
+
+    def __init__(self, task_store, tombstone_store, revision_store):
+        self._tasks = task_store
+        self._tombstones = tombstone_store
+        self._revisions = revision_store
+
+    def next_revisions(self, count=1):
+        """Reserve revisions for ``count`` writes and return the first one."""
+        return self._revisions.allocate(SYNC_SEQUENCE, count)
+
+    def current_token(self):
+        return make_sync_token(self._revisions.current(SYNC_SEQUENCE))
+
+    def record_task_deletes(self, tasks):
+        """Leave a tombstone for each deleted task (dicts with _id and folder_id)."""
+        if not tasks:
+            return
+        rev = self.next_revisions(len(tasks))
+        now = datetime.now()
+        self._tombstones.add_many([
+            {'kind': 'task', 'task_id': str(task['_id']), 'folder_id': task.get('folder_id'), 'rev': rev + offset, 'deleted_at': now}
+            for offset, task in enumerate(tasks)
+        ])
+
+    def record_folder_delete(self, folder_id):
+        self._tombstones.add_many(
+            [{'kind': 'folder', 'folder_id': folder_id, 'rev': self.next_revisions(), 'deleted_at': datetime.now()}]
+        )
+
+    def changes(self, token, limit):
+        """Collect a page of about ``limit`` changes made after ``token``.
+
+        Returns a dict with the changed tasks, the IDs of deleted tasks and
+        folders, the token to send next time and whether more changes are
+        waiting. ``reset`` is True when the token is too old for the
+        tombstones still on record; the client must then reload everything.
+        """
+        since, issued = parse_sync_token(token)
+        if time.time() - issued > TOMBSTONE_TTL_SECONDS:
+            return {'reset': True, 'next': self.current_token()}
+
+        # At most SYNC_OVERLAP documents sit in the re-read window, so a page
+        # larger than that always makes progress past the client's token
+        limit = max(limit, 2 * SYNC_OVERLAP)
+        low = max(since - SYNC_OVERLAP, 0)
+        # Each source is fetched one past the limit; after merging by
+        # revision that is enough to tell whether anything is left over
+        tasks = self._tasks.changed_since(low, limit + 1)
+        tombstones = self._tombstones.since(low, limit + 1)
+
+        merged = sorted(tasks + tombstones, key=lambda doc: doc['rev'])
+        has_more = len(merged) > limit
+        merged = merged[:limit]
+        last_rev = max(merged[-1]['rev'], since) if merged else since
+
+        changed = [doc for doc in merged if 'kind' not in doc]
+        deleted = [doc['task_id'] for doc in merged if doc.get('kind') == 'task']
+        deleted_folders = [doc['folder_id'] for doc in merged if doc.get('kind') == 'folder']
+        return {
+            'reset': False,
+            'tasks': changed,
+            'deleted': deleted,
+            'deleted_folders': deleted_folders,
+            'next': make_sync_token(last_rev),
+            'has_more': has_more
+        }
@@ -0,0 +1,118 @@
+"""Base for in-process indexes over every task.
+
+An index is loaded from the task store on first use and then kept
+current two ways: routes in this process update it directly as they
+write, and changes made anywhere else (other workers, batch routes) are
+pulled from the task change log at most once per ``refresh_interval``.
+"""
+import threading
+import time
+
+from bson.objectid import ObjectId
+
+# Seconds between pulls of changes made elsewhere into an index
+REFRESH_SECONDS = 1.0
+
+# Changes applied per page when an index catches up
+SYNC_PAGE_SIZE = 1000
+
+class SyncedTaskIndex:
+    """Subclasses set ``fields`` (the task fields to load) and implement
+    ``_rebuild``, ``_add`` and ``_remove``, which run with ``_lock`` held.
+    """
+
+    fields = None
+    name = 'task-index'
+
+    def __init__(self, refresh_interval=REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._token = None
+        self._refreshed = 0.0
+        self._loader = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._token is not None
+
+    # Updates before the first load are dropped: the load picks up every
+    # earlier write, and catching up from its token every later one
+
+    def add(self, task):
+        """Index a new or changed task."""
+        with self._lock:
+            if self._token is not None:
+                self._add(task)
+
+    def remove(self, task_id):
+        with self._lock:
+            if self._token is not None:
+                self._remove(task_id)
+
+    def _rebuild(self, tasks):
+        raise NotImplementedError
+
+    def _add(self, task):
+        raise NotImplementedError
+
+    def _remove(self, task_id):
+        raise NotImplementedError
+
+    def sync(self, change_log, task_store, block=True):
+        """Load the index on first use, then apply changes made since.
+
+        One thread refreshes at a time; the others answer from the index
+        as it stands rather than wait. Before the first load, callers wait
+        for it, or with ``block=False`` start it in a background thread.
+        Returns whether the index is loaded.
+        """
+        if self._token is not None and time.monotonic() - self._refreshed < self.refresh_interval:
+            return True
+        if self._token is None and not block:
+            self._load_in_background(change_log, task_store)
+            return False
+        if not self._sync_lock.acquire(blocking=self._token is None):
+            return True
+        try:
+            if self._token is None:
+                self._load(change_log, task_store)
+            elif time.monotonic() - self._refreshed >= self.refresh_interval:
+                self._catch_up(change_log, task_store)
+            self._refreshed = time.monotonic()
+        finally:
+            self._sync_lock.release()
+        return True
+
+    def _load_in_background(self, change_log, task_store):
+        with self._lock:
+            if self._loader is not None and self._loader.is_alive():
+                return
+            self._loader = threading.Thread(
+                target=self.sync, args=(change_log, task_store), name=f'{self.name}-loader', daemon=True
+            )
+            self._loader.start()
+
+    def _load(self, change_log, task_store):
+        # Take the token before the listing so nothing written in between
+        # is missed; changes seen twice are simply applied again
+        token = change_log.current_token()
+        tasks = list(task_store.find(fields=self.fields))
+        with self._lock:
+            self._rebuild(tasks)
+            self._token = token
+
+    def _catch_up(self, change_log, task_store):
+        while True:
+            changes = change_log.changes(self._token, SYNC_PAGE_SIZE)
+            if changes['reset']:
+                self._load(change_log, task_store)
+                return
+            with self._lock:
+                for task in changes['tasks']:
+                    self._add(task)
+                for task_id in changes['deleted']:
+                    self._remove(ObjectId(task_id))
+                self._token = changes['next']
+            if not changes['has_more']:
+                return
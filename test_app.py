@@ -0,0 +1,467 @@
+"""Route tests, run against the app on every storage backend.
+
+Like test_storage.py, MongoDB is only included when TEST_MONGO_URI is set.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from App import create_app
+from sync import TOMBSTONE_TTL_SECONDS, make_sync_token
+
+MONGO_URI = os.environ.get('TEST_MONGO_URI')
+
+URGENT_IMPORTANT = {'urgent': True, 'important': True}
+
+@pytest.fixture(params=['memory', 'sqlite', 'mongo'])
+def app(request, tmp_path):
+    backend = request.param
+    if backend == 'mongo' and not MONGO_URI:
+        pytest.skip('TEST_MONGO_URI is not set')
+    app = create_app({
+        'STORAGE_BACKEND': backend,
+        'MONGO_URI': MONGO_URI,
+        'SQLITE_PATH': str(tmp_path / 'test.db'),
+        'LOG_LEVEL': 'WARNING',
+    })
+    database = app.extensions['database']
+    assert database.check()
+    if backend == 'mongo':
+        database.storage.client.drop_database(database.storage.db.name)
+        database.check()
+    yield app
+    database.stop_monitor()
+    if backend == 'mongo':
+        database.storage.client.drop_database(database.storage.db.name)
+    database.storage.close()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def create_tasks(client, count):
+    return [
+        client.post('/task', json={'name': f'task {i}', 'priority': URGENT_IMPORTANT}).json['_id']
+        for i in range(count)
+    ]
+
+def wait_for_job(client, job_id):
+    for _ in range(200):
+        job = client.get(f'/jobs/{job_id}').json
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+def test_stream_tasks(client):
+    ids = create_tasks(client, 3)
+
+    response = client.get('/task?stream=ndjson')
+    assert response.status_code == 200
+    assert [json.loads(line)['_id'] for line in response.text.splitlines()] == ids
+
+    response = client.get('/task?stream=array&fields=name')
+    assert [task['name'] for task in json.loads(response.text)] == ['task 0', 'task 1', 'task 2']
+
+    assert client.get('/task?stream=csv').status_code == 400
+
+def test_quadrant_folder_deleted_by_another_worker(tmp_path):
+    # Two workers sharing one database
+    config = {'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': str(tmp_path / 'shared.db'), 'LOG_LEVEL': 'WARNING'}
+    apps = [create_app(config) for _ in range(2)]
+    for app in apps:
+        assert app.extensions['database'].check()
+    first, second = (app.test_client() for app in apps)
+    second_folders = apps[1].extensions['database'].quadrant_folders
+    try:
+        old_folder = second.post('/task', json={'name': 'a', 'priority': URGENT_IMPORTANT}).json['folder_id']
+        job_id = first.delete(f'/folder/{old_folder}').json['job_id']
+        wait_for_job(first, job_id)
+
+        second_folders.refresh_interval = 0
+        new_folder = second.post('/task', json={'name': 'b', 'priority': URGENT_IMPORTANT}).json['folder_id']
+        assert new_folder != old_folder
+        assert first.post('/task', json={'name': 'c', 'priority': URGENT_IMPORTANT}).json['folder_id'] == new_folder
+        for client in (first, second):
+            assert client.get('/matrix').json['quadrants']['urgent_important']['folder_id'] == new_folder
+    finally:
+        for app in apps:
+            app.extensions['database'].stop_monitor()
+
+def test_first_request_connects_in_the_background(tmp_path, monkeypatch):
+    # What a pre-fork server's parent process does: build the app, then fork
+    app = create_app({'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': str(tmp_path / 'test.db'), 'LOG_LEVEL': 'WARNING'})
+    database = app.extensions['database']
+    assert database.storage is None
+    assert database._monitor is None
+
+    # A backend slow to answer holds up the monitor, not requests
+    answer = threading.Event()
+    connect = database.connect
+    def slow_connect():
+        assert answer.wait(5)
+        connect()
+    monkeypatch.setattr(database, 'connect', slow_connect)
+    callback_threads = []
+    database.on_healthy.append(lambda: callback_threads.append(threading.current_thread().name))
+    client = app.test_client()
+    try:
+        assert client.get('/task').status_code == 503
+        answer.set()
+        for _ in range(200):
+            if database.available and callback_threads:
+                break
+            time.sleep(0.01)
+        assert client.get('/task').status_code == 200
+        assert callback_threads[0] == 'db-health-monitor'
+    finally:
+        answer.set()
+        database.stop_monitor()
+
+def test_conditional_listings_read_the_primary(app, client):
+    # The ETag's revision comes from the primary, so the body must as well
+    folder_id = client.post('/task', json={'name': 'a', 'priority': URGENT_IMPORTANT}).json['folder_id']
+    app.extensions['database'].read_storage = None
+    for url in ('/task', '/task?stream=ndjson', '/task?limit=1', f'/folder/{folder_id}/tasks', '/matrix', '/'):
+        assert client.get(url).status_code == 200, url
+
+def test_task_name_must_be_a_string(client):
+    assert client.post('/task', json={'name': 123, 'priority': URGENT_IMPORTANT}).status_code == 400
+    response = client.post('/task/batch', json={'tasks': [{'name': 123, 'priority': URGENT_IMPORTANT}, {'name': 'ok', 'priority': URGENT_IMPORTANT}]})
+    assert response.status_code == 207
+    assert response.json['succeeded'] == 1
+    folder_id = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    assert client.post(f'/folder/{folder_id}/task', json={'name': ['x']}).status_code == 400
+
+def test_timer_needs_an_existing_task(client):
+    assert client.post('/timer/start', json={'task_id': 'not-an-id'}).status_code == 400
+    assert client.post('/timer/start', json={'task_id': '000000000000000000000000'}).status_code == 404
+    task_id = create_tasks(client, 1)[0]
+    assert client.post('/timer/start', json={'task_id': task_id}).status_code == 201
+    assert client.post('/timer/start', json={'task_id': task_id}).status_code == 409
+    assert client.post('/timer/stop', json={'task_id': task_id}).status_code == 200
+    assert client.get('/report/time?group=quadrant').json['totals'][0]['key'] == 'urgent_important'
+
+def test_delete_folder(client):
+    folder_id = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    for i in range(3):
+        client.post(f'/folder/{folder_id}/task', json={'name': f'task {i}'})
+
+    response = client.delete(f'/folder/{folder_id}')
+    assert response.status_code == 202
+    job = wait_for_job(client, response.json['job_id'])
+    assert job['status'] == 'succeeded'
+    assert job['progress']['tasks_deleted'] == 3
+    assert client.get('/task').json == []
+    assert client.delete(f'/folder/{folder_id}').status_code == 404
+
+def test_folder_kept_when_its_job_cannot_be_recorded(app, client, monkeypatch):
+    folder_id = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    client.post(f'/folder/{folder_id}/task', json={'name': 'a'})
+
+    def fail(job):
+        raise RuntimeError('jobs unavailable')
+    monkeypatch.setattr(app.extensions['database'].storage.jobs, 'insert', fail)
+    assert client.delete(f'/folder/{folder_id}').status_code == 500
+    assert client.post(f'/folder/{folder_id}/task', json={'name': 'b'}).status_code == 201
+
+def test_resumed_delete_folder_job_deletes_the_folder(app, client):
+    # The request died after recording the job, before deleting the folder
+    folder_id = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    client.post(f'/folder/{folder_id}/task', json={'name': 'a'})
+    job_runner = app.extensions['jobs']
+    job = job_runner.create('delete-folder', folder_id=folder_id)
+
+    job_runner.start(job)
+    assert wait_for_job(client, job['_id'])['status'] == 'succeeded'
+    assert client.post(f'/folder/{folder_id}/task', json={'name': 'b'}).status_code == 404
+    assert client.get('/task').json == []
+
+def test_cached_task_reflects_writes(app, client):
+    task_id = create_tasks(client, 1)[0]
+    assert client.get(f'/task/{task_id}').json['priority'] == URGENT_IMPORTANT
+    assert client.get(f'/task/{task_id}').status_code == 200
+    assert app.extensions['task_cache'].stats()['hits'] >= 1
+
+    priority = {'urgent': False, 'important': False}
+    assert client.put(f'/task/{task_id}/move', json={'priority': priority}).status_code == 200
+    assert client.get(f'/task/{task_id}').json['priority'] == priority
+    assert client.delete(f'/task/{task_id}').status_code == 200
+    assert client.get(f'/task/{task_id}').status_code == 404
+
+def test_next_from_the_index_and_the_database(app, client):
+    later = client.post('/task', json={'name': 'later', 'priority': {'urgent': False, 'important': False}}).json['_id']
+    client.post('/task', json={'name': 'now', 'priority': URGENT_IMPORTANT})
+    client.post('/task', json={'name': 'due', 'priority': {'urgent': False, 'important': True}, 'due_at': '2000-01-01T09:00:00'})
+    assert client.get('/next?n=0').status_code == 400
+
+    def ranked():
+        return [task['name'] for task in client.get('/next').json['tasks']]
+    app.config['NEXT_UP_INDEX'] = False
+    from_database = ranked()
+    assert from_database == ['due', 'now', 'later']
+
+    app.config['NEXT_UP_INDEX'] = True
+    index = app.extensions['next_up_index']
+    index.sync(app.extensions['database'].change_log, app.extensions['database'].storage.tasks)
+    assert ranked() == from_database
+    client.delete(f'/task/{later}')
+    assert ranked() == ['due', 'now']
+
+def test_events_stream(app, client):
+    response = client.get('/events', buffered=False)
+    frames = iter(response.response)
+    assert next(frames).startswith(b'retry:')
+    broker = app.extensions['event_broker']
+    assert broker.subscriber_count() == 1
+
+    task_id = create_tasks(client, 1)[0]
+    frame = next(frames).decode()
+    assert 'event: task-created\n' in frame
+    assert json.loads(frame.split('data: ')[1])['_id'] == task_id
+
+    response.close()
+    assert broker.subscriber_count() == 0
+
+def test_timer_task_id_must_be_a_string(client):
+    task_id = create_tasks(client, 1)[0]
+    assert client.post('/timer/start', json={'task_id': task_id}).status_code == 201
+    for action in ('start', 'pause', 'resume', 'stop'):
+        for bad in ({'$ne': None}, None, 5):
+            assert client.post(f'/timer/{action}', json={'task_id': bad}).status_code == 400, (action, bad)
+    # The running timer was left alone
+    assert client.post('/timer/pause', json={'task_id': task_id}).json['state'] == 'paused'
+
+def test_time_entry_lost_by_a_failed_stop_is_recorded_later(app, client, monkeypatch):
+    task_id = create_tasks(client, 1)[0]
+    client.post('/timer/start', json={'task_id': task_id})
+    database = app.extensions['database']
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError('disk I/O error')
+    with monkeypatch.context() as patch:
+        patch.setattr(database.storage.time_log, 'record', fail)
+        assert client.post('/timer/stop', json={'task_id': task_id}).status_code == 500
+    assert client.post('/timer/stop', json={'task_id': task_id}).status_code == 404
+    assert client.get('/report/time?group=task').json['totals'] == []
+
+    # Moved after the timer stopped: the time goes where the task is now
+    client.put(f'/task/{task_id}/move', json={'priority': {'urgent': False, 'important': True}})
+    monkeypatch.setattr('App.UNLOGGED_TIMER_GRACE_SECONDS', 0)
+    database.notify_healthy()
+    assert [total['key'] for total in client.get('/report/time?group=task').json['totals']] == [task_id]
+    assert client.get('/report/time?group=quadrant').json['totals'][0]['key'] == 'not_urgent_important'
+    # Recorded once, however many checks follow
+    database.notify_healthy()
+    assert client.get('/report/time?group=task').json['totals'][0]['entries'] == 1
+
+def test_next_sees_batch_created_tasks_right_away(app, client):
+    database = app.extensions['database']
+    app.extensions['next_up_index'].sync(database.change_log, database.storage.tasks)
+    client.post('/task', json={'name': 'single', 'priority': {'urgent': False, 'important': False}})
+    client.post('/task/batch', json={'tasks': [{'name': 'batched', 'priority': URGENT_IMPORTANT}]})
+    # Within the index's refresh interval, so only the routes' own updates count
+    assert [task['name'] for task in client.get('/next').json['tasks']] == ['batched', 'single']
+
+def test_prefix_search_follows_every_write_right_away(app, client):
+    database = app.extensions['database']
+    app.extensions['task_prefix_index'].sync(database.change_log, database.storage.tasks)
+
+    def found(folder_id=None):
+        url = '/task/search?mode=prefix&q=rep' + (f'&folder_id={folder_id}' if folder_id else '')
+        return sorted(task['name'] for task in client.get(url).json['tasks'])
+    tasks = client.post('/task/batch', json={'tasks': [
+        {'name': f'report {i}', 'priority': URGENT_IMPORTANT} for i in range(4)
+    ]}).json['results']
+    ids = [result['task']['_id'] for result in tasks]
+    quadrant_folder = tasks[0]['task']['folder_id']
+    assert found(quadrant_folder) == ['report 0', 'report 1', 'report 2', 'report 3']
+
+    reading = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    client.put(f'/task/{ids[0]}/move', json={'folder_id': reading})
+    client.put('/task/batch/move', json={'moves': [{'task_id': ids[1], 'folder_id': reading}]})
+    assert found(reading) == ['report 0', 'report 1']
+    assert found(quadrant_folder) == ['report 2', 'report 3']
+
+    client.delete('/task/batch', json={'task_ids': [ids[2]]})
+    assert found(quadrant_folder) == ['report 3']
+    job_id = client.delete(f'/folder/{reading}').json['job_id']
+    wait_for_job(client, job_id)
+    assert found() == ['report 3']
+
+def test_listing_etag_and_not_modified(client):
+    create_tasks(client, 2)
+    response = client.get('/task')
+    etag = response.headers['ETag']
+    assert etag
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get('/task', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    # Another representation of the same listing has its own ETag
+    assert client.get('/task?fields=name').headers['ETag'] != etag
+    assert client.get('/task?fields=name', headers={'If-None-Match': etag}).status_code == 200
+
+def test_listing_etags_change_with_every_write(client):
+    task_id = create_tasks(client, 1)[0]
+    quadrant_folder = client.get(f'/task/{task_id}').json['folder_id']
+    reading = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    other = client.post('/folder', json={'name': 'Other'}).json['_id']
+
+    def etags():
+        return {url: client.get(url).headers['ETag'] for url in ('/task', f'/folder/{quadrant_folder}/tasks', f'/folder/{reading}/tasks', f'/folder/{other}/tasks')}
+    def changed_by(write):
+        before = etags()
+        assert write().status_code < 300
+        after = etags()
+        return {url for url in before if before[url] != after[url]}
+    everything_but_other = {'/task', f'/folder/{quadrant_folder}/tasks', f'/folder/{reading}/tasks'}
+
+    assert changed_by(lambda: client.put(f'/task/{task_id}/move', json={'folder_id': reading})) == everything_but_other
+    assert changed_by(lambda: client.put('/task/batch/move', json={'moves': [{'task_id': task_id, 'priority': URGENT_IMPORTANT}]})) == everything_but_other
+    assert changed_by(lambda: client.post(f'/folder/{reading}/task', json={'name': 'b'})) == {'/task', f'/folder/{reading}/tasks'}
+    assert changed_by(lambda: client.post('/task', json={'name': 'c', 'priority': URGENT_IMPORTANT})) == {'/task', f'/folder/{quadrant_folder}/tasks'}
+    assert changed_by(lambda: client.post('/task/batch', json={'tasks': [{'name': 'd', 'priority': URGENT_IMPORTANT}]})) == {'/task', f'/folder/{quadrant_folder}/tasks'}
+    created = client.get(f'/folder/{quadrant_folder}/tasks').json[-1]['_id']
+    assert changed_by(lambda: client.delete(f'/task/{task_id}')) == {'/task', f'/folder/{quadrant_folder}/tasks'}
+    assert changed_by(lambda: client.delete('/task/batch', json={'task_ids': [created]})) == {'/task', f'/folder/{quadrant_folder}/tasks'}
+
+def test_task_changes_since_a_token(client):
+    first = client.get('/task/changes').json
+    assert first['reset'] is True
+    kept, moved, deleted = create_tasks(client, 3)
+    reading = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    archive = client.post('/folder', json={'name': 'Archive'}).json['_id']
+    client.put(f'/task/{moved}/move', json={'folder_id': reading})
+    client.delete(f'/task/{deleted}')
+    wait_for_job(client, client.delete(f'/folder/{archive}').json['job_id'])
+
+    changes = client.get(f"/task/changes?since={first['next']}").json
+    assert changes['reset'] is False
+    assert {task['_id']: task['folder_id'] for task in changes['tasks'] if task['_id'] != kept} == {moved: reading}
+    assert kept in {task['_id'] for task in changes['tasks']}
+    assert changes['deleted'] == [deleted]
+    assert changes['deleted_folders'] == [archive]
+    assert changes['has_more'] is False
+
+    # Paging: a small limit leaves more to fetch, and the token moves on
+    page = client.get(f"/task/changes?since={first['next']}&limit=1").json
+    assert page['next'] != first['next']
+
+def test_task_changes_reset_and_bad_tokens(client):
+    expired = make_sync_token(0, issued=time.time() - TOMBSTONE_TTL_SECONDS - 60)
+    response = client.get(f'/task/changes?since={expired}').json
+    assert response['reset'] is True
+    assert 'next' in response
+    for bad in ('nonsense', '-1.5', '1', 'a.b'):
+        assert client.get(f'/task/changes?since={bad}').status_code == 400, bad
+    assert client.get('/task/changes?since=0.0&limit=0').status_code == 400
+
+def test_task_changes_keep_writes_that_commit_out_of_order(app, client):
+    token = client.get('/task/changes').json['next']
+    database = app.extensions['database']
+    # A write takes its revision, then stalls while a later one commits
+    late_rev = database.change_log.next_revisions()
+    early = create_tasks(client, 1)[0]
+    changes = client.get(f'/task/changes?since={token}').json
+    assert [task['_id'] for task in changes['tasks']] == [early]
+
+    late = {'name': 'late', 'folder_id': 'f1', 'created_at': datetime.now(), 'rev': late_rev}
+    database.storage.tasks.insert(late)
+    changes = client.get(f"/task/changes?since={changes['next']}").json
+    assert str(late['_id']) in {task['_id'] for task in changes['tasks']}
+
+MISSING_ID = '000000000000000000000000'
+
+def test_batch_create(client):
+    response = client.post('/task/batch', json={'tasks': [
+        {'name': 'a', 'priority': URGENT_IMPORTANT},
+        {'name': 'b'},
+        {'name': 'c', 'priority': {'urgent': False, 'important': True}, 'estimate': -5},
+        {'name': 'd', 'priority': {'urgent': False, 'important': True}, 'due_at': '2030-01-01T09:00:00'},
+    ]})
+    assert response.status_code == 207
+    assert (response.json['succeeded'], response.json['failed']) == (2, 2)
+    results = response.json['results']
+    assert [result['index'] for result in results] == [0, 1, 2, 3]
+    assert 'error' in results[1] and 'error' in results[2]
+    created = [results[0]['task'], results[3]['task']]
+    assert [task['name'] for task in created] == ['a', 'd']
+    assert created[0]['folder_id'] != created[1]['folder_id']
+    assert sorted(task['name'] for task in client.get('/task').json) == ['a', 'd']
+
+    all_good = client.post('/task/batch', json={'tasks': [{'name': 'e', 'priority': URGENT_IMPORTANT}]})
+    assert all_good.status_code == 201
+    assert client.post('/task/batch', json={'tasks': []}).status_code == 400
+
+def test_batch_move(client):
+    first, second = create_tasks(client, 2)
+    reading = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    response = client.put('/task/batch/move', json={'moves': [
+        {'task_id': first, 'folder_id': reading},
+        {'task_id': first, 'folder_id': reading},
+        {'task_id': MISSING_ID, 'folder_id': reading},
+        {'task_id': 'not-an-id', 'folder_id': reading},
+        {'task_id': second},
+        {'task_id': second, 'priority': {'urgent': True}},
+    ]})
+    assert response.status_code == 207
+    errors = [result.get('error') for result in response.json['results']]
+    assert errors == [None, 'Duplicate task ID in batch', 'Task not found', 'Invalid ID format',
+                      "Each move needs a 'priority' or a 'folder_id'", 'Duplicate task ID in batch']
+    assert response.json['results'][0]['folder_id'] == reading
+    assert [task['_id'] for task in client.get(f'/folder/{reading}/tasks').json] == [first]
+
+    not_urgent = {'urgent': False, 'important': True}
+    response = client.put('/task/batch/move', json={'moves': [{'task_id': second, 'priority': not_urgent}]})
+    assert response.status_code == 200
+    moved = client.get(f'/task/{second}').json
+    assert moved['priority'] == not_urgent
+    assert moved['folder_id'] == response.json['results'][0]['folder_id']
+
+def test_batch_delete_removes_tasks_and_their_timers(client):
+    first, second, third = create_tasks(client, 3)
+    for task_id in (first, second):
+        assert client.post('/timer/start', json={'task_id': task_id}).status_code == 201
+    response = client.delete('/task/batch', json={'task_ids': [first, second, first, MISSING_ID, 5]})
+    assert response.status_code == 207
+    errors = [result.get('error') for result in response.json['results']]
+    assert errors == [None, None, 'Duplicate task ID in batch', 'Task not found', 'Invalid ID format']
+    assert [task['_id'] for task in client.get('/task').json] == [third]
+    for task_id in (first, second):
+        assert client.post('/timer/stop', json={'task_id': task_id}).status_code == 404
+    assert client.delete('/task/batch', json={'task_ids': [third]}).status_code == 200
+
+def test_matrix_groups_tasks_by_quadrant(client):
+    not_urgent = {'urgent': False, 'important': True}
+    client.post('/task/batch', json={'tasks': [{'name': f'now {i}', 'priority': URGENT_IMPORTANT} for i in range(3)]
+                                     + [{'name': 'later', 'priority': not_urgent}]})
+    reading = client.post('/folder', json={'name': 'Reading'}).json['_id']
+    client.post(f'/folder/{reading}/task', json={'name': 'not in a quadrant'})
+
+    matrix = client.get('/matrix?limit=2').json
+    assert matrix['limit'] == 2
+    quadrants = matrix['quadrants']
+    assert set(quadrants) == {'urgent_important', 'not_urgent_important', 'urgent_not_important', 'not_urgent_not_important'}
+    assert quadrants['urgent_important']['count'] == 3
+    assert [task['name'] for task in quadrants['urgent_important']['tasks']] == ['now 0', 'now 1']
+    assert [task['name'] for task in quadrants['not_urgent_important']['tasks']] == ['later']
+    assert (quadrants['urgent_not_important']['count'], quadrants['urgent_not_important']['tasks']) == (0, [])
+    assert client.get('/task/changes?since=' + matrix['next']).json['reset'] is False
+    assert client.get('/matrix?limit=0').status_code == 400
+
+def test_matrix_etag_changes_when_an_empty_quadrant_folder_is_deleted(client):
+    response = client.get('/matrix')
+    old_folder = response.json['quadrants']['not_urgent_not_important']['folder_id']
+    wait_for_job(client, client.delete(f'/folder/{old_folder}').json['job_id'])
+
+    response = client.get('/matrix', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+    assert response.json['quadrants']['not_urgent_not_important']['folder_id'] != old_folder
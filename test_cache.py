@@ -0,0 +1,114 @@
+"""Unit tests for ReadThroughCache."""
+import threading
+import time
+
+import pytest
+
+from cache import ReadThroughCache
+
+class BlockingLoad:
+    """A load that waits for ``release`` and counts its calls."""
+
+    def __init__(self, value='doc'):
+        self.value = value
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, key):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        if isinstance(self.value, Exception):
+            raise self.value
+        return {'_id': key, 'value': self.value}
+
+def wait_until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError('condition not met')
+
+def get_in_threads(cache, key, load, count):
+    results = [None] * count
+    def get(i):
+        try:
+            results[i] = cache.get(key, load)
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+def test_hit_returns_a_copy():
+    cache = ReadThroughCache('test')
+    cache.get(1, lambda key: {'tags': []})['tags'].append('changed')
+    assert cache.get(1, lambda key: pytest.fail('loaded twice')) == {'tags': []}
+    assert cache.stats()['hits'] == 1
+
+def test_missing_documents_are_not_cached():
+    cache = ReadThroughCache('test')
+    assert cache.get(1, lambda key: None) is None
+    assert cache.get(1, lambda key: {'found': True}) == {'found': True}
+    assert cache.stats()['misses'] == 2
+
+def test_least_recently_used_is_evicted():
+    cache = ReadThroughCache('test', max_entries=2)
+    cache.get(1, lambda key: {'n': 1})
+    cache.get(2, lambda key: {'n': 2})
+    cache.get(1, lambda key: pytest.fail('1 was evicted'))
+    cache.get(3, lambda key: {'n': 3})
+    assert cache.get(2, lambda key: {'n': 'reloaded'}) == {'n': 'reloaded'}
+    assert cache.stats()['evictions'] == 2
+
+def test_entries_expire():
+    cache = ReadThroughCache('test', ttl=0)
+    cache.get(1, lambda key: {'n': 1})
+    assert cache.get(1, lambda key: {'n': 2}) == {'n': 2}
+    assert cache.stats()['expirations'] == 1
+
+def test_invalidate():
+    cache = ReadThroughCache('test')
+    cache.get(1, lambda key: {'n': 1})
+    cache.invalidate(1, 2)
+    assert cache.get(1, lambda key: {'n': 2}) == {'n': 2}
+
+def test_concurrent_misses_share_one_load():
+    cache = ReadThroughCache('test')
+    load = BlockingLoad()
+    threads, results = get_in_threads(cache, 1, load, 5)
+    wait_until(lambda: cache.stats()['coalesced'] == 4)
+    load.release.set()
+    for thread in threads:
+        thread.join()
+    assert load.calls == 1
+    assert results == [{'_id': 1, 'value': 'doc'}] * 5
+    assert cache.get(1, lambda key: pytest.fail('not cached')) == {'_id': 1, 'value': 'doc'}
+
+def test_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache = ReadThroughCache('test')
+    load = BlockingLoad(RuntimeError('down'))
+    threads, results = get_in_threads(cache, 1, load, 3)
+    wait_until(lambda: cache.stats()['coalesced'] == 2)
+    load.release.set()
+    for thread in threads:
+        thread.join()
+    assert load.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.get(1, lambda key: {'n': 1}) == {'n': 1}
+
+def test_load_overtaken_by_an_invalidation_is_not_cached():
+    cache = ReadThroughCache('test')
+    load = BlockingLoad('before the write')
+    threads, results = get_in_threads(cache, 1, load, 2)
+    wait_until(lambda: cache.stats()['coalesced'] == 1)
+    cache.invalidate(1)
+    # A miss after the invalidation starts a load of its own
+    assert cache.get(1, lambda key: {'value': 'after the write'}) == {'value': 'after the write'}
+    load.release.set()
+    for thread in threads:
+        thread.join()
+    assert [result['value'] for result in results] == ['before the write'] * 2
+    assert cache.get(1, lambda key: pytest.fail('not cached')) == {'value': 'after the write'}
@@ -0,0 +1,152 @@
+"""Unit tests for CircuitBreaker and Database availability."""
+import logging
+
+import pytest
+from pymongo.errors import ConnectionFailure
+
+import database as database_module
+from App import create_app
+from database import CLOSED, OPEN, HALF_OPEN, CircuitBreaker, Database
+from storage.sqlite import SQLiteStorage
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(database_module.time, 'monotonic', clock)
+    return clock
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    # A success in between starts the count over
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    breaker.trip()
+    clock.now += 30
+    assert breaker.allow_request()
+    # One failure is enough while half open
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 29
+    assert not breaker.allow_request()
+
+def test_lost_trial_does_not_block_forever(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.trip()
+    clock.now += 30
+    assert breaker.allow_request()
+    # The trial's outcome is never recorded
+    clock.now += 30
+    assert breaker.allow_request()
+
+def test_check_trips_the_breaker_while_unreachable(tmp_path):
+    database = Database('sqlite', sqlite_path=str(tmp_path / 'missing' / 'test.db'))
+    assert database.status()['database'] == 'connecting'
+    assert not database.check()
+    assert database.breaker.state == OPEN
+    assert not database.allow_request()
+    assert database.status()['database'] == 'disconnected'
+
+    (tmp_path / 'missing').mkdir()
+    assert database.check()
+    assert database.breaker.state == CLOSED
+    assert database.status()['status'] == 'healthy'
+    database.storage.close()
+
+def test_failing_health_callback_is_contained(tmp_path):
+    database = Database('sqlite', sqlite_path=str(tmp_path / 'test.db'))
+    calls = []
+    def fail():
+        raise RuntimeError('callback failed')
+    database.on_healthy.extend([fail, lambda: calls.append(True)])
+    assert database.check()
+    assert calls == []
+    database.notify_healthy()
+    assert calls == [True]
+    database.storage.close()
+
+def test_child_starts_over_after_fork(tmp_path):
+    database = Database('sqlite', sqlite_path=str(tmp_path / 'test.db'),
+                        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=5))
+    assert database.check()
+    storage = database.storage
+    database.breaker.trip()
+
+    database._after_fork()
+    assert database.storage is None
+    assert database.breaker.state == CLOSED
+    assert (database.breaker.failure_threshold, database.breaker.reset_timeout) == (2, 5)
+    storage.close()
+
+def test_routes_fail_fast_once_the_circuit_opens(tmp_path, monkeypatch):
+    app = create_app({
+        'STORAGE_BACKEND': 'sqlite',
+        'SQLITE_PATH': str(tmp_path / 'test.db'),
+        'LOG_LEVEL': 'WARNING',
+        'DB_BREAKER_THRESHOLD': 2,
+    })
+    database = app.extensions['database']
+    assert database.check()
+    client = app.test_client()
+    try:
+        def unreachable(*args, **kwargs):
+            raise ConnectionFailure('unreachable')
+        monkeypatch.setattr(database.storage.tasks, 'get', unreachable)
+        task_id = '000000000000000000000000'
+        assert client.get(f'/task/{task_id}').status_code == 500
+        assert client.get(f'/task/{task_id}').status_code == 500
+        assert client.get(f'/task/{task_id}').status_code == 503
+        assert client.get('/health').json['circuit'] == OPEN
+        assert client.get('/health').status_code == 503
+
+        monkeypatch.undo()
+        assert database.check()
+        assert client.get(f'/task/{task_id}').status_code == 404
+    finally:
+        database.stop_monitor()
+        database.storage.close()
+
+def test_storage_upgrades_are_logged(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLiteStorage, 'upgrade', lambda self: {'timers': 2})
+    records = []
+    logger = logging.getLogger('test_storage_upgrades_are_logged')
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    database = Database('sqlite', sqlite_path=str(tmp_path / 'test.db'), logger=logger)
+    assert database.check()
+    assert [(record.getMessage(), record.fields) for record in records] == [('storage-upgraded', {'timers': 2})]
+    database.storage.close()
@@ -0,0 +1,46 @@
+"""Unit tests for EventBroker fan-out and subscriber overflow."""
+import json
+
+from events import SUBSCRIBER_QUEUE_SIZE, EventBroker
+
+def test_publish_reaches_every_subscriber():
+    broker = EventBroker(json.dumps)
+    first, second = broker.subscribe(), broker.subscribe()
+    assert broker.subscriber_count() == 2
+
+    broker.publish('task-created', {'name': 'a'})
+    broker.publish('task-deleted', {'name': 'a'})
+    frames = [first.get(timeout=0), first.get(timeout=0)]
+    assert frames == [
+        'id: 1\nevent: task-created\ndata: {"name": "a"}\n\n',
+        'id: 2\nevent: task-deleted\ndata: {"name": "a"}\n\n',
+    ]
+    assert [second.get(timeout=0), second.get(timeout=0)] == frames
+    assert first.get(timeout=0) is None
+
+def test_unsubscribed_get_nothing():
+    broker = EventBroker(json.dumps)
+    subscription = broker.subscribe()
+    broker.unsubscribe(subscription)
+    broker.unsubscribe(subscription)
+    broker.publish('task-created', {})
+    assert broker.subscriber_count() == 0
+    assert subscription.get(timeout=0) is None
+
+def test_subscriber_that_falls_behind_is_disconnected():
+    broker = EventBroker(json.dumps)
+    slow, fast = broker.subscribe(), broker.subscribe()
+    for i in range(SUBSCRIBER_QUEUE_SIZE):
+        broker.publish('task-created', {'i': i})
+        assert fast.get(timeout=0) is not None
+    assert not slow.overflowed
+
+    broker.publish('task-created', {'i': SUBSCRIBER_QUEUE_SIZE})
+    assert slow.overflowed
+    assert not fast.overflowed
+    assert broker.subscriber_count() == 1
+    # What was queued before the overflow can still be drained
+    assert slow.get(timeout=0).startswith('id: 1\n')
+
+    broker.publish('task-created', {})
+    assert fast.get(timeout=0) is not None
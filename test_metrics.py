@@ -0,0 +1,102 @@
+"""Unit tests for the metrics registry, the command listener and GET /metrics."""
+import re
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+from App import create_app
+from metrics import Counter, Histogram, MetricsRegistry, CommandMetrics
+
+# One sample line of the Prometheus text format: name{labels} value
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+def parse(text):
+    """``{(name, frozenset(labels)): value}`` from Prometheus text output;
+    fails the test on any line that isn't valid."""
+    samples = {}
+    declared = set()
+    assert text.endswith('\n')
+    for line in text.splitlines():
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            parts = line.split(' ', 3)
+            assert len(parts) >= 3, line
+            if parts[1] == 'TYPE':
+                assert parts[3] in ('counter', 'gauge', 'histogram'), line
+                declared.add(parts[2])
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        assert any(name == family or name.startswith(family + '_') for family in declared), line
+        samples[(name, frozenset(LABEL.findall(labels or '')))] = float(value)
+    return samples
+
+def test_render_counters_and_histograms():
+    registry = MetricsRegistry()
+    counter = registry.add(Counter('jobs_total', 'Jobs.', ('kind',)))
+    histogram = registry.add(Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0)))
+    counter.inc(('say "hi"\n',), 2)
+    histogram.observe(('/a',), 0.05)
+    histogram.observe(('/a',), 0.5)
+    histogram.observe(('/a',), 5)
+
+    samples = parse(registry.render())
+    assert samples[('jobs_total', frozenset({('kind', 'say \\"hi\\"\\n')}))] == 2
+    buckets = {le: samples[('latency_seconds_bucket', frozenset({('route', '/a'), ('le', le)}))] for le in ('0.1', '1.0', '+Inf')}
+    assert buckets == {'0.1': 1, '1.0': 2, '+Inf': 3}
+    assert samples[('latency_seconds_count', frozenset({('route', '/a')}))] == 3
+    assert samples[('latency_seconds_sum', frozenset({('route', '/a')}))] == pytest.approx(5.55)
+
+def command_event(request_id, command, duration_micros=2000):
+    name = next(iter(command))
+    return SimpleNamespace(connection_id=('db', 27017), request_id=request_id, command=command,
+                           command_name=name, duration_micros=duration_micros)
+
+def test_command_listener_times_commands_and_charges_the_request():
+    registry = MetricsRegistry()
+    listener = CommandMetrics(registry)
+    metrics._request_commands.value = {}
+    try:
+        listener.started(command_event(1, {'find': 'tasks'}))
+        listener.succeeded(command_event(1, {'find': 'tasks'}))
+        listener.started(command_event(2, {'getMore': 123, 'collection': 'tasks'}))
+        listener.failed(command_event(2, {'getMore': 123, 'collection': 'tasks'}, 5000))
+        assert metrics._request_commands.value == {('tasks', 'find'): [1, 0.002], ('tasks', 'getMore'): [1, 0.005]}
+    finally:
+        metrics._request_commands.value = None
+
+    samples = parse(registry.render())
+    assert samples[('time2learn_db_command_duration_seconds_count', frozenset({('collection', 'tasks'), ('command', 'find')}))] == 1
+    assert samples[('time2learn_db_command_failures_total', frozenset({('collection', 'tasks'), ('command', 'getMore')}))] == 1
+
+def test_requests_are_counted_and_timed(tmp_path):
+    app = create_app({'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': str(tmp_path / 'test.db'), 'LOG_LEVEL': 'WARNING'})
+    database = app.extensions['database']
+    assert database.check()
+    client = app.test_client()
+    try:
+        for _ in range(3):
+            assert client.get('/task').status_code == 200
+        assert client.get('/task/not-an-id').status_code == 400
+        assert client.get('/no/such/route').status_code == 404
+
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        samples = parse(response.text)
+        listing = frozenset({('method', 'GET'), ('route', '/task'), ('status', '200')})
+        assert samples[('time2learn_http_request_duration_seconds_count', listing)] == 3
+        assert samples[('time2learn_http_request_duration_seconds_bucket', listing | {('le', '+Inf')})] == 3
+        assert samples[('time2learn_http_request_duration_seconds_sum', listing)] > 0
+        bad_id = frozenset({('method', 'GET'), ('route', '/task/<task_id>'), ('status', '400')})
+        assert samples[('time2learn_http_request_duration_seconds_count', bad_id)] == 1
+        unmatched = frozenset({('method', 'GET'), ('route', '<unmatched>'), ('status', '404')})
+        assert samples[('time2learn_http_request_duration_seconds_count', unmatched)] == 1
+        # Only the scrape itself is still in flight
+        assert samples[('time2learn_http_requests_in_flight', frozenset({('route', '/task')}))] == 0
+        assert samples[('time2learn_http_requests_in_flight', frozenset({('route', '/metrics')}))] == 1
+    finally:
+        database.stop_monitor()
+        database.storage.close()
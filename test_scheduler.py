@@ -0,0 +1,130 @@
+"""Unit tests for the GET /next ranking and NextUpIndex."""
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+from scheduler import NextUpIndex, next_up_from_store, parse_schedule, start_by
+from storage import create_storage
+from sync import TaskChangeLog
+
+CREATED = datetime(2024, 1, 1, 9, 0)
+
+PRIORITIES = {
+    'urgent_important': {'urgent': True, 'important': True},
+    'urgent_not_important': {'urgent': True, 'important': False},
+    'not_urgent_important': {'urgent': False, 'important': True},
+    'not_urgent_not_important': {'urgent': False, 'important': False},
+}
+
+def make_task(name, quadrant='urgent_important', days=0, **schedule):
+    task = {'_id': ObjectId(), 'name': name, 'folder_id': 'f1', 'priority': PRIORITIES[quadrant],
+            'created_at': CREATED + timedelta(days=days), 'rev': 1}
+    task.update(parse_schedule(schedule))
+    return task
+
+@pytest.fixture
+def storage():
+    store = create_storage('memory')
+    store.ping()
+    yield store
+    store.close()
+
+@pytest.fixture
+def change_log(storage):
+    return TaskChangeLog(storage.tasks, storage.tombstones, storage.revisions)
+
+def loaded_index(change_log, task_store):
+    index = NextUpIndex(refresh_interval=0)
+    assert index.sync(change_log, task_store)
+    return index
+
+def names(ranked):
+    return [task['name'] for task, _ in ranked]
+
+def test_start_by():
+    assert start_by({'name': 'no priority', 'created_at': CREATED}) is None
+    assert start_by(make_task('a')) == CREATED
+    assert start_by(make_task('a', 'not_urgent_not_important')) == CREATED + timedelta(days=14)
+    # A due date counts once it is earlier than the wait horizon
+    task = make_task('a', 'not_urgent_important', due_at='2024-01-02T10:00:00', estimate=60)
+    assert start_by(task) == datetime(2024, 1, 1, 9, 0)
+
+def test_parse_schedule_rejects_bad_values():
+    for schedule in ({'estimate': 0}, {'estimate': True}, {'estimate': '60'}, {'due_at': 'tomorrow'}, {'due_at': 5}):
+        with pytest.raises(ValueError):
+            parse_schedule(schedule)
+
+def test_index_ranks_by_start_by(storage, change_log):
+    tasks = [
+        make_task('later', 'not_urgent_important'),
+        make_task('now'),
+        make_task('someday', 'not_urgent_not_important'),
+        make_task('due soon', 'not_urgent_not_important', due_at='2024-01-01T12:00:00'),
+    ]
+    unranked = make_task('no priority')
+    unranked['priority'] = None
+    storage.tasks.insert_many(tasks + [unranked])
+
+    index = loaded_index(change_log, storage.tasks)
+    assert names(index.top(10)) == ['now', 'due soon', 'later', 'someday']
+    assert names(index.top(2)) == ['now', 'due soon']
+    # Reading the top leaves the heap as it was
+    assert names(index.top(10)) == ['now', 'due soon', 'later', 'someday']
+    assert names(index.top(10)) == names(next_up_from_store(storage.tasks, 10))
+
+def test_changed_and_removed_tasks(storage, change_log):
+    first, second, third = (make_task(name, days=days) for days, name in enumerate(['first', 'second', 'third']))
+    storage.tasks.insert_many([first, second, third])
+    index = loaded_index(change_log, storage.tasks)
+
+    # The stale entry for first's old key is dropped as it surfaces
+    index.add(dict(first, created_at=CREATED + timedelta(days=5)))
+    index.remove(second['_id'])
+    assert names(index.top(10)) == ['third', 'first']
+
+    # Re-adding with an unchanged key leaves a duplicate heap entry
+    index.add(third)
+    assert names(index.top(10)) == ['third', 'first']
+
+    # Losing its priority takes a task out of the ranking
+    index.add(dict(third, priority=None))
+    assert names(index.top(10)) == ['first']
+
+def test_heap_is_compacted(storage, change_log):
+    task = make_task('busy')
+    storage.tasks.insert(task)
+    index = loaded_index(change_log, storage.tasks)
+    for days in range(500):
+        index.add(dict(task, created_at=CREATED + timedelta(days=days)))
+    assert len(index._heap) <= 2 * len(index._current) + 64
+    assert index.top(10)[0][1] == CREATED + timedelta(days=499)
+
+def test_updates_before_the_first_load_are_dropped(storage, change_log):
+    index = NextUpIndex()
+    index.add(make_task('early'))
+    assert not index.loaded
+    assert index.top(10) == []
+
+def test_sync_catches_up_with_other_writers(storage, change_log):
+    old, kept = make_task('old'), make_task('kept', days=1)
+    storage.tasks.insert_many([old, kept])
+    index = loaded_index(change_log, storage.tasks)
+
+    # Written by another worker, so only the change log tells the index
+    new = make_task('new', days=2)
+    new['rev'] = change_log.next_revisions()
+    storage.tasks.insert(new)
+    storage.tasks.delete_many([old['_id']])
+    change_log.record_task_deletes([old])
+
+    assert index.sync(change_log, storage.tasks)
+    assert names(index.top(10)) == ['kept', 'new']
+
+def test_sync_without_blocking_loads_in_the_background(storage, change_log):
+    storage.tasks.insert(make_task('a'))
+    index = NextUpIndex()
+    if not index.sync(change_log, storage.tasks, block=False):
+        index._loader.join(5)
+    assert index.loaded
+    assert names(index.top(1)) == ['a']
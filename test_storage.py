@@ -0,0 +1,358 @@
+"""Conformance suite every storage backend must pass.
+
+Runs against the memory and sqlite backends; set TEST_MONGO_URI to also
+run it against a MongoDB server (the test database is dropped afterwards).
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+from storage import create_storage
+from storage.sqlite import _earliest_query
+from timers import RUNNING, PAUSED, STOPPED
+from jobs import RUNNING as JOB_RUNNING, SUCCEEDED, new_job
+from time_entries import DAY_FORMAT
+
+MONGO_URI = os.environ.get('TEST_MONGO_URI')
+
+@pytest.fixture(params=['memory', 'sqlite', 'mongo'])
+def storage(request, tmp_path):
+    backend = request.param
+    if backend == 'mongo':
+        if not MONGO_URI:
+            pytest.skip('TEST_MONGO_URI is not set')
+        store = create_storage('mongo', mongo_uri=MONGO_URI)
+        store.client.drop_database(store.db.name)
+    else:
+        store = create_storage(backend, sqlite_path=str(tmp_path / 'test.db'))
+    store.ping()
+    assert store.ensure_indexes() == []
+    yield store
+    if backend == 'mongo':
+        store.client.drop_database(store.db.name)
+    store.close()
+
+def recent(days_ago=0):
+    # Stopped timers expire after a day, so timer tests use recent timestamps
+    return (datetime.now() - timedelta(days=days_ago)).replace(hour=9, minute=0, second=0, microsecond=0)
+
+def make_task(name, folder_id='f1', rev=1):
+    return {'name': name, 'folder_id': folder_id, 'priority': {'urgent': True, 'important': True},
+            'created_at': datetime(2024, 1, 1, 9, 30), 'rev': rev}
+
+def test_task_insert_and_get(storage):
+    task = make_task('write report')
+    storage.tasks.insert(task)
+    assert isinstance(task['_id'], ObjectId)
+
+    stored = storage.tasks.get(task['_id'])
+    assert stored == task
+    assert storage.tasks.get(task['_id'], ['name']) == {'_id': task['_id'], 'name': 'write report'}
+    assert storage.tasks.get(ObjectId()) is None
+
+def test_task_find_pages_in_id_order(storage):
+    tasks = [make_task(f't{i}', folder_id='a' if i % 2 else 'b', rev=i) for i in range(7)]
+    assert storage.tasks.insert_many(tasks) == {}
+    ids = sorted(task['_id'] for task in tasks)
+
+    assert [task['_id'] for task in storage.tasks.find()] == ids
+    assert [task['_id'] for task in storage.tasks.find(limit=3)] == ids[:3]
+    assert [task['_id'] for task in storage.tasks.find(after=ids[2], limit=3)] == ids[3:6]
+    folder_a = [task['_id'] for task in tasks if task['folder_id'] == 'a']
+    assert [task['_id'] for task in storage.tasks.find('a')] == sorted(folder_a)
+    assert list(storage.tasks.find('missing')) == []
+    assert all(set(task) == {'_id', 'rev'} for task in storage.tasks.find(fields=['rev']))
+
+    # Streaming routes close the cursor, possibly before it is exhausted
+    cursor = storage.tasks.find()
+    next(cursor)
+    cursor.close()
+
+def test_task_update_returns_previous_version(storage):
+    task = make_task('plan')
+    storage.tasks.insert(task)
+
+    before = storage.tasks.update(task['_id'], {'folder_id': 'f2', 'rev': 5})
+    assert before['folder_id'] == 'f1'
+    stored = storage.tasks.get(task['_id'])
+    assert (stored['folder_id'], stored['rev'], stored['name']) == ('f2', 5, 'plan')
+    assert storage.tasks.update(ObjectId(), {'folder_id': 'f2'}) is None
+
+def test_task_update_many_reports_existing_tasks(storage):
+    first, second = make_task('one'), make_task('two')
+    storage.tasks.insert_many([first, second])
+    missing = ObjectId()
+
+    before, errors = storage.tasks.update_many([
+        (first['_id'], {'folder_id': 'x', 'rev': 2}),
+        (missing, {'folder_id': 'x', 'rev': 3}),
+        (second['_id'], {'folder_id': 'y', 'rev': 4}),
+    ])
+    assert errors == {}
+    assert set(before) == {first['_id'], second['_id']}
+    assert before[first['_id']]['folder_id'] == 'f1'
+    assert storage.tasks.get(first['_id'])['folder_id'] == 'x'
+    assert storage.tasks.get(second['_id'])['folder_id'] == 'y'
+    assert storage.tasks.get(missing) is None
+
+def test_task_delete(storage):
+    tasks = [make_task(f't{i}') for i in range(3)]
+    storage.tasks.insert_many(tasks)
+
+    assert storage.tasks.delete(tasks[0]['_id'])['name'] == 't0'
+    assert storage.tasks.delete(tasks[0]['_id']) is None
+    deleted = storage.tasks.delete_many([tasks[1]['_id'], tasks[0]['_id']])
+    assert [task['_id'] for task in deleted] == [tasks[1]['_id']]
+    assert deleted[0]['folder_id'] == 'f1'
+    assert [task['_id'] for task in storage.tasks.find()] == [tasks[2]['_id']]
+    assert list(storage.tasks.find('f1')) == [storage.tasks.get(tasks[2]['_id'])]
+
+def test_task_changed_since(storage):
+    tasks = [make_task(f't{i}', rev=rev) for i, rev in enumerate([3, 1, 2, 5])]
+    storage.tasks.insert_many(tasks)
+
+    assert [task['rev'] for task in storage.tasks.changed_since(0, 10)] == [1, 2, 3, 5]
+    assert [task['rev'] for task in storage.tasks.changed_since(2, 1)] == [3]
+    storage.tasks.update(tasks[1]['_id'], {'rev': 6})
+    assert [task['rev'] for task in storage.tasks.changed_since(2, 10)] == [3, 5, 6]
+
+def test_task_group_by_folder(storage):
+    tasks = [make_task(f't{i}', folder_id='a' if i < 5 else 'b') for i in range(7)]
+    storage.tasks.insert_many(tasks)
+    tasks.append(make_task('elsewhere', folder_id='c'))
+    storage.tasks.insert(tasks[-1])
+
+    groups = storage.tasks.group_by_folder(['a', 'b', 'empty'], 3)
+    assert set(groups) == {'a', 'b'}
+    assert groups['a']['count'] == 5
+    assert groups['a']['tasks'] == sorted(tasks[:5], key=lambda task: task['_id'])[:3]
+    assert groups['b']['count'] == 2
+    assert [task['name'] for task in groups['b']['tasks']] == ['t5', 't6']
+
+def test_task_earliest(storage):
+    urgent = {'urgent': True, 'important': False}
+    tasks = [make_task(f't{i}') for i in range(5)]
+    for i, task in enumerate(tasks[:4]):
+        task['priority'] = urgent
+        task['created_at'] = datetime(2024, 1, 1, 10 - i)
+    tasks[0]['latest_start'] = datetime(2024, 1, 3)
+    tasks[2]['latest_start'] = datetime(2024, 1, 2)
+    storage.tasks.insert_many(tasks)
+
+    oldest = storage.tasks.earliest(urgent, 'created_at', 3, fields=['name'])
+    assert oldest == [{'_id': task['_id'], 'name': task['name']} for task in (tasks[3], tasks[2], tasks[1])]
+    # Tasks without the field are left out
+    assert [task['name'] for task in storage.tasks.earliest(urgent, 'latest_start', 5)] == ['t2', 't0']
+
+def test_task_earliest_orders_within_a_second(storage):
+    urgent = {'urgent': True, 'important': True}
+    tasks = [make_task(name) for name in ('half past', 'on the second', 'next second')]
+    for task, created_at in zip(tasks, (datetime(2024, 1, 1, 9, 30, 0, 500000), datetime(2024, 1, 1, 9, 30),
+                                        datetime(2024, 1, 1, 9, 30, 1))):
+        task['priority'] = urgent
+        task['created_at'] = created_at
+    storage.tasks.insert_many(tasks)
+    assert [task['name'] for task in storage.tasks.earliest(urgent, 'created_at', 2)] == ['on the second', 'half past']
+
+def test_sqlite_earliest_uses_its_indexes(storage):
+    if storage.name != 'sqlite':
+        pytest.skip('checks the SQLite query plan')
+    for field in ('created_at', 'latest_start'):
+        plan = storage._db.execute('EXPLAIN QUERY PLAN ' + _earliest_query(field), (1, 0, 5)).fetchall()
+        assert any(f'USING INDEX tasks_priority_{field}' in row[-1] for row in plan), plan
+
+def test_task_search_ranks_by_matching_words(storage):
+    names = ['Write the quarterly report', 'Report bug', 'Read report drafts', 'Plan the week']
+    tasks = [make_task(name, folder_id='a' if i % 2 else 'b') for i, name in enumerate(names)]
+    storage.tasks.insert_many(tasks)
+
+    found = storage.tasks.search(['quarterly', 'report'])
+    assert found[0]['name'] == 'Write the quarterly report'
+    assert {task['name'] for task in found} == set(names[:3])
+    assert [task['name'] for task in storage.tasks.search(['report'], folder_id='a')] == ['Report bug']
+    assert len(storage.tasks.search(['report'], limit=2)) == 2
+    # Whole words only
+    assert storage.tasks.search(['rep']) == []
+
+    storage.tasks.delete(tasks[1]['_id'])
+    assert 'Report bug' not in [task['name'] for task in storage.tasks.search(['report'])]
+
+def test_folders(storage):
+    folder = {'name': 'Reading', 'created_at': datetime(2024, 1, 1)}
+    storage.folders.insert(folder)
+    assert storage.folders.get(folder['_id']) == folder
+    assert storage.folders.delete(folder['_id']) is True
+    assert storage.folders.delete(folder['_id']) is False
+    assert storage.folders.get(folder['_id']) is None
+
+def test_resolve_quadrant_is_idempotent_under_concurrency(storage):
+    results = []
+
+    def resolve():
+        results.append(storage.folders.resolve_quadrant('urgent_important'))
+
+    threads = [threading.Thread(target=resolve) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(results)) == 1
+    assert isinstance(results[0], str)
+    assert storage.folders.get(ObjectId(results[0]))['name'] == 'urgent_important'
+    assert storage.folders.resolve_quadrant('not_urgent_important') != results[0]
+
+def test_timer_state_machine(storage):
+    start = recent()
+    timer = storage.timers.start('t1', start)
+    assert timer['state'] == RUNNING
+    assert storage.timers.start('t1', start) is None
+    assert storage.timers.resume('t1', start) is None
+
+    assert storage.timers.pause('t1', start + timedelta(minutes=10))['state'] == PAUSED
+    assert storage.timers.pause('t1', start + timedelta(minutes=11)) is None
+    assert storage.timers.resume('t1', start + timedelta(minutes=15))['state'] == RUNNING
+
+    stopped = storage.timers.stop('t1', start + timedelta(minutes=20))
+    assert stopped['state'] == STOPPED
+    assert stopped['elapsed'] == 15 * 60
+    assert storage.timers.stop('t1', start + timedelta(minutes=21)) is None
+    # A stopped timer frees the task for a new one
+    assert storage.timers.start('t1', start + timedelta(minutes=30))['state'] == RUNNING
+
+def test_timer_stop_while_paused_counts_time_until_pause(storage):
+    start = recent()
+    storage.timers.start('t1', start)
+    storage.timers.pause('t1', start + timedelta(minutes=5))
+    assert storage.timers.stop('t1', start + timedelta(minutes=50))['elapsed'] == 5 * 60
+
+def test_legacy_timers_are_upgraded(storage):
+    if storage.name != 'mongo':
+        pytest.skip('only MongoDB held timers from before timer states')
+    start = recent(1)
+    storage.db.timers.insert_many([
+        {'task_id': 't1', 'start_time': start, 'paused_time': None, 'total_pause_time': 0},
+        {'task_id': 't2', 'start_time': start.isoformat(), 'paused_time': (start + timedelta(minutes=5)).isoformat(), 'total_pause_time': 60},
+        # Two timers for one task: the later one stays active
+        {'task_id': 't3', 'start_time': start, 'paused_time': None, 'total_pause_time': 0},
+        {'task_id': 't3', 'start_time': start + timedelta(minutes=1), 'paused_time': None, 'total_pause_time': 0},
+    ])
+    assert storage.ensure_indexes() == []
+    assert storage.upgrade() == {'timers': 4}
+    assert storage.upgrade() == {'timers': 0}
+    # The duplicate stopped by the upgrade has no time entry to record
+    assert storage.timers.unlogged(datetime.now(), 10) == []
+
+    assert storage.timers.pause('t1', start + timedelta(minutes=1))['state'] == PAUSED
+    assert storage.timers.stop('t2', start + timedelta(minutes=20))['elapsed'] == 4 * 60
+    stopped = storage.timers.stop('t3', start + timedelta(minutes=11))
+    assert stopped['start_time'] == start + timedelta(minutes=1)
+    assert storage.timers.stop('t3') is None
+
+def test_timer_delete_for_tasks(storage):
+    storage.timers.start('t1')
+    storage.timers.start('t2')
+    storage.timers.delete_for_tasks(['t1'])
+    assert storage.timers.pause('t1') is None
+    assert storage.timers.pause('t2')['state'] == PAUSED
+
+def test_time_log_totals(storage):
+    yesterday, today = recent(1), recent()
+    for task_id, began, minutes, quadrant in [('t1', yesterday, 10, 'urgent_important'), ('t1', today, 20, 'urgent_important'),
+                                              ('t2', today, 45, 'not_urgent_important')]:
+        storage.timers.start(task_id, began)
+        timer = storage.timers.stop(task_id, began + timedelta(minutes=minutes))
+        storage.time_log.record(timer, folder_id='f1', quadrant=quadrant)
+
+    assert storage.time_log.totals('quadrant') == [
+        {'key': 'not_urgent_important', 'seconds': 45 * 60, 'entries': 1},
+        {'key': 'urgent_important', 'seconds': 30 * 60, 'entries': 2},
+    ]
+    assert storage.time_log.totals('folder') == [{'key': 'f1', 'seconds': 75 * 60, 'entries': 3}]
+    first_day, second_day = yesterday.strftime(DAY_FORMAT), today.strftime(DAY_FORMAT)
+    assert storage.time_log.totals('task', first_day, first_day) == [{'key': 't1', 'seconds': 10 * 60, 'entries': 1}]
+    assert storage.time_log.totals('day', start_day=second_day) == [{'key': second_day, 'seconds': 65 * 60, 'entries': 2}]
+
+def test_time_log_records_each_timer_once(storage):
+    start = recent()
+    storage.timers.start('t1', start)
+    timer = storage.timers.stop('t1', start + timedelta(minutes=10))
+    assert [unlogged['_id'] for unlogged in storage.timers.unlogged(start + timedelta(minutes=11), 10)] == [timer['_id']]
+    assert storage.timers.unlogged(start + timedelta(minutes=10), 10) == []
+
+    storage.time_log.record(timer, folder_id='f1')
+    # A retry, e.g. after the first attempt's response was lost
+    storage.time_log.record(timer, folder_id='f2')
+    assert storage.time_log.totals('folder') == [{'key': 'f1', 'seconds': 10 * 60, 'entries': 1}]
+
+    storage.timers.mark_logged(timer['_id'])
+    assert storage.timers.unlogged(start + timedelta(minutes=11), 10) == []
+
+def test_revisions(storage):
+    assert storage.revisions.current('tasks') == 0
+    assert storage.revisions.allocate('seq', 3) == 1
+    assert storage.revisions.allocate('seq') == 4
+    storage.revisions.bump('tasks', 'folder:a', 'tasks', None)
+    assert storage.revisions.current('tasks') == 1
+    assert storage.revisions.current('folder:a') == 1
+
+def test_revision_allocation_is_unique_across_threads(storage):
+    firsts = []
+
+    def allocate():
+        for _ in range(20):
+            firsts.append(storage.revisions.allocate('seq', 2))
+
+    threads = [threading.Thread(target=allocate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(firsts) == list(range(1, 161, 2))
+
+def test_tombstones(storage):
+    now = datetime.now()
+    storage.tombstones.add_many([
+        {'kind': 'task', 'task_id': 'a', 'folder_id': 'f1', 'rev': 4, 'deleted_at': now},
+        {'kind': 'folder', 'folder_id': 'f2', 'rev': 2, 'deleted_at': now},
+    ])
+    storage.tombstones.add_many([{'kind': 'task', 'task_id': 'b', 'folder_id': 'f1', 'rev': 7, 'deleted_at': now}])
+
+    assert [tombstone['rev'] for tombstone in storage.tombstones.since(0, 10)] == [2, 4, 7]
+    assert [tombstone['rev'] for tombstone in storage.tombstones.since(2, 1)] == [4]
+    assert storage.tombstones.since(4, 10)[0]['task_id'] == 'b'
+    assert [tombstone['rev'] for tombstone in storage.tombstones.since(0, 10, kind='task')] == [4, 7]
+    assert [tombstone['folder_id'] for tombstone in storage.tombstones.since(0, 10, kind='folder')] == ['f2']
+
+def test_jobs(storage):
+    job = new_job('delete-folder', {'folder_id': 'f1'}, now=recent(1))
+    storage.jobs.insert(job)
+    assert isinstance(job['_id'], ObjectId)
+    assert storage.jobs.get(job['_id']) == job
+    assert storage.jobs.get(ObjectId()) is None
+
+    storage.jobs.update(job['_id'], {'status': JOB_RUNNING, 'progress': {'tasks_deleted': 500}})
+    stored = storage.jobs.get(job['_id'])
+    assert stored['status'] == JOB_RUNNING
+    assert stored['progress'] == {'tasks_deleted': 500}
+    assert stored['params'] == {'folder_id': 'f1'}
+
+def test_jobs_claim_stale_once(storage):
+    stale = new_job('delete-folder', {'folder_id': 'f1'}, now=recent(1))
+    fresh = new_job('delete-folder', {'folder_id': 'f2'})
+    done = new_job('delete-folder', {'folder_id': 'f3'}, now=recent(1))
+    done.update(status=SUCCEEDED, finished_at=recent(1))
+    for job in (stale, fresh, done):
+        storage.jobs.insert(job)
+
+    now = datetime.now().replace(microsecond=0)
+    before = now - timedelta(minutes=5)
+    claimed = storage.jobs.claim_stale(before, now)
+    assert claimed['_id'] == stale['_id']
+    assert claimed['updated_at'] == storage.jobs.get(stale['_id'])['updated_at'] == now
+    # Claiming touched it, so it is no longer stale
+    assert storage.jobs.claim_stale(before, now) is None
@@ -0,0 +1,28 @@
+# Dimensions the rollups are kept for; every rollup is also split by day
+ROLLUP_GROUPS = ('task', 'folder', 'quadrant', 'day')
+
+DAY_FORMAT = '%Y-%m-%d'
+
+# Every stopped timer becomes one time entry. At the same time the rollups
+# get an increment for each group in ROLLUP_GROUPS, keyed by the day the
+# timer stopped, so reports sum a handful of rollups instead of
+# aggregating raw entries.
+
+def build_entry(timer, folder_id=None, quadrant=None):
+    return {
+        'timer_id': timer['_id'],
+        'task_id': timer['task_id'],
+        'folder_id': folder_id,
+        'quadrant': quadrant,
+        'start_time': timer['start_time'],
+        'stopped_at': timer['stopped_at'],
+        'total_pause_time': timer['total_pause_time'],
+        'elapsed': timer['elapsed'],
+        'day': timer['stopped_at'].strftime(DAY_FORMAT)
+    }
+
+def rollup_keys(entry):
+    """``(group, key)`` of every rollup an entry counts towards."""
+    keys = {'task': entry['task_id'], 'folder': entry['folder_id'], 'quadrant': entry['quadrant'], 'day': entry['day']}
+    # Tasks added straight to a folder have no priority, hence no quadrant
+    return [(group, key) for group, key in keys.items() if key is not None]
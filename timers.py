@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+RUNNING = 'running'
+PAUSED = 'paused'
+STOPPED = 'stopped'
+
+# Name of the partial unique index (declared in indexes.py) that allows at
+# most one running or paused timer per task
+ACTIVE_TIMER_INDEX_NAME = 'task_id_active_unique'
+
+# Stopped timers are only kept long enough to read back
+STOPPED_TIMER_TTL_SECONDS = 24 * 60 * 60
+
+# A stopped timer whose time entry is still unrecorded this long after it
+# stopped is taken to have lost its request, and is recorded again
+UNLOGGED_TIMER_GRACE_SECONDS = 60
+
+# A timer is ``running`` -> ``paused`` <-> ``running`` -> ``stopped``.
+# Running and paused timers carry ``active: True`` so a partial unique
+# index on ``task_id`` rejects a second active timer for the same task.
+# The helpers below apply a transition to a timer in memory; backends that
+# cannot compute it inside the database run them under their own lock or
+# transaction.
+#
+# Stopping a timer and recording its time entry are separate writes, so a
+# stopped timer carries ``unlogged: True`` until its entry is recorded;
+# that is what lets an entry lost to a failed request be recorded later.
+
+def new_timer(task_id, now=None):
+    return {
+        'task_id': task_id,
+        'state': RUNNING,
+        'active': True,
+        'start_time': now or datetime.now(),
+        'paused_time': None,
+        'total_pause_time': 0
+    }
+
+def apply_pause(timer, now):
+    timer['state'] = PAUSED
+    timer['paused_time'] = now
+
+def apply_resume(timer, now):
+    timer['total_pause_time'] += (now - timer['paused_time']).total_seconds()
+    timer['state'] = RUNNING
+    timer['paused_time'] = None
+
+def apply_stop(timer, now):
+    # A timer stopped while paused stops accruing at the moment it paused
+    if timer['state'] == PAUSED:
+        timer['total_pause_time'] += (now - timer['paused_time']).total_seconds()
+    timer['state'] = STOPPED
+    timer.pop('active', None)
+    timer['stopped_at'] = now
+    timer['unlogged'] = True
+    timer['paused_time'] = None
+    timer['elapsed'] = (now - timer['start_time']).total_seconds() - timer['total_pause_time']
+
+def upgrade_legacy_timer(timer):
+    """Give a timer written before timers had states its ``state`` and
+    ``active`` flag.
+
+    Such timers were deleted when stopped, so each one is running, or
+    paused if it has a ``paused_time``; their times may be ISO strings.
+    """
+    for field in ('start_time', 'paused_time'):
+        if isinstance(timer.get(field), str):
+            timer[field] = datetime.fromisoformat(timer[field].rstrip('Z'))
+    timer.setdefault('paused_time', None)
+    timer['total_pause_time'] = timer.get('total_pause_time') or 0
+    timer['state'] = PAUSED if timer['paused_time'] else RUNNING
+    timer['active'] = True
+    return timer
+
+def serialize_timer(timer):
+    timer.pop('active', None)
+    timer.pop('unlogged', None)
+    if 'elapsed' in timer:
+        timer['total_time'] = str(timedelta(seconds=timer['elapsed']))
+    return timer